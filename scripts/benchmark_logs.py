@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Measures how fast `story logs` renders lines, against a local websocket
+stub of the log server.
+
+    python scripts/benchmark_logs.py [--lines 1000000] [--output ndjson]
+
+Output is written to /dev/null, so that the terminal isn't what's measured.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import websockets
+
+PORT = 8765
+
+
+def serve(lines, ready):
+    """Runs a log server stub, which sends `lines` log lines per filter."""
+    start_ts = int(time.time() * 1000)
+    levels = ('debug', 'info', 'warning', 'error')
+    messages = [
+        json.dumps({
+            'ts': start_ts + i,
+            'level': levels[i % len(levels)],
+            'service_name': f'service_{i % 8}',
+            'message': f'Processed request {i} in {i % 97}ms',
+        })
+        for i in range(lines)
+    ]
+
+    async def handler(websocket, path=None):
+        await websocket.recv()  # Auth.
+        await websocket.send(json.dumps({'authorised': True}))
+
+        while True:
+            command = json.loads(await websocket.recv())
+            if command['command'] == 'filter':
+                break
+
+        for message in messages:
+            await websocket.send(message)
+
+    async def main():
+        async with websockets.serve(handler, 'localhost', PORT):
+            ready.set()
+            await asyncio.Future()
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--output', default='pretty',
+                        choices=('pretty', 'ndjson', 'raw'))
+    options = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=serve, args=(options.lines, ready), daemon=True
+    )
+    server.start()
+    ready.wait()
+
+    from story import cli
+    from story.commands import logs
+
+    cli.data = {'access_token': 'benchmark'}
+    logs.SS_LOGS = f'ws://localhost:{PORT}'
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.perf_counter()
+        asyncio.get_event_loop().run_until_complete(
+            logs.connect_and_listen_once(
+                'app_id', options.lines, False, False, True, '*', 'debug',
+                options.output,
+            )
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    server.terminate()
+    print(f'{options.lines} lines in {elapsed:.2f}s '
+          f'({options.lines / elapsed:,.0f} lines/s)')
+
+
+if __name__ == '__main__':
+    main()
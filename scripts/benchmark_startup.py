@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Times how long `story --version` and `story apps url` take to start.
+
+    python scripts/benchmark_startup.py [--runs 20] [--budget 250]
+
+Exits with 1 if the median time of a command is over the budget (in ms),
+so that it can be used to catch startup time regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+COMMANDS = {
+    'story --version': ['--version'],
+    'story apps url': ['apps', 'url', '--app', 'benchmark'],
+}
+
+
+def time_command(args, config_path, env, runs):
+    # Log in with a dummy user, and don't check for updates.
+    args = ['--config_path', config_path, '--disable-version-check', *args]
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-m', 'story.main', *args],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Maximum median startup time, in ms')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        config_path = os.path.join(home, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump({'id': 'benchmark', 'access_token': 'benchmark'}, f)
+
+        env = dict(
+            os.environ,
+            HOME=home,
+            XDG_CACHE_HOME=home,
+            XDG_STATE_HOME=home,
+            TOXENV='benchmark',
+        )
+
+        over_budget = False
+        for name, args in COMMANDS.items():
+            timings = time_command(args, config_path, env, options.runs)
+            median = statistics.median(timings)
+            print(f'{name:<20} median {median:7.1f}ms  '
+                  f'min {min(timings):7.1f}ms  max {max(timings):7.1f}ms')
+
+            if options.budget is not None and median > options.budget:
+                over_budget = True
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tracking events are appended to a local spool, rather than sent straight
+away, and the spool is drained by a single background sender once the
+command exits.
+"""
+import atexit
+import json
+import os
+import sys
+
+from . import storage, utils
+
+try:
+    import fcntl
+except ImportError:  # Windows.
+    fcntl = None
+
+TRACK_EVENT_URL = 'https://stories.storyscriptapp.com/track/event'
+TRACK_PROFILE_URL = 'https://stories.storyscriptapp.com/track/profile'
+
+SPOOL_PATH = os.path.join(storage.CACHE_DIR, 'analytics.ndjson')
+MAX_SPOOL_SIZE = 256 * 1024
+REQUEST_TIMEOUT = 5
+
+_sender_scheduled = False
+
+
+def record(url, json_data):
+    """Spools an event, dropping (but counting) it if the spool is full."""
+    line = json.dumps({'url': url, 'json': json_data}) + '\n'
+
+    try:
+        size = os.path.getsize(SPOOL_PATH)
+    except OSError:
+        size = 0
+
+    if size + len(line) > MAX_SPOOL_SIZE:
+        dropped = storage.cache.fetch('analytics-dropped', 0)
+        storage.cache.store('analytics-dropped', dropped + 1)
+        return
+
+    os.makedirs(os.path.dirname(SPOOL_PATH), exist_ok=True)
+
+    # A single appended write, so that events spooled by concurrent
+    # commands don't interleave.
+    with open(SPOOL_PATH, 'a') as f:
+        f.write(line)
+
+    _schedule_sender()
+
+
+def _schedule_sender():
+    global _sender_scheduled
+
+    if not _sender_scheduled:
+        _sender_scheduled = True
+        atexit.register(
+            utils.spawn_detached, [sys.executable, '-m', 'story.analytics']
+        )
+
+
+def _spooled_events(path) -> list:
+    events = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass  # A partially written event.
+    except OSError:
+        pass
+
+    return events
+
+
+def send(session):
+    """
+    Sends the spooled events, and the number of dropped events, over the
+    session's pooled connection. Returns without sending anything if
+    another sender is already at it.
+    """
+    os.makedirs(os.path.dirname(SPOOL_PATH), exist_ok=True)
+
+    with open(f'{SPOOL_PATH}.lock', 'a') as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+
+        # Take the spool over, so that new events go to a new one. If a
+        # previous sender died, its events are sent first.
+        sending = f'{SPOOL_PATH}.sending'
+        if not os.path.exists(sending) and os.path.exists(SPOOL_PATH):
+            os.replace(SPOOL_PATH, sending)
+
+        events = _spooled_events(sending)
+
+        dropped = storage.cache.fetch('analytics-dropped', 0)
+        if dropped and events:
+            events.append({
+                'url': TRACK_EVENT_URL,
+                'json': {
+                    'id': events[-1]['json'].get('id'),
+                    'event_name': 'Analytics Events Dropped',
+                    'event_props': {'Count': dropped},
+                },
+            })
+            storage.cache.delete('analytics-dropped')
+
+        for event in events:
+            try:
+                session.post(
+                    event['url'], json=event['json'], timeout=REQUEST_TIMEOUT
+                )
+            except Exception:
+                # Ignore issues with tracking.
+                pass
+
+        if os.path.exists(sending):
+            os.remove(sending)
+
+
+if __name__ == '__main__':
+    # Run detached, once a command which tracked events exits.
+    import requests
+
+    storage.init_storage()
+    send(requests.Session())
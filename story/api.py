@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import re
 import sys
 from json import dumps
 from urllib.error import URLError
@@ -8,14 +9,23 @@ import click
 
 import requests
 
-from . import cli, storage
+from . import cli, storage, transport
 from .environment import SS_GRAPHQL
 
+APP_UUID_EXPIRES = 60 * 60 * 24 * 7
+APP_MISSING_EXPIRES = 60 * 5
+
+RELEASES_PAGE_SIZE = 100
+
+# Release states which are yet to settle.
+PENDING_STATES = ('QUEUED', 'DEPLOYING')
+
 
 def graphql(query, **variables):
     try:
-        res = requests.post(
+        res = transport.post(
             SS_GRAPHQL,
+            idempotent=not query.lstrip().startswith('mutation'),
             data=dumps({'query': query, 'variables': variables}),
             headers={
                 'Content-Type': 'application/json',
@@ -38,6 +48,8 @@ def graphql(query, **variables):
 
     data = res.json()
     if 'errors' in data:
+        Apps.forget_cached_uuids()
+
         click.echo()
         for error in data['errors']:
             click.echo(
@@ -48,10 +60,133 @@ def graphql(query, **variables):
     return data
 
 
+def _query(batch, parse, query, **variables):
+    """
+    Runs the query and returns its parsed result, or, if a batch is given,
+    adds the query to it and returns the pending result.
+    """
+    if batch is not None:
+        return batch.add(parse, query, **variables)
+
+    return parse(graphql(query, **variables))
+
+
+class Pending:
+    """The result of a query added to a Batch, available once it's sent."""
+
+    def __init__(self, parse):
+        self.parse = parse
+        self.result = None
+
+
+class Batch:
+    """
+    Coalesces queries into a single GraphQL document, which is sent when
+    the batch exits (or on send()). Identical queries are only sent once.
+
+        with Batch() as batch:
+            config = Config.get(app, batch=batch)
+            enabled = Apps.maintenance(app, maintenance=None, batch=batch)
+
+        config.result, enabled.result
+
+    Every query must select a single top-level field. Queries and
+    mutations can't share a document, so they're sent separately.
+    """
+
+    _operation = re.compile(
+        r'^\s*(?P<kind>query|mutation)\s*'
+        r'(?:\((?P<variables>[^)]*)\))?\s*{(?P<selection>.*)}\s*$',
+        re.DOTALL,
+    )
+    _field = re.compile(r'^\s*(?:(?P<alias>\w+)\s*:\s*)?(?P<name>\w+)')
+
+    def __init__(self):
+        self._operations = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+    def add(self, parse, query, **variables) -> Pending:
+        key = (query, dumps(variables, sort_keys=True))
+        if key not in self._operations:
+            self._operations[key] = (query, variables, Pending(parse))
+
+        return self._operations[key][2]
+
+    def send(self):
+        operations, self._operations = list(self._operations.values()), {}
+
+        for kind in ('query', 'mutation'):
+            self._send([
+                op for op in operations
+                if self._operation.match(op[0])['kind'] == kind
+            ])
+
+    def _send(self, operations):
+        if len(operations) == 0:
+            return
+
+        if len(operations) == 1:
+            query, variables, pending = operations[0]
+            pending.result = pending.parse(graphql(query, **variables))
+            return
+
+        kind = None
+        declarations, selections, keys, variables = [], [], [], {}
+        for i, (query, op_variables, _) in enumerate(operations):
+            match = self._operation.match(query)
+            kind = match['kind']
+            prefix = f'op{i}_'
+
+            def rename(text):
+                return re.sub(r'\$(\w+)', rf'${prefix}\1', text)
+
+            if match['variables']:
+                declarations.append(rename(match['variables'].strip()))
+
+            # Alias the top-level field, so that it can't clash with others.
+            selection = rename(match['selection']).strip()
+            field = self._field.match(selection)
+            keys.append(field['alias'] or field['name'])
+            selections.append(
+                f'op{i}: {field["name"]}{selection[field.end():]}'
+            )
+
+            for name, value in op_variables.items():
+                variables[prefix + name] = value
+
+        if declarations:
+            kind += f'({", ".join(declarations)})'
+
+        res = graphql(
+            kind + '{\n' + '\n'.join(selections) + '\n}', **variables
+        )
+
+        for i, (key, (_, _, pending)) in enumerate(zip(keys, operations)):
+            try:
+                op_res = {'data': {key: res['data'][f'op{i}']}}
+            except (KeyError, TypeError):
+                op_res = res
+            pending.result = pending.parse(op_res)
+
+
 class Config:
     @staticmethod
-    def get(app: str):
-        res = graphql(
+    def get(app: str, batch: Batch = None):
+        def parse(res):
+            try:
+                return res['data']['allReleases']['nodes'][0]['config'] or {}
+            except:
+                return {}
+
+        return _query(
+            batch,
+            parse,
             """
             query($app: UUID!){
               allReleases(condition: {appUuid: $app},
@@ -64,10 +199,6 @@ class Config:
             """,
             app=Apps.get_uuid_from_hostname(app),
         )
-        try:
-            return res['data']['allReleases']['nodes'][0]['config'] or {}
-        except:
-            return {}
 
     @staticmethod
     def set(config: {}, app: str, message: str) -> dict:
@@ -78,27 +209,86 @@ class Config:
 
 class Releases:
     @staticmethod
-    def list(app: str, limit: int):
-        res = graphql(
-            """
-            query($app: UUID!){
-              allReleases(condition: {appUuid: $app},
-                        first: 30, orderBy: ID_DESC){
-                nodes{
+    def pages(app: str, limit: int = None, before: int = None,
+              after: int = None, page_size: int = None,
+              with_config: bool = False):
+        """
+        Yields the app's releases a page at a time, as they're fetched, up
+        to `limit` releases (or all of them). That's the latest ones, or
+        the ones before or after a version (ids are exclusive bounds).
+
+        Releases come newest first, except after a version only, where the
+        ones right after it come first.
+        """
+        # Version ranges need the API's connection filters, so plain
+        # listings don't use them.
+        id_filter = {}
+        if before is not None:
+            id_filter['lessThan'] = before
+        if after is not None:
+            id_filter['greaterThan'] = after
+
+        order = 'ID_ASC' if after is not None and before is None else 'ID_DESC'
+        declarations = '$app: UUID!, $first: Int!, $cursor: Cursor'
+        arguments = 'condition: {appUuid: $app}'
+        variables = {}
+        if id_filter:
+            declarations += ', $filter: ReleaseFilter'
+            arguments += ', filter: $filter'
+            variables['filter'] = {'id': id_filter}
+
+        config = '\n                  config' if with_config else ''
+        query = f"""
+            query({declarations}){{
+              allReleases({arguments},
+                          first: $first, after: $cursor, orderBy: {order}){{
+                nodes{{
                   id
                   message
                   timestamp
-                  state
-                }
-              }
-            }
-            """,
-            app=Apps.get_uuid_from_hostname(app),
-        )
-        try:
-            return res['data']['allReleases']['nodes']
-        except:
-            return []
+                  state{config}
+                }}
+                pageInfo{{
+                  hasNextPage
+                  endCursor
+                }}
+              }}
+            }}
+            """
+
+        page_size = page_size or RELEASES_PAGE_SIZE
+        app_uuid = Apps.get_uuid_from_hostname(app)
+        cursor = None
+        while limit is None or limit > 0:
+            res = graphql(
+                query,
+                app=app_uuid,
+                first=page_size if limit is None else min(limit, page_size),
+                cursor=cursor,
+                **variables,
+            )
+            try:
+                connection = res['data']['allReleases']
+                nodes = connection['nodes']
+            except (KeyError, TypeError):
+                return
+
+            yield nodes
+
+            if limit is not None:
+                limit -= len(nodes)
+            if not nodes or not connection['pageInfo']['hasNextPage']:
+                return
+
+            cursor = connection['pageInfo']['endCursor']
+
+    @staticmethod
+    def list(app: str, limit: int, before: int = None, after: int = None):
+        return [
+            release
+            for page in Releases.pages(app, limit, before, after)
+            for release in page
+        ]
 
     @staticmethod
     def rollback(version: str, app: str):
@@ -126,8 +316,16 @@ class Releases:
         )
 
     @staticmethod
-    def get(app: str):
-        res = graphql(
+    def get(app: str, batch: Batch = None):
+        def parse(res):
+            try:
+                return res['data']['allReleases']['nodes']
+            except:
+                return []
+
+        return _query(
+            batch,
+            parse,
             """
             query($app: UUID!){
               allReleases(condition: {appUuid: $app},
@@ -141,10 +339,6 @@ class Releases:
             """,
             app=Apps.get_uuid_from_hostname(app),
         )
-        try:
-            return res['data']['allReleases']['nodes']
-        except:
-            return []
 
     @staticmethod
     def create(config: {}, payload: {}, app: str, message: str,
@@ -184,37 +378,48 @@ class Releases:
 
 class Apps:
     _hostname_to_uuid = {}
+    _resolved_from_cache = set()
 
     @staticmethod
     def get_uuid_from_hostname(app: str) -> str:
         """
-        This method also caches all queries made, but only during the current
-        CLI session.
-        """
-        cache_key = f'app-{app}'
-        the_uuid = None
+        Resolves an app's UUID from its hostname.
 
-        if cache_key in storage.cache:
-            the_uuid = storage.cache.fetch(cache_key)
+        Lookups are memoized for the current CLI session, and persisted in
+        the cache (misses included) across sessions, so that a warm lookup
+        does not hit the network at all. Pass --no-cache to bypass the cache.
+        """
+        if app in Apps._hostname_to_uuid:
+            return Apps._hostname_to_uuid[app]
 
-        if not the_uuid:
-            the_uuid = Apps._hostname_to_uuid.get(app)
+        cache_key = f'app-uuid-{app}'
 
-        # Cache the app's UUID.
-        if cache_key not in storage.cache:
-            storage.cache.store(cache_key, the_uuid)
+        if cli.use_cache and cache_key in storage.cache:
+            app_uuid = storage.cache.fetch(cache_key)
+            Apps._resolved_from_cache.add(app)
+        else:
+            res = graphql(
+                """
+                query($app: Hostname!){
+                  app: appDnsByHostname(hostname: $app){
+                    appUuid
+                  }
+                }
+                """,
+                app=app,
+            )
+            app_uuid = None
+            if res['data']['app'] is not None:
+                app_uuid = res['data']['app']['appUuid']
+
+            # Missing apps are cached too, but not for as long.
+            storage.cache.store(
+                cache_key,
+                app_uuid,
+                expires=APP_UUID_EXPIRES if app_uuid else APP_MISSING_EXPIRES,
+            )
 
-        res = graphql(
-            """
-            query($app: Hostname!){
-              app: appDnsByHostname(hostname: $app){
-                appUuid
-              }
-            }
-            """,
-            app=app,
-        )
-        if res['data']['app'] is None:
+        if app_uuid is None:
             click.echo()
             click.echo(
                 click.style(
@@ -226,15 +431,45 @@ class Apps:
             )
             sys.exit(1)
 
-        app_uuid = res['data']['app']['appUuid']
         Apps._hostname_to_uuid[app] = app_uuid
 
         return app_uuid
 
     @staticmethod
-    def maintenance(app: str, maintenance: bool):
+    def forget_uuid(app: str):
+        """Drops the app's UUID from the session memo and the cache."""
+        Apps._hostname_to_uuid.pop(app, None)
+        Apps._resolved_from_cache.discard(app)
+
+        cache_key = f'app-uuid-{app}'
+        if cache_key in storage.cache:
+            storage.cache.delete(cache_key)
+
+    @staticmethod
+    def forget_cached_uuids():
+        """
+        Drops every UUID which was served from the cache during this session.
+        Called when the API reports an error, since a stale UUID (e.g. the
+        app was destroyed and re-created) surfaces as one.
+        """
+        for app in list(Apps._resolved_from_cache):
+            Apps.forget_uuid(app)
+
+    @staticmethod
+    def maintenance(app: str, maintenance: bool, batch: Batch = None):
         if maintenance is None:
-            res = graphql(
+            def parse(res):
+                stale = app in Apps._resolved_from_cache
+                if res['data']['app'] is None and stale:
+                    # The cached UUID no longer points to an app.
+                    Apps.forget_uuid(app)
+                    return Apps.maintenance(app, maintenance)
+
+                return res['data']['app']['maintenance']
+
+            return _query(
+                batch,
+                parse,
                 """
                 query($app: UUID!){
                   app: appByUuid(uuid: $app){
@@ -244,7 +479,6 @@ class Apps:
                 """,
                 app=Apps.get_uuid_from_hostname(app),
             )
-            return res['data']['app']['maintenance']
         else:
             graphql(
                 """
@@ -293,6 +527,10 @@ class Apps:
             """,
             data={'app': {'ownerUuid': cli.get_user_id(), 'name': name}},
         )
+
+        # The name may have been cached as missing.
+        Apps.forget_uuid(name)
+
         return res['data']['createApp']['app']
 
     @staticmethod
@@ -312,3 +550,5 @@ class Apps:
                 'appPatch': {'deleted': True},
             },
         )
+
+        Apps.forget_uuid(app)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+A local archive of the log lines received by `story logs --archive`.
+
+Lines are kept as they were received, in gzipped NDJSON files, one per
+app, source (runtime or service) and hour. An SQLite index records the
+time range and number of lines of every file, per level and service, so
+that a search only reads the files which may have matching lines.
+
+The archive only ever grows forwards: lines older than the latest one
+archived for a stream are skipped, as are lines archived already, so
+that overlapping fetches aren't stored twice.
+"""
+import gzip
+import json
+import os
+import sqlite3
+import time
+
+from . import storage
+from .helpers.logs import (
+    CHUNK_SIZE,
+    LogCursor,
+    LogFilter,
+    decode,
+    level_rank,
+)
+
+ARCHIVE_DIR = os.path.join(storage.CACHE_DIR, 'logs')
+
+HOUR = 60 * 60 * 1000  # In milliseconds, like the timestamps of lines.
+
+# Received lines are written out once this many are pending (and when the
+# archive is closed).
+FLUSH_LINES = 5000
+
+
+class Archive:
+    def __init__(self, path=None):
+        self.path = path or ARCHIVE_DIR
+        self._cursors = {}
+        self._pending = {}
+        self._pending_lines = 0
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # Wait for other CLI processes' writes, rather than failing.
+        self._db = sqlite3.connect(
+            os.path.join(self.path, 'index.sqlite3'), timeout=10
+        )
+        self._db.create_function('level_rank', 1, level_rank)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS partitions ('
+                '  app_id TEXT NOT NULL,'
+                '  source TEXT NOT NULL,'
+                '  hour INTEGER NOT NULL,'
+                '  level TEXT NOT NULL,'
+                '  service_name TEXT NOT NULL,'
+                '  lines INTEGER NOT NULL,'
+                '  min_ts INTEGER NOT NULL,'
+                '  max_ts INTEGER NOT NULL,'
+                '  PRIMARY KEY (app_id, source, hour, level, service_name)'
+                ')'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS partitions_max_ts '
+                'ON partitions (app_id, source, max_ts)'
+            )
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def partition_path(self, app_id, source, hour) -> str:
+        name = time.strftime('%Y%m%d%H', time.gmtime(hour * HOUR / 1000))
+        return os.path.join(self.path, app_id, source, f'{name}.ndjson.gz')
+
+    def latest_ts(self, app_id, source):
+        """Returns the timestamp of the latest line archived, if any."""
+        return self._db.execute(
+            'SELECT MAX(max_ts) FROM partitions '
+            'WHERE app_id = ? AND source = ?',
+            (app_id, source),
+        ).fetchone()[0]
+
+    def cursor(self, app_id, source) -> LogCursor:
+        """
+        Returns a new cursor past the lines archived for the stream, which
+        skips them (and reports a gap if the lines after it don't reach
+        back to them).
+        """
+        cursor = LogCursor()
+        latest_ts = self.latest_ts(app_id, source)
+        if latest_ts is not None:
+            for _, log in self._read(app_id, source, latest_ts // HOUR):
+                if log['ts'] == latest_ts:
+                    cursor.advance(log)
+
+        cursor.resume()
+        return cursor
+
+    def tee(self, app_id, source, sink, log_filter=None):
+        """
+        Returns a LogRenderer sink, which archives the entries before
+        handing them (or only those which match log_filter) to sink.
+        """
+        if log_filter is not None:
+            sink = log_filter.sink(sink)
+
+        def archive_and_sink(entries):
+            self.add(app_id, source, entries)
+            sink(entries)
+
+        return archive_and_sink
+
+    def add(self, app_id, source, entries: list):
+        """Queues (message, log, app) entries, to be archived."""
+        cursor = self._cursors.get((app_id, source))
+        if cursor is None:
+            cursor = self._cursors[(app_id, source)] = self.cursor(
+                app_id, source
+            )
+
+        for message, log, _ in entries:
+            if cursor.advance(log):
+                key = (app_id, source, log['ts'] // HOUR)
+                self._pending.setdefault(key, []).append((message, log))
+                self._pending_lines += 1
+
+        # Lines older than the archive aren't missing from it.
+        cursor.gap = None
+
+        if self._pending_lines >= FLUSH_LINES:
+            self.flush()
+
+    def flush(self):
+        """Appends the pending lines to their partitions, and indexes them."""
+        if not self._pending:
+            return
+
+        # Taking the write lock first serialises flushes across processes,
+        # partition files included.
+        self._db.execute('BEGIN IMMEDIATE')
+        with self._db:
+            for (app_id, source, hour), lines in self._pending.items():
+                self._append(app_id, source, hour, lines)
+
+        self._pending.clear()
+        self._pending_lines = 0
+
+    def _append(self, app_id, source, hour, lines: list):
+        path = self.partition_path(app_id, source, hour)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Each append is a gzip member of its own, which gzip reads back
+        # as one stream.
+        with gzip.open(path, 'at') as f:
+            f.write(''.join(
+                f'{message}\n' if '\n' not in message
+                else f'{json.dumps(log)}\n'
+                for message, log in lines
+            ))
+
+        stats = {}
+        for _, log in lines:
+            key = (log['level'], log.get('service_name') or '')
+            count, min_ts, max_ts = stats.get(key, (0, log['ts'], log['ts']))
+            stats[key] = (
+                count + 1, min(min_ts, log['ts']), max(max_ts, log['ts'])
+            )
+
+        # Not an UPSERT, which older SQLite libraries (before 3.24) lack.
+        keys = [
+            (app_id, source, hour, level, service_name)
+            for level, service_name in stats
+        ]
+        self._db.executemany(
+            'INSERT OR IGNORE INTO partitions VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+            [
+                (*key, min_ts, max_ts)
+                for key, (_, min_ts, max_ts) in zip(keys, stats.values())
+            ],
+        )
+        self._db.executemany(
+            'UPDATE partitions SET lines = lines + ?,'
+            '  min_ts = MIN(min_ts, ?), max_ts = MAX(max_ts, ?) '
+            'WHERE app_id = ? AND source = ? AND hour = ?'
+            '  AND level = ? AND service_name = ?',
+            [(*stat, *key) for key, stat in zip(keys, stats.values())],
+        )
+
+    def _read(self, app_id, source, hour):
+        """Yields the (message, log) lines of a partition."""
+        try:
+            with gzip.open(self.partition_path(app_id, source, hour)) as f:
+                # Not splitlines(), which splits on more than newlines.
+                messages = f.read().decode().split('\n')[:-1]
+        except FileNotFoundError:
+            return
+
+        for i in range(0, len(messages), CHUNK_SIZE):
+            chunk = messages[i:i + CHUNK_SIZE]
+            yield from zip(chunk, decode(chunk))
+
+    def search(self, app_id, source, log_filter: LogFilter):
+        """
+        Yields the archived (message, log) lines which match the filter,
+        oldest first. Only the partitions which the index says may have
+        matching lines are read.
+        """
+        hours = [
+            hour
+            for hour, in self._db.execute(
+                'SELECT DISTINCT hour FROM partitions '
+                'WHERE app_id = ? AND source = ?'
+                '  AND max_ts >= ? AND min_ts <= ?'
+                '  AND level_rank(level) >= ?'
+                '  AND (? IS NULL OR service_name = ?) '
+                'ORDER BY hour',
+                (
+                    app_id,
+                    source,
+                    log_filter.since_ts or 0,
+                    log_filter.until_ts or 2 ** 62,
+                    log_filter.min_rank,
+                    log_filter.service_name,
+                    log_filter.service_name,
+                ),
+            )
+        ]
+
+        for hour in hours:
+            for message, log in self._read(app_id, source, hour):
+                if log_filter.match(log):
+                    yield message, log
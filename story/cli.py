@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import importlib
 import json
 import os
 import subprocess
@@ -9,43 +10,37 @@ import typing
 from urllib.parse import urlencode
 from uuid import uuid4
 
-from blindspin import spinner
-
 import click
 
 import click_help_colors
 
-
-import emoji
-
-from raven import Client
-
-from requests import Session
-
-from . import storage, utils
+from . import analytics, storage, transport, utils
+from .commands import COMMANDS, HIDDEN_COMMANDS
 from .ensure import ensure_latest
 from .helpers.didyoumean import DYMGroup
-from .support import echo_support
 from .version import compiler_version
 from .version import version as story_version
 
-# Initiate requests session, for connection pooling.
-requests = Session()
+# Share the pooled requests session, for connection reuse.
+requests = transport.session
 
 # Typing hints.
 Content = typing.Union[str, typing.Mapping, typing.List]
 
-if not os.getenv('TOXENV'):
-    enable_reporting = True
-    sentry = Client(
-        'https://007e7d135737487f97f5fe87d5d85b55@sentry.io/1206504'
-    )
-else:
-    enable_reporting = False
-    sentry = Client()
+SENTRY_DSN = 'https://007e7d135737487f97f5fe87d5d85b55@sentry.io/1206504'
+
+enable_reporting = not os.getenv('TOXENV')
+
+# The Sentry client is only constructed once there's something to report,
+# so that raven stays off the startup path.
+sentry = None
+sentry_user = None
 
 data = None
 
+# Whether locally cached lookups (e.g. app UUIDs) may be used.
+use_cache = True
+
 
 def get_access_token():
     return data['access_token']
@@ -58,7 +53,7 @@ def get_user_id():
 
 def track_profile():
     _make_tracking_http_request(
-        'https://stories.storyscriptapp.com/track/profile',
+        analytics.TRACK_PROFILE_URL,
         {
             'id': str(get_user_id()),
             'profile': {
@@ -73,38 +68,13 @@ def track_profile():
 
 def _make_tracking_http_request(url, json_data):
     """
-    Forks the HTTP call into the background.
-    The caller does not make the call, and this method returns just after
-    forking the process.
-
-    The child makes the call, and does not return back to the caller,
-    but instead just exits (sys.exit(0)). This is to ensure that whatever
-    needs to happen after this method is called, does not happen twice.
+    Spools the event, to be sent in the background once the command exits
+    (see story.analytics).
     """
     if not enable_reporting:
         return
-    if sys.platform != 'linux' and sys.platform != 'darwin':
-        try:
-            requests.post(url, json=json_data)
-        except Exception:
-            # ignore issues with tracking
-            pass
-
-        return
 
-    pid = os.fork()
-    if pid > 0:
-        # This is the parent process.
-        return
-
-    try:
-        requests.post(url, json=json_data)
-    except Exception:
-        # ignore issues with tracking
-        pass
-
-    # This is the child process. Exit now.
-    sys.exit(0)
+    analytics.record(url, json_data)
 
 
 def track(event_name, extra: dict = None):
@@ -113,7 +83,7 @@ def track(event_name, extra: dict = None):
 
     extra['CLI version'] = story_version
     _make_tracking_http_request(
-        'https://stories.storyscriptapp.com/track/event',
+        analytics.TRACK_EVENT_URL,
         {
             'id': str(get_user_id()),
             'event_name': event_name,
@@ -127,6 +97,9 @@ class NoCredsException(BaseException):
 
 
 def initiate_login():
+    from blindspin import spinner
+    import emoji
+
     global data
 
     click.echo(
@@ -186,8 +159,9 @@ def initiate_login():
         sys.exit(1)
 
     data = r.json()
-    for k, v in data.items():
-        storage.config.store(k, v)
+    with storage.config.transaction():
+        for k, v in data.items():
+            storage.config.store(k, v)
 
     init()
 
@@ -286,12 +260,41 @@ def init(config_path=None):
 
     data = storage.config.as_dict()
 
+    global sentry_user
+
     try:
-        sentry.user_context({'id': get_user_id(), 'email': data['email']})
+        sentry_user = {'id': get_user_id(), 'email': data['email']}
     except Exception:
         pass
 
 
+def get_sentry():
+    """Returns the Sentry client, constructing it the first time."""
+    global sentry
+
+    if sentry is None:
+        from raven import Client
+
+        sentry = Client(SENTRY_DSN, install_sys_hook=False)
+
+    if sentry_user is not None:
+        sentry.user_context(sentry_user)
+
+    return sentry
+
+
+def report_exception(*exc_info):
+    """A sys.excepthook, which reports uncaught exceptions to Sentry."""
+    try:
+        get_sentry().captureException(exc_info=exc_info, level='fatal')
+    finally:
+        sys.__excepthook__(*exc_info)
+
+
+if enable_reporting:
+    sys.excepthook = report_exception
+
+
 def stream(cmd: str):
     process = subprocess.Popen(cmd.split(' '), stdout=subprocess.PIPE)
 
@@ -323,9 +326,49 @@ class CLIGroup(DYMGroup, click_help_colors.HelpColorsGroup):
     pass
 
 
+class LazyCLIGroup(CLIGroup):
+    """
+    Lists commands from the story.commands manifest, and imports a
+    command's module (which registers it) only when it's needed.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(COMMANDS))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in COMMANDS:
+            importlib.import_module(f'{__package__}.commands.{cmd_name}')
+
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        names = [
+            name
+            for name in self.list_commands(ctx)
+            if name not in HIDDEN_COMMANDS
+            and not (name in self.commands and self.commands[name].hidden)
+        ]
+        if not names:
+            return
+
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                help = self.commands[name].get_short_help_str(limit)
+            else:
+                help = click.utils.make_default_short_help(
+                    COMMANDS[name], limit
+                )
+            rows.append((name, help))
+
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
 # @click.option('--url', callback=version)
 @click.group(
-    cls=CLIGroup,
+    cls=LazyCLIGroup,
     help_headers_color='yellow',
     help_options_color='magenta',
     add_help_option=True,
@@ -345,10 +388,19 @@ class CLIGroup(DYMGroup, click_help_colors.HelpColorsGroup):
 @click.option('--config', 'do_config', is_flag=True, hidden=True)
 @click.option('--config_path', 'config_path', hidden=True)
 @click.option('--cache', 'do_cache', is_flag=True, hidden=True)
+@click.option(
+    '--no-cache',
+    'no_cache',
+    is_flag=True,
+    help='Bypass locally cached lookups, such as app UUIDs',
+)
 @click.option(
     '--disable-version-check', 'dont_check', is_flag=True, hidden=True
 )
 @click.option('--completion', 'do_completion', is_flag=True, hidden=True)
+@click.option('--debug-http', 'debug_http', is_flag=True, hidden=True)
+@click.option('--profile-startup', 'do_profile_startup', is_flag=True,
+              hidden=True)
 @click.option('--reset', 'do_reset', is_flag=True, hidden=True)
 @click.option('--support', 'do_support', is_flag=True, hidden=True)
 def cli(
@@ -356,11 +408,14 @@ def cli(
     do_version=False,
     do_config=False,
     do_cache=False,
+    no_cache=False,
     do_reset=False,
+    do_profile_startup=False,
     do_support=False,
     do_completion=False,
     dont_check=False,
     config_path=False,
+    debug_http=False,
 ):
     """
     Hello! Welcome to Storyscript.
@@ -369,6 +424,12 @@ def cli(
 
     Documentation: https://docs.storyscript.io/
     """
+    global use_cache
+
+    use_cache = not no_cache
+
+    if debug_http:
+        click.get_current_context().call_on_close(transport.echo_stats)
 
     if do_version:
         echo_version()
@@ -386,11 +447,25 @@ def cli(
         reset()
         sys.exit(0)
     elif do_support:
+        from .support import echo_support
+
         echo_support()
 
+    elif do_profile_startup:
+        from .support import echo_startup_profile
+
+        echo_startup_profile()
+        sys.exit(0)
+
     else:
         init(config_path=config_path)
 
+        # Write storage changes once, when the command completes.
+        ctx = click.get_current_context()
+        for store in (storage.cache, storage.config):
+            store.begin()
+            ctx.call_on_close(store.commit)
+
         # Check for new versions, if allowed.
         if not dont_check:
             ensure_latest()
@@ -1,16 +1,23 @@
-__all__ = [
-    'apps',
-    'write',
-    'config',
-    'completion',
-    'feedback',
-    'login',
-    'logs',
-    'maintenance',
-    'releases',
-    'status',
-    'test',
-    'update',
-    'deploy',
-    'logout'
-]
+# The CLI's commands, by name, along with their short help. Each command
+# lives in the module of the same name, which is only imported once the
+# command is invoked (see cli.LazyCLIGroup).
+COMMANDS = {
+    'apps': 'Create, list, and manage apps on Storyscript Cloud.',
+    'completion': 'Show or install shell completion code',
+    'config': 'Update the configuration for your app.',
+    'deploy': 'Deploy your app to Storyscript Cloud.',
+    'feedback': 'Give feedback.',
+    'login': 'Login to Storyscript Cloud via GitHub.',
+    'logout': 'Logout from the Storyscript Cloud.',
+    'logs': 'Fetch logs for your app',
+    'maintenance': 'Manage the availability of your apps.',
+    'releases': 'Manage releases for your app (including rollback).',
+    'status': 'Show Storyscript Cloud status.',
+    'test': 'Compile your Storyscripts, and check for any errors.',
+    'update': 'Look for new version updates to CLI.',
+    'write': 'Pre–defined Storyscripts for your app!',
+}
+
+HIDDEN_COMMANDS = {'status', 'update'}
+
+__all__ = list(COMMANDS)
@@ -11,6 +11,7 @@ import emoji
 from .. import api
 from .. import awesome
 from .. import cli
+from .. import fanout
 from .. import options
 from ..helpers import datetime
 
@@ -194,7 +195,8 @@ def do_open(app):
 @click.option(
     '--all', is_flag=True, help='Destroy all Storyscript Cloud apps.'
 )
-def destroy(yes=False, app=None, all=False):
+@options.concurrency()
+def destroy(yes=False, app=None, all=False, concurrency=1):
     """Destroy an app."""
 
     cli.user()
@@ -205,21 +207,59 @@ def destroy(yes=False, app=None, all=False):
     else:
         apps = [app]
 
-    for app in apps:
+    if not yes:
+        for app in apps:
+            click.confirm(f'Do you want to destroy {app!r}?', abort=True)
 
-        if yes or click.confirm(
-            f'Do you want to destroy {app!r}?', abort=True
-        ):
-            click.echo(f'Destroying application {app!r}… ', nl=False)
+    if len(apps) == 1:
+        app = apps[0]
+        click.echo(f'Destroying application {app!r}… ', nl=False)
 
-            with spinner():
-                api.Apps.destroy(app=app)
-                cli.track('App Destroyed', {'App name': app})
+        with spinner():
+            _destroy(app)
 
-            click.echo(
-                '\b'
-                + click.style(emoji.emojize(':heavy_check_mark:'), fg='green')
+        click.echo(
+            '\b' + click.style(emoji.emojize(':heavy_check_mark:'), fg='green')
+        )
+        click.echo()
+        sys.exit(0)
+
+    done = 0
+
+    def on_done(app, error):
+        nonlocal done
+        done += 1
+
+        if error is None:
+            mark = click.style(emoji.emojize(':heavy_check_mark:'), fg='green')
+        else:
+            mark = click.style(
+                emoji.emojize(':heavy_multiplication_x:'), fg='red'
             )
-            click.echo()
+            # Errors from the API have been reported already.
+            if not isinstance(error, (SystemExit, click.exceptions.Exit)):
+                mark += f' {error}'
+
+        click.echo(
+            f'[{done}/{len(apps)}] Destroying application {app!r}… {mark}'
+        )
+
+    errors = fanout.fan_out(_destroy, apps, concurrency, on_done)
+
+    if errors:
+        click.echo(
+            click.style(
+                f'Failed to destroy {len(errors)} of {len(apps)} '
+                f'applications: {", ".join(sorted(errors))}',
+                fg='red',
+            ),
+            err=True,
+        )
+        sys.exit(1)
 
     sys.exit(0)
+
+
+def _destroy(app):
+    api.Apps.destroy(app=app)
+    cli.track('App Destroyed', {'App name': app})
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import json
 import sys
 import time
 
@@ -8,21 +11,32 @@ import click
 
 import emoji
 
-from . import test
-from .. import cli, options
-from ..api import Apps, Config, Releases
+import websockets
+
+from . import logs, test
+from .. import cli, options, storage, transport
+from ..api import Apps, Batch, Config, PENDING_STATES, Releases
+from ..environment import SS_LOGS
+
+POLL_INTERVAL = 0.5
+POLL_INTERVAL_MAX = 8
 
 
 @cli.cli.command()
 @click.option('--message', help='Deployment message')
 @click.option('--hard', is_flag=True,
               help='Pull the latest service images on deploy')
+@click.option('--force', is_flag=True,
+              help='Deploy even if nothing changed since the last deploy')
+@click.option('--verbose', '-v', is_flag=True,
+              help='Show how much data was uploaded')
+@options.jobs()
 @options.app(allow_option=False)
-def deploy(app, message, hard):
+def deploy(app, message, hard, force, verbose, jobs):
     """Deploy your app to Storyscript Cloud."""
     cli.user()
 
-    payload = test.compile_app(app, False)  # Also adds a spinner.
+    payload = test.compile_app(app, False, jobs=jobs)  # Also adds a spinner.
 
     if payload is None:
         sys.exit(1)  # Error already printed by compile_app.
@@ -30,8 +44,45 @@ def deploy(app, message, hard):
     click.echo(f'Deploying app {app}... ', nl=False)
 
     with spinner():
-        config = Config.get(app)
-        release = Releases.create(config, payload, app, message, hard)
+        # Pre-flight queries go out in a single round trip.
+        with Batch() as batch:
+            config = Config.get(app, batch=batch)
+            maintenance = Apps.maintenance(app, maintenance=None, batch=batch)
+            latest = Releases.get(app, batch=batch)
+
+        release_hash = payload_hash(config.result, payload)
+        deployed = storage.cache.fetch(f'release-{app}')
+        unchanged = (
+            deployed is not None
+            and len(latest.result) > 0
+            and latest.result[0]['id'] == deployed['id']
+            and latest.result[0]['state'] == 'DEPLOYED'
+            and deployed['hash'] == release_hash
+        )
+        # --hard deploys pull newer images, even for the same payload.
+        skip = unchanged and not (force or hard)
+
+        if not skip:
+            release = Releases.create(
+                config.result, payload, app, message, hard
+            )
+            storage.cache.store(
+                f'release-{app}', {'id': release['id'], 'hash': release_hash}
+            )
+
+    if verbose:
+        click.echo()
+        transport.echo_upload_stats()
+
+    if skip:
+        click.echo()
+        click.echo(
+            f'Version {deployed["id"]} of your app is already deployed, '
+            f'with the same stories and config.'
+        )
+        click.echo('Run the following to deploy it again anyway:')
+        cli.print_command('story deploy --force')
+        return
 
     url = f'https://{app}.storyscriptapp.com/'
     click.echo()
@@ -43,7 +94,7 @@ def deploy(app, message, hard):
 
     click.echo('Waiting for deployment to complete…  ', nl=False)
     with spinner():
-        if Apps.maintenance(app, maintenance=None):
+        if maintenance.result:
             click.echo()
             click.echo()
             click.echo(
@@ -58,10 +109,7 @@ def deploy(app, message, hard):
             )
             return
 
-        state = 'QUEUED'
-        while state in ['DEPLOYING', 'QUEUED']:
-            state = Releases.get(app)[0]['state']
-            time.sleep(0.5)
+        state = wait_for_release(app, release['id'])
 
     click.echo()
     if state == 'DEPLOYED':
@@ -98,3 +146,64 @@ def deploy(app, message, hard):
             err=True,
         )
         click.echo(f'Please shoot an email to support@storyscript.io')
+
+
+def payload_hash(config: dict, payload: dict) -> str:
+    """A canonical hash of what a release deploys."""
+    release = json.dumps(
+        {'config': config, 'payload': payload},
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(release.encode()).hexdigest()
+
+
+def wait_for_release(app: str, release_id: int) -> str:
+    """
+    Waits for the release to leave the QUEUED and DEPLOYING states, and
+    returns its final state. State changes are pushed by the log server
+    when it supports it, otherwise the release is polled.
+    """
+    try:
+        state = asyncio.get_event_loop().run_until_complete(
+            watch_release(Apps.get_uuid_from_hostname(app), release_id)
+        )
+    except (OSError, websockets.exceptions.WebSocketException):
+        state = None
+
+    if state is None:
+        state = poll_release(app)
+
+    return state
+
+
+async def watch_release(app_id: str, release_id: int):
+    """
+    Subscribes to state changes of the release over the log server's
+    websocket. Returns None if the server can't push them.
+    """
+    async with websockets.connect(SS_LOGS) as websocket:
+        auth_response = await logs.authenticate(websocket, app_id)
+        if 'release_state' not in auth_response.get('features', []):
+            return None
+
+        await websocket.send(
+            json.dumps({'command': 'release_state', 'release_id': release_id})
+        )
+
+        while True:
+            event = json.loads(await websocket.recv())
+            if event['state'] not in PENDING_STATES:
+                return event['state']
+
+
+def poll_release(app: str) -> str:
+    """Polls the latest release, backing off exponentially."""
+    interval = POLL_INTERVAL
+    while True:
+        state = Releases.get(app)[0]['state']
+        if state not in PENDING_STATES:
+            return state
+
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import functools
+import itertools
 import json
+import random
+import re
 import socket
 import sys
 import time
@@ -16,9 +20,91 @@ from websockets import WebSocketClientProtocol
 from .. import cli
 from .. import options
 from ..api import Apps
+from ..archive import Archive
+from ..environment import SS_LOGS
+from ..helpers import datetime
+from ..helpers.logs import (
+    CHUNK_SIZE,
+    LEVELS,
+    LogFilter,
+    LogMerger,
+    LogRenderer,
+    LogThrottle,
+    LogWriter,
+    OUTPUTS,
+)
+
+# How many lines to fetch again when resuming a stream, if the log server
+# can't resume from a timestamp.
+RESUME_LINES = 100
+
+# How many lines "story logs search" fetches at most, beyond the archive,
+# if the log server can't resume from a timestamp.
+SEARCH_TAIL_LINES = 1000
+
+HEARTBEAT_INTERVAL = 10
+
+# Reconnects wait for a random time, of up to BACKOFF_BASE seconds at
+# first, doubling with every failed attempt up to BACKOFF_MAX. Connections
+# which stay up for STABLE_CONNECTION seconds reset the backoff.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+STABLE_CONNECTION = 60
+
+# How many reconnects in a row may fail (to connect at all, or with a 5xx)
+# before a followed stream gives up.
+RECONNECT_ATTEMPTS = 10
+
+
+def ago_to_ts(context, param, value):
+    """Converts a duration (eg: "2h") to the timestamp of that long ago."""
+    if value is None:
+        return None
+
+    try:
+        seconds = datetime.parse_duration(value)
+    except ValueError:
+        raise click.BadParameter('expected a duration, such as 15m, 2h or 7d')
+
+    return int((time.time() - seconds) * 1000)
+
+
+def check_pattern(context, param, value):
+    """Checks that a pattern is a valid regular expression."""
+    if value is not None:
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise click.BadParameter(f'invalid regular expression ({e})')
+
+    return value
+
+
+def parse_rate(context, param, value):
+    """Parses a number of lines a second (eg: "100/s")."""
+    if value is None:
+        return None
+
+    match = re.fullmatch(r'(\d+)(/s)?', value)
+    if match is None or int(match.group(1)) == 0:
+        raise click.BadParameter('expected a rate, such as 100/s')
+
+    return int(match.group(1))
 
 
-@cli.cli.command()
+def parse_sample(context, param, value):
+    """Parses a sampling ratio (eg: "1/10")."""
+    if value is None:
+        return None
+
+    match = re.fullmatch(r'(1/)?(\d+)', value)
+    if match is None or int(match.group(2)) == 0:
+        raise click.BadParameter('expected a ratio, such as 1/10')
+
+    return int(match.group(2))
+
+
+@cli.cli.group(invoke_without_command=True)
 @click.option('--follow', '-f', is_flag=True, help='Follow the logs')
 @click.option('--last', '-n', default=10, help='Print the last n lines')
 @click.option(
@@ -39,27 +125,102 @@ from ..api import Apps
     '--level',
     '-l',
     default='info',
-    type=click.Choice(['debug', 'info', 'warning', 'error']),
+    type=click.Choice(LEVELS),
     help='Specify the minimum log level '
     '(does not work when --services/-s is specified)',
 )
-@options.app()
-def logs(follow, last, service, service_name, app, level):
+@click.option(
+    '--output',
+    '-o',
+    default='pretty',
+    type=click.Choice(OUTPUTS),
+    help='Print coloured lines, the log objects as NDJSON, '
+    'or just their messages',
+)
+@click.option(
+    '--grep',
+    callback=check_pattern,
+    help='Only print the lines whose message matches '
+    'this regular expression',
+)
+@click.option(
+    '--exclude',
+    callback=check_pattern,
+    help='Skip the lines whose message matches this regular expression',
+)
+@click.option(
+    '--since',
+    callback=ago_to_ts,
+    help='Only print the lines since this long ago (eg: 15m, 2h or 7d). '
+    "Unless the log server can filter by time, that's of the last n lines",
+)
+@click.option(
+    '--until',
+    callback=ago_to_ts,
+    help='Only print the lines until this long ago',
+)
+@click.option(
+    '--max-rate',
+    callback=parse_rate,
+    help='Print at most this many lines a second (eg: 100/s), '
+    'and count the ones skipped',
+)
+@click.option(
+    '--sample',
+    callback=parse_sample,
+    help='Print only one in N lines (eg: 1/10)',
+)
+@click.option(
+    '--collapse',
+    is_flag=True,
+    help='Collapse repeated lines into a count '
+    '(implied by --max-rate and --sample)',
+)
+@click.option(
+    '--archive',
+    is_flag=True,
+    help='Keep the lines received in the local archive, '
+    'for "story logs search"',
+)
+@options.apps()
+@click.pass_context
+def logs(ctx, follow, last, service, service_name, apps, level, output, grep,
+         exclude, since, until, max_rate, sample, collapse, archive):
     """
     Fetch logs for your app
     """
+    if ctx.invoked_subcommand is not None:
+        return
+
+    log_filter = None
+    if any(value is not None for value in (grep, exclude, since, until)):
+        if archive:
+            raise click.UsageError(
+                "--archive keeps whole streams, so it can't be combined "
+                'with --grep, --exclude, --since or --until.'
+            )
+        if follow and until is not None:
+            raise click.UsageError("--until can't be combined with --follow.")
+
+        log_filter = LogFilter(grep, since, until, exclude=exclude)
+
+    apps = options.assert_apps(ctx.command.name, apps)
     cli.user()
 
-    click.echo(f'Retrieving logs for {app}... ', nl=False)
-    with click_spinner.spinner():
-        app_id = Apps.get_uuid_from_hostname(app)
+    # Keep stdout to the logs themselves, when it's meant for machines.
+    pretty = output == 'pretty'
+    click.echo(
+        f'Retrieving logs for {", ".join(apps)}... ', nl=False, err=not pretty
+    )
+    with click_spinner.spinner(disable=not pretty):
+        app_ids = {app: Apps.get_uuid_from_hostname(app) for app in apps}
 
-    click.echo()
+    click.echo(err=not pretty)
 
     cli.track(
         'App Logs Requested',
         {
-            'App name': app,
+            'App name': ', '.join(apps),
             'Follow': 'Yes' if follow else 'No',
             'Last N': last,
             'Source': 'Runtime' if service is False else 'Service',
@@ -68,17 +229,273 @@ def logs(follow, last, service, service_name, app, level):
         },
     )
 
-    asyncio.get_event_loop().run_until_complete(
-        connect_and_listen_with_retry(
-            app_id,
+    # The archive keeps whole streams, whatever their level and service,
+    # so that searching it finds all of their lines. Those shown are
+    # picked out of them.
+    archive_filter = None
+    if archive:
+        archive = Archive()
+        if level != 'debug' or (service and service_name):
+            archive_filter = LogFilter(
+                level=level, service_name=service_name if service else None
+            )
+        level, service_name = 'debug', None
+    else:
+        archive = None
+
+    make_throttle = None
+    if max_rate or sample or collapse:
+        make_throttle = functools.partial(
+            LogThrottle, max_rate=max_rate, sample=sample
+        )
+        if sample:
+            click.echo(
+                click.style(f'Printing one in {sample} lines.', dim=True),
+                err=True,
+            )
+
+    throttle = None
+    if len(app_ids) > 1:
+        listen = listen_to_apps(
+            app_ids,
             last,
             follow,
             service is False,
             service,
             service_name,
             level,
+            output,
+            archive=archive,
+            archive_filter=archive_filter,
+            log_filter=log_filter,
+            make_throttle=make_throttle,
         )
+    else:
+        renderer = None
+        if archive or log_filter or make_throttle:
+            sink = LogWriter(
+                tag=None if service else 'runtime', output=output
+            ).write
+            if make_throttle:
+                throttle = make_throttle(sink)
+                sink = throttle.push
+            if archive:
+                sink = archive.tee(
+                    app_ids[apps[0]],
+                    'service' if service else 'runtime',
+                    sink,
+                    log_filter=archive_filter,
+                )
+
+            renderer = LogRenderer(sink=sink, log_filter=log_filter)
+
+        listen = connect_and_listen_with_retry(
+            app_ids[apps[0]],
+            last,
+            follow,
+            service is False,
+            service,
+            service_name,
+            level,
+            output,
+            renderer=renderer,
+        )
+
+    try:
+        asyncio.get_event_loop().run_until_complete(listen)
+    finally:
+        if throttle:
+            throttle.drain()
+        if archive:
+            archive.close()
+
+
+@logs.command()
+@click.argument('pattern', callback=check_pattern)
+@click.option(
+    '--since',
+    default='1h',
+    callback=ago_to_ts,
+    help='Search the lines since this long ago (eg: 15m, 2h or 7d)',
+)
+@click.option(
+    '--until',
+    callback=ago_to_ts,
+    help='Search the lines until this long ago, rather than until now',
+)
+@click.option(
+    '--services',
+    '-s',
+    'service',
+    is_flag=True,
+    help='Search logs from services used in the story',
+)
+@click.option(
+    '--service-name',
+    '-sn',
+    default=None,
+    help='Search logs for a specific service given by its name',
+)
+@click.option(
+    '--level',
+    '-l',
+    default='debug',
+    type=click.Choice(LEVELS),
+    help='Specify the minimum log level',
+)
+@click.option(
+    '--output',
+    '-o',
+    default='pretty',
+    type=click.Choice(OUTPUTS),
+    help='Print coloured lines, the log objects as NDJSON, '
+    'or just their messages',
+)
+@options.app()
+def search(pattern, since, until, service, service_name, level, output,
+           app):
+    """
+    Search the archived logs of your app (see --archive)
+
+    The pattern is a regular expression. Lines newer than the archive are
+    fetched from the log server (and archived) too.
+    """
+    cli.user()
+
+    log_filter = LogFilter(
+        pattern, since, until, level=level, service_name=service_name
+    )
+
+    app_id = Apps.get_uuid_from_hostname(app)
+    source = 'service' if service else 'runtime'
+    writer = LogWriter(tag=None if service else 'runtime', output=output)
+
+    archive = Archive()
+    try:
+        matches = archive.search(app_id, source, log_filter)
+        while True:
+            chunk = list(itertools.islice(matches, CHUNK_SIZE))
+            if not chunk:
+                break
+
+            writer.write([(message, log, None) for message, log in chunk])
+
+        if until is None:
+            # Fetch (and archive) what the archive doesn't have yet. The
+            # cursor skips what it does, and reports a gap if the tail
+            # didn't reach back to it. The whole stream is fetched, as the
+            # archive keeps whole streams, and the matches picked out of it.
+            renderer = LogRenderer(
+                cursor=archive.cursor(app_id, source),
+                sink=archive.tee(
+                    app_id, source, writer.write, log_filter=log_filter
+                ),
+            )
+            renderer.gap_reason = 'they were not archived'
+            asyncio.get_event_loop().run_until_complete(
+                connect_and_listen_once(
+                    app_id,
+                    SEARCH_TAIL_LINES,
+                    False,
+                    not service,
+                    service,
+                    '*',
+                    'debug',
+                    output,
+                    renderer=renderer,
+                )
+            )
+    finally:
+        archive.close()
+
+
+async def listen_to_apps(
+    app_ids: dict, n, follow, runtime_logs, service_logs, service_name,
+    level, output='pretty', archive=None, archive_filter=None,
+    log_filter=None, make_throttle=None
+):
+    """
+    Listens to the logs of several apps at once, over a connection each,
+    and merges them into timestamp order, tagged with their app. The lines
+    are archived first, if an archive is given (and only those which match
+    archive_filter are shown), and thinned out by a throttle per app (from
+    make_throttle), if given.
+    """
+    writer = LogWriter(
+        tag=None if service_logs else 'runtime',
+        output=output,
+        app_width=max(len(app) for app in app_ids),
     )
+    merger = LogMerger(writer)
+
+    throttles = []
+    streams = []
+    for app, app_id in app_ids.items():
+        sink = merger.push
+        if make_throttle:
+            throttles.append(make_throttle(sink))
+            sink = throttles[-1].push
+        if archive:
+            sink = archive.tee(
+                app_id,
+                'service' if service_logs else 'runtime',
+                sink,
+                log_filter=archive_filter,
+            )
+
+        streams.append(
+            asyncio.ensure_future(
+                connect_and_listen_with_retry(
+                    app_id,
+                    n,
+                    follow,
+                    runtime_logs,
+                    service_logs,
+                    service_name,
+                    level,
+                    output,
+                    renderer=LogRenderer(
+                        app=app, sink=sink, log_filter=log_filter
+                    ),
+                )
+            )
+        )
+
+    try:
+        await asyncio.gather(*streams)
+    finally:
+        for stream in streams:
+            stream.cancel()
+
+        for throttle in throttles:
+            throttle.drain()
+
+        merger.drain()
+
+
+async def authenticate(websocket: WebSocketClientProtocol, app_id) -> dict:
+    """
+    Authenticates the connection for the app, and returns the log server's
+    auth response. Raises ConnectionClosed if access was denied.
+    """
+    auth_payload = {
+        'command': 'auth',
+        'access_token': cli.get_access_token(),
+        'id': cli.get_access_token(),
+        'app_id': app_id,
+    }
+    await websocket.send(json.dumps(auth_payload))
+
+    auth_response = await websocket.recv()
+
+    # Generally, the log server will close the connection instantly.
+    # This authorised check is just for consistency.
+    # See https://github.com/storyscript/logstreamer#authentication.
+    auth_response = json.loads(auth_response)
+    if not auth_response['authorised']:
+        raise websockets.exceptions.ConnectionClosed(-1, None)
+
+    return auth_response
 
 
 async def ping_forever(websocket: WebSocketClientProtocol):
@@ -89,11 +506,82 @@ async def ping_forever(websocket: WebSocketClientProtocol):
             return  # Stop looping when this connection is closed.
         except URLError:
             return
-        await asyncio.sleep(10)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def supervise_heartbeat(heartbeat: asyncio.Task, websocket):
+    """
+    Closes the connection if its heartbeat dies, so that it's re-established
+    rather than left to go stale.
+    """
+
+    def on_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            asyncio.ensure_future(websocket.close())
+
+    heartbeat.add_done_callback(on_done)
+
+
+class ConnectionManager:
+    """
+    Paces the reconnects of a stream, with jittered exponential backoff,
+    and keeps count of them, and of the time spent disconnected.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.reconnects = 0
+        self.disconnected_secs = 0
+
+        self._attempt = 0
+        self._connected_at = None
+        self._disconnected_at = None
+
+    def connected(self):
+        now = time.monotonic()
+        self.connects += 1
+        if self._disconnected_at is not None:
+            self.reconnects += 1
+            self.disconnected_secs += now - self._disconnected_at
+            self._disconnected_at = None
+
+        self._connected_at = now
+
+    def disconnected(self):
+        now = time.monotonic()
+        if (
+            self._connected_at is not None
+            and now - self._connected_at >= STABLE_CONNECTION
+        ):
+            self._attempt = 0
+
+        self._connected_at = None
+        self._disconnected_at = now
+
+    def backoff(self) -> float:
+        """Returns how long to wait before the next reconnect."""
+        delay = random.uniform(
+            0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self._attempt)
+        )
+        self._attempt += 1
+        return delay
+
+    def echo_metrics(self):
+        if self.reconnects:
+            click.echo(
+                click.style(
+                    f'Reconnected to the log server {self.reconnects} '
+                    f'time(s), after {self.disconnected_secs:.1f}s '
+                    f'disconnected in all.',
+                    dim=True,
+                ),
+                err=True,
+            )
 
 
 async def connect_and_listen_with_retry(
-    app_id, n, follow, runtime_logs, service_logs, service_name, level
+    app_id, n, follow, runtime_logs, service_logs, service_name, level,
+    output='pretty', renderer=None
 ):
     """
     Every 4-5 minutes, the connection terminates. This is
@@ -104,83 +592,125 @@ async def connect_and_listen_with_retry(
     left off.
     If somebody does ever figure out why it breaks,
     please ping @judepereira on GitHub.
+
+    The renderer's cursor keeps track of where the stream is up to, across
+    connections, and reconnects are paced by a ConnectionManager. Once a
+    followed stream is up, reconnects which fail (to connect at all, or
+    with a 5xx) are retried too, up to RECONNECT_ATTEMPTS times in a row.
     """
-    while True:
-        try:
-            completed = await connect_and_listen_once(
-                app_id,
-                n,
-                follow,
-                runtime_logs,
-                service_logs,
-                service_name,
-                level,
-            )
-        except (URLError, socket.gaierror):
-            click.echo('Network connection lost', err=True)
-            click.get_current_context().exit(1)
-            return
-        except websockets.exceptions.InvalidStatusCode as e:
-            if int(e.status_code / 100) == 5:
-                click.echo(
-                    'The upstream log server appears to be restarting.'
-                    '\nPlease try again in a few seconds.',
-                    err=True,
+    if renderer is None:
+        renderer = LogRenderer(
+            tag=None if service_logs else 'runtime', output=output
+        )
+
+    connection = ConnectionManager()
+    failures = 0
+
+    try:
+        while True:
+            try:
+                completed = await connect_and_listen_once(
+                    app_id,
+                    n,
+                    follow,
+                    runtime_logs,
+                    service_logs,
+                    service_name,
+                    level,
+                    output,
+                    renderer=renderer,
+                    connection=connection,
                 )
-            else:
+                failures = 0
+            except (OSError, websockets.exceptions.InvalidStatusCode) as e:
+                # Once a followed stream is up, the log server failing to
+                # take it back (as when it's restarting) is retried for a
+                # while. Other errors (and those of the first connect)
+                # aren't.
+                server_error = (
+                    not isinstance(e, websockets.exceptions.InvalidStatusCode)
+                    or int(e.status_code / 100) == 5
+                )
+                failures += 1
+                if (
+                    not follow
+                    or not connection.connects
+                    or not server_error
+                    or failures > RECONNECT_ATTEMPTS
+                ):
+                    echo_connect_error(e)
+                    click.get_current_context().exit(1)
+                    return
+
                 click.echo(
-                    'The upstream log server did not respond.'
-                    '\nPlease try again in a few seconds.',
+                    click.style(
+                        f'Failed to reconnect to the log server (attempt '
+                        f'{failures} of {RECONNECT_ATTEMPTS}), retrying…',
+                        dim=True,
+                    ),
                     err=True,
                 )
-            click.get_current_context().exit(1)
-            return
+                completed = False
 
-        if completed:
-            break
+            if completed:
+                break
 
-        # Don't worry, cut_off_ts will take care of
-        # not printing duplicate messages.
-        # We set n=100 just so that messages are not lost during a
-        # connection termination.
-        n = 100
+            # Unless the log server can resume from the cursor, fetch the
+            # last RESUME_LINES lines again, so that the lines sent in the
+            # meantime aren't lost. The cursor skips the ones already
+            # printed, and reports a gap if that didn't reach back far
+            # enough.
+            n = RESUME_LINES
 
+            await asyncio.sleep(connection.backoff())
+    finally:
+        connection.echo_metrics()
 
-cut_off_ts = 0
-"""
-Logic around cut_off_ts: This field holds the last last log's timestamp,
-and is used to ensure that messages displayed by the CLI are not missed
-in the event of an abrupt connection termination. See the pydoc for
-connect_and_listen_with_retry above for more help.
-"""
+
+def echo_connect_error(e):
+    if isinstance(e, (URLError, socket.gaierror)):
+        click.echo('Network connection lost', err=True)
+    elif isinstance(e, OSError):
+        click.echo(
+            'The upstream log server could not be reached.'
+            '\nPlease try again in a few seconds.',
+            err=True,
+        )
+    elif int(e.status_code / 100) == 5:
+        click.echo(
+            'The upstream log server appears to be restarting.'
+            '\nPlease try again in a few seconds.',
+            err=True,
+        )
+    else:
+        click.echo(
+            'The upstream log server did not respond.'
+            '\nPlease try again in a few seconds.',
+            err=True,
+        )
 
 
 async def connect_and_listen_once(
-    app_id, n, follow, runtime_logs, service_logs, service_name, level
+    app_id, n, follow, runtime_logs, service_logs, service_name, level,
+    output='pretty', renderer=None, connection=None
 ):
-    global cut_off_ts
+    """
+    Listens to the logs of the app, until the connection closes. Returns
+    whether all the logs asked for were received.
 
-    async with websockets.connect('wss://logs.storyscript.io') as websocket:
-        assert isinstance(websocket, WebSocketClientProtocol)
+    When resuming a stream, the renderer is the one of the previous
+    connection, so that its cursor picks up where that left off.
+    """
+    if renderer is None:
+        renderer = LogRenderer(
+            tag=None if service_logs else 'runtime', output=output
+        )
 
-        auth_payload = {
-            'command': 'auth',
-            'access_token': cli.get_access_token(),
-            'id': cli.get_access_token(),
-            'app_id': app_id,
-        }
-        await websocket.send(json.dumps(auth_payload))
+    async with websockets.connect(SS_LOGS) as websocket:
+        assert isinstance(websocket, WebSocketClientProtocol)
 
         try:
-            auth_response = await websocket.recv()
-
-            # Generally, the log server will close the connection instantly.
-            # This authorised check is just for consistency.
-            # See https://github.com/storyscript/logstreamer#authentication.
-            auth_response = json.loads(auth_response)
-            if not auth_response['authorised']:
-                raise websockets.exceptions.ConnectionClosed(-1, None)
-
+            auth_response = await authenticate(websocket, app_id)
         except websockets.exceptions.ConnectionClosed:
             click.echo(
                 'The log server sent an unauthorised response.\n'
@@ -190,9 +720,6 @@ async def connect_and_listen_once(
             )
             sys.exit(1)
 
-        # Keep the connection alive by sending pings.
-        asyncio.get_event_loop().create_task(ping_forever(websocket))
-
         # Send our filter payload.
         if runtime_logs:
             filter_payload = {
@@ -213,63 +740,59 @@ async def connect_and_listen_once(
                 'watch': follow,
             }
 
-        await websocket.send(json.dumps(filter_payload))
-
-        last_log = None
-        while True:
-            try:
-                message = await websocket.recv()
-            except websockets.exceptions.ConnectionClosed:
-                # Connection was closed since all the required log items were
-                # sent.
-                if not follow:
-                    return True
-
-                cut_off_ts = last_log['ts']
-                return False
+        # Have the log server filter the lines, as far as it can. The rest
+        # of the filter is applied to the lines before they're rendered.
+        features = auth_response.get('features', ())
+        if renderer.log_filter is not None:
+            fields, rest = renderer.log_filter.split(features)
+            filter_payload.update(fields)
+            renderer.match = rest.match if rest else None
+
+        # Ask for exactly the lines missed since the cursor, if the log
+        # server supports it.
+        cursor = renderer.cursor
+        if cursor.ts is not None and 'since' in features:
+            filter_payload['since'] = max(
+                cursor.ts, filter_payload.get('since', cursor.ts)
+            )
 
-            log = json.loads(message)
-            last_log = log
+        if 'since' in filter_payload:
+            del filter_payload['n']
 
-            if cut_off_ts >= log['ts']:
-                continue
+        if connection is not None:
+            connection.connected()
 
-            date = time.strftime(
-                '%b %d %H:%M:%S', time.localtime(int(log['ts'] / 1000))
-            )
+        # Keep the connection alive by sending pings, for as long as it's
+        # being listened to.
+        heartbeat = asyncio.get_event_loop().create_task(
+            ping_forever(websocket)
+        )
+        supervise_heartbeat(heartbeat, websocket)
 
-            tag = 'runtime'
-            if service_logs:
-                tag = log['service_name']
+        try:
+            await websocket.send(json.dumps(filter_payload))
 
-            colourize_and_print(date, tag, log['level'], log['message'])
+            while True:
+                try:
+                    message = await websocket.recv()
+                except websockets.exceptions.ConnectionClosed:
+                    renderer.flush()
 
-    return True
+                    # Connection was closed since all the required log items
+                    # were sent.
+                    if not follow:
+                        return True
 
+                    cursor.resume()
+                    return False
 
-def colourize_and_print(date, tag, level, message):
-    level_col = 'green'  # Default for info.
-    level = level.lower()
-    if 'debug' in level:
-        level_col = 'blue'
-    elif 'warn' in level:
-        level_col = 'yellow'
-    elif 'crit' in level or 'error' in level:
-        level_col = 'red'
+                renderer.feed(message)
+        finally:
+            heartbeat.cancel()
+            if connection is not None:
+                connection.disconnected()
 
-    level = level[:7].rjust(7)
-    tag = tag[:12].rjust(12)
+            # Don't lose the lines of the last chunk, whatever happens.
+            renderer.flush()
 
-    if tag:
-        click.echo(
-            f'{click.style(date, fg="white")} '
-            f'{click.style(level.upper(), fg=level_col)} '
-            f'{click.style(tag, fg="blue")}: '
-            f'{message}'
-        )
-    else:
-        click.echo(
-            f'{click.style(date, fg="white")} '
-            f'{click.style(level.upper(), fg=level_col)} '
-            f'{message}'
-        )
+    return True
@@ -11,6 +11,7 @@ from .. import api
 from .. import cli
 from .. import options
 from ..helpers import datetime
+from ..mirror import ReleaseMirror
 
 
 @cli.cli.group()
@@ -19,12 +20,45 @@ def releases():
     pass
 
 
+def parse_version(context, param, value):
+    """Parses a release version, such as "v12" or "12"."""
+    if value is None:
+        return None
+
+    try:
+        return int(value[1:] if value.startswith('v') else value)
+    except ValueError:
+        raise click.BadParameter('expected a version, such as v12')
+
+
+def _mirrored_releases(app, **kwargs) -> list:
+    """
+    Returns the app's releases asked for (see ReleaseMirror.releases),
+    oldest first, through the local mirror.
+    """
+    mirror = ReleaseMirror()
+    try:
+        return mirror.releases(app, **kwargs)
+    finally:
+        mirror.close()
+
+
 @releases.command(name='list')
 @click.option(
     '--limit', '-n', nargs=1, default=20, help='List N latest releases'
 )
+@click.option(
+    '--before',
+    callback=parse_version,
+    help='List the releases before this version (eg: v12)',
+)
+@click.option(
+    '--after',
+    callback=parse_version,
+    help='List the releases after this version (eg: v12)',
+)
 @options.app()
-def list_command(app, limit):
+def list_command(app, limit, before, after):
     """List application releases."""
     cli.user()
 
@@ -32,28 +66,31 @@ def list_command(app, limit):
     # click.echo(click.style('========', fg='magenta'))
 
     with spinner():
-        res = api.Releases.list(app, limit=limit)
+        releases = _mirrored_releases(
+            app, limit=limit, before=before, after=after
+        )
 
-    res = sorted(res, key=lambda elem: elem['id'])
+    all_releases = []
+    for release in releases:
+        date = datetime.parse_psql_date_str(release['timestamp'])
+        all_releases.append(
+            [
+                f'v{release["id"]}',
+                release['state'].capitalize(),
+                datetime.reltime(date),
+                release['message'],
+            ]
+        )
 
-    if res:
+    if all_releases:
         from texttable import Texttable
 
         table = Texttable(max_width=800)
         table.set_deco(Texttable.HEADER)
         table.set_cols_align(['l', 'l', 'l', 'l'])
-        all_releases = [['VERSION', 'STATUS', 'CREATED', 'MESSAGE']]
-        for release in res:
-            date = datetime.parse_psql_date_str(release['timestamp'])
-            all_releases.append(
-                [
-                    f'v{release["id"]}',
-                    release['state'].capitalize(),
-                    datetime.reltime(date),
-                    release['message'],
-                ]
-            )
-        table.add_rows(rows=all_releases)
+        table.add_rows(
+            rows=[['VERSION', 'STATUS', 'CREATED', 'MESSAGE']] + all_releases
+        )
         click.echo(table.draw())
     else:
         click.echo(f'No releases yet for app {app}.')
@@ -72,8 +109,8 @@ def rollback(version, app):
     if not version:
         click.echo(f'Getting latest release for app {app}…  ', nl=False)
         with spinner():
-            res = api.Releases.get(app=app)
-            version = int(res[0]['id']) - 1
+            latest = _mirrored_releases(app, limit=1)
+            version = latest[0]['id'] - 1 if latest else 0
         click.echo(
             click.style('\b' + emoji.emojize(':heavy_check_mark:'), fg='green')
         )
@@ -100,3 +137,46 @@ def rollback(version, app):
         f'Deployed new release… '
         + click.style(f'v{res["id"]}', bold=True, fg='magenta')
     )
+
+
+@releases.command()
+@click.argument('version_a', callback=parse_version)
+@click.argument('version_b', callback=parse_version)
+@options.app()
+def diff(version_a, version_b, app):
+    """Compare two releases."""
+    cli.user()
+
+    with spinner():
+        mirror = ReleaseMirror()
+        try:
+            releases = [
+                mirror.get(app, version) for version in (version_a, version_b)
+            ]
+        finally:
+            mirror.close()
+
+    for version, release in zip((version_a, version_b), releases):
+        if release is None:
+            click.echo(
+                click.style(
+                    f'Release v{version} not found for app {app}.', fg='red'
+                ),
+                err=True,
+            )
+            sys.exit(1)
+
+    a, b = releases
+    click.echo(f'--- v{a["id"]}')
+    click.echo(f'+++ v{b["id"]}')
+    for field in ('state', 'timestamp', 'message'):
+        if a[field] == b[field]:
+            click.echo(f' {field}: {a[field]}')
+        else:
+            click.echo(click.style(f'-{field}: {a[field]}', fg='red'))
+            click.echo(click.style(f'+{field}: {b[field]}', fg='green'))
+
+    if a['config_hash'] == b['config_hash']:
+        click.echo(' config: unchanged')
+    else:
+        click.echo(click.style(' config: changed', fg='yellow'))
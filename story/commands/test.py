@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import json
 import os
 import sys
 
@@ -9,19 +8,20 @@ import emoji
 
 from storyscript.exceptions import StoryError
 
-from .. import cli, options, utils
+from .. import cli, compiler, options, utils
 
 
 @cli.cli.command()
 @click.option('--debug', is_flag=True, help='Compile in debug mode')
+@options.jobs()
 @options.app()
-def test(debug, app):
+def test(debug, jobs, app):
     """Compile your Storyscripts, and check for any errors."""
 
     cli.user()
 
     app_name = cli.get_app_name_from_yml() or 'Not created'
-    tree = compile_app(app_name, debug)
+    tree = compile_app(app_name, debug, jobs=jobs)
 
     if tree is None:
         sys.exit(1)
@@ -48,19 +48,19 @@ def test(debug, app):
     cli.print_command('story deploy')
 
 
-def compile_app(app_name_for_analytics, debug) -> dict:
+def compile_app(app_name_for_analytics, debug, jobs=1) -> dict:
     """Compiles, prints pretty info, and returns the compiled tree.
     :return: The compiled tree
     """
-    from storyscript.App import App
-
     click.echo(click.style('Compiling Stories… ', bold=True))
 
     old_cwd = os.getcwd()
 
     try:
         os.chdir(utils.get_project_root_dir())
-        stories = json.loads(App.compile(utils.get_project_root_dir()))
+        stories = compiler.compile_project(
+            utils.get_project_root_dir(), jobs=jobs
+        )
     except StoryError as e:
         click.echo('Failed to compile project:\n', err=True)
         click.echo(click.style(str(e.message()), fg='red'), err=True)
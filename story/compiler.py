@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental compilation of a project's stories.
+
+Every story is compiled on its own, and its compiled bundle is cached on
+disk, keyed by the hash of its content (and that of the stories it
+imports), the compiler version and the project's story.yml. The merged
+result for the whole project is cached too, so an unchanged project costs
+a single file read, and a changed one only recompiles the stories which
+changed.
+"""
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from . import cli, storage, utils
+from .version import compiler_version
+
+COMPILED_DIR = os.path.join(storage.CACHE_DIR, 'compiled')
+MAX_CACHED_FILES = 2000
+
+# Stories import others by path: import 'lib/utils.story' as utils
+IMPORT = re.compile(
+    rb'^\s*import\s+([\'"])(?P<path>[^\'"]+)\1', re.MULTILINE
+)
+
+
+def find_stories(root: str) -> list:
+    """Returns the paths of all stories under root, relative to it."""
+    stories = []
+    for directory, _, files in os.walk(root):
+        for file in files:
+            if file.endswith('.story'):
+                path = os.path.join(directory, file)
+                stories.append(os.path.relpath(path, root))
+
+    return sorted(stories)
+
+
+def compile_project(root: str, jobs: int = 1) -> dict:
+    """
+    Compiles all stories under root (which must be the CWD), and returns
+    the merged, compiled tree. Stories which aren't cached are compiled in
+    up to `jobs` processes (0 for one per CPU).
+    """
+    story_yml = utils.find_story_yml()
+    with open(story_yml, 'rb') as f:
+        project_salt = _hash(compiler_version.encode(), f.read())
+
+    sources = {}
+    for story in find_stories(root):
+        with open(story, 'rb') as f:
+            sources[story] = f.read()
+
+    # A story's bundle depends on the stories it imports, too.
+    story_keys = {}
+    for story in sources:
+        story_keys[story] = _hash(
+            project_salt.encode(),
+            story.encode(),
+            *[
+                part
+                for dependency in dependencies(story, sources)
+                for part in (dependency.encode(), sources[dependency])
+            ],
+        )
+
+    project_key = _hash(*[key.encode() for key in story_keys.values()])
+
+    tree = _load(project_key)
+    if tree is not None:
+        return tree
+
+    bundles = {story: _load(key) for story, key in story_keys.items()}
+    missing = [story for story, bundle in bundles.items() if bundle is None]
+
+    for story, bundle in zip(missing, compile_stories(missing, jobs)):
+        _save(story_keys[story], bundle)
+        bundles[story] = bundle
+
+    # Merge in path order, whichever order the stories were compiled in.
+    tree = merge([bundles[story] for story in story_keys])
+    _save(project_key, tree)
+    _prune()
+
+    return tree
+
+
+def imports(story: str, source: bytes, stories) -> list:
+    """
+    Returns the stories (among the given ones) which a story imports, by
+    a path relative to the project root or to its own directory.
+    """
+    imported = []
+    for match in IMPORT.finditer(source):
+        path = match.group('path').decode(errors='replace')
+        for candidate in (path, os.path.join(os.path.dirname(story), path)):
+            candidate = os.path.normpath(candidate)
+            if candidate in stories:
+                imported.append(candidate)
+                break
+
+    return imported
+
+
+def dependencies(story: str, sources: dict) -> list:
+    """
+    Returns the story and all the stories it imports, directly or not, in
+    path order.
+    """
+    seen = {story}
+    pending = [story]
+    while pending:
+        current = pending.pop()
+        for imported in imports(current, sources[current], sources):
+            if imported not in seen:
+                seen.add(imported)
+                pending.append(imported)
+
+    return sorted(seen)
+
+
+def compile_stories(stories: list, jobs: int = 1) -> list:
+    """Compiles the stories, and returns their bundles in the same order."""
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1 or len(stories) <= 1:
+        return [compile_story(story) for story in stories]
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(stories))) as pool:
+        bundles = list(pool.map(_compile_story_in_worker, stories))
+
+    # The stories which failed are compiled again here, to raise their
+    # errors in this process.
+    return [
+        compile_story(story) if bundle is None else bundle
+        for story, bundle in zip(stories, bundles)
+    ]
+
+
+def compile_story(story: str) -> dict:
+    from storyscript.App import App
+
+    return json.loads(App.compile(story))
+
+
+def _compile_story_in_worker(story: str):
+    """
+    Compiles a story in a worker process, and returns None if it fails:
+    errors such as StoryError can't be unpickled in the parent, where the
+    pool would raise a BrokenProcessPool instead of them.
+    """
+    try:
+        return compile_story(story)
+    except Exception:
+        return None
+
+
+def merge(bundles: list) -> dict:
+    """
+    Merges compiled bundles into one: dicts (such as "stories") are
+    combined, lists are combined without duplicates, and everything else
+    is taken from the last bundle. The output only depends on the order
+    of the bundles given.
+    """
+    merged = {}
+    for bundle in bundles:
+        for key, value in bundle.items():
+            if isinstance(value, dict):
+                merged.setdefault(key, {}).update(value)
+            elif isinstance(value, list):
+                items = merged.setdefault(key, [])
+                items.extend(item for item in value if item not in items)
+            else:
+                merged[key] = value
+
+    return merged
+
+
+def _hash(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+
+    return digest.hexdigest()
+
+
+def _load(key: str):
+    if not cli.use_cache:
+        return None
+
+    path = os.path.join(COMPILED_DIR, f'{key}.json')
+    try:
+        with open(path, 'r') as f:
+            tree = json.load(f)
+        os.utime(path)  # Recently used entries survive pruning.
+    except (OSError, ValueError):
+        return None
+
+    return tree
+
+
+def _save(key: str, tree: dict):
+    utils.write_atomic(
+        os.path.join(COMPILED_DIR, f'{key}.json'), json.dumps(tree)
+    )
+
+
+def _prune():
+    """Keeps the newest MAX_CACHED_FILES entries of the cache."""
+    paths = [
+        os.path.join(COMPILED_DIR, file) for file in os.listdir(COMPILED_DIR)
+    ]
+    if len(paths) <= MAX_CACHED_FILES:
+        return
+
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:-MAX_CACHED_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,10 +1,12 @@
+import sys
+
 import click
 
 import requests
 
 import semver
 
-from . import storage
+from . import storage, utils
 from .version import version as story_version
 
 PYPI_API_URL = 'https://pypi.org/pypi/story/json'
@@ -15,10 +17,6 @@ http_session = requests.Session()
 
 
 def _latest_pypi():
-    # Restore from cache, if applicable.
-    if 'cli-latest' in storage.cache:
-        return storage.cache['cli-latest']
-
     # Make an HTTP request to the PyPI JSON API.
     try:
         r = http_session.get(url=PYPI_API_URL, timeout=REQUEST_TIMEOUT)
@@ -30,23 +28,34 @@ def _latest_pypi():
     releases = r.json()['releases']
 
     # Grab the latest release.
-    latest = [k for k in releases.keys()][-1]
+    return [k for k in releases.keys()][-1]
 
-    # Store the results in the cache for three hours.
-    storage.cache.store('cli-latest', latest, expires=CACHE_EXPIRES)
 
-    # Parse the version string.
-    return latest
+def refresh_latest():
+    """Looks up the latest version on PyPI, and caches it."""
+    latest = _latest_pypi()
+    if latest:
+        storage.cache.store('cli-latest', latest)
 
 
 def ensure_latest():
+    """
+    Warns if a newer CLI has been released, going by the cached version.
+
+    The cache is refreshed every three hours, by a detached process, so that
+    the command being run never waits on PyPI.
+    """
     current_version = '.'.join(story_version.split('.')[:3])
 
-    # Grab the latest version from PyPi. Valid for three hours.
-    latest_version = _latest_pypi()
+    if 'cli-latest-checked' not in storage.cache:
+        storage.cache.store('cli-latest-checked', True,
+                            expires=CACHE_EXPIRES)
+        utils.spawn_detached([sys.executable, '-m', 'story.ensure'])
+
+    latest_version = storage.cache.fetch('cli-latest')
 
     if latest_version:
-        if semver.cmp(current_version, latest_version) == -1:
+        if semver.compare(current_version, latest_version) == -1:
             click.echo(
                 click.style(
                     f'A new release (v{latest_version}) of the '
@@ -55,3 +64,9 @@ def ensure_latest():
                 ),
                 err=True,
             )
+
+
+if __name__ == '__main__':
+    # Run detached by ensure_latest.
+    storage.init_storage()
+    refresh_latest()
@@ -1,3 +1,5 @@
 import os
 
 SS_GRAPHQL = os.getenv('SS_GRAPHQL', 'https://api.storyscript.io/graphql')
+SS_LOGS = os.getenv('SS_LOGS', 'wss://logs.storyscript.io')
+SS_HTTP_POOL_SIZE = int(os.getenv('SS_HTTP_POOL_SIZE', '10'))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Runs an operation on many apps at once, in a bounded pool of threads.
+
+The operations share the pooled HTTP session (see story.transport), so
+the concurrency is best kept within SS_HTTP_POOL_SIZE.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+from click.globals import pop_context, push_context
+
+DEFAULT_CONCURRENCY = 8
+
+
+def fan_out(func, items: list, concurrency=DEFAULT_CONCURRENCY,
+            on_done=None) -> dict:
+    """
+    Calls func(item) for every item, in up to `concurrency` threads, and
+    returns the errors of the calls which failed, by item.
+
+    on_done(item, error) is called in this thread as every call completes
+    (error is None if it succeeded), to report progress.
+
+    The calls run within the current click context, so that they can exit
+    it (as api.graphql does on errors), which only fails that call.
+    """
+    ctx = click.get_current_context(silent=True)
+
+    def call(item):
+        if ctx is not None:
+            push_context(ctx)
+        try:
+            func(item)
+        finally:
+            if ctx is not None:
+                pop_context()
+
+    errors = {}
+    workers = max(1, min(concurrency, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(call, item): item for item in items}
+        try:
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    future.result()
+                    error = None
+                except (Exception, SystemExit) as e:
+                    errors[item] = error = e
+
+                if on_done is not None:
+                    on_done(item, error)
+        except BaseException:
+            # Don't start on the rest (eg: on ^C), but let the running calls
+            # finish.
+            for future in futures:
+                future.cancel()
+            raise
+
+    return errors
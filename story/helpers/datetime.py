@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import math
+import re
 from datetime import datetime
 
 import pytz
@@ -13,6 +14,21 @@ def parse_psql_date_str(ts: str):
     ).astimezone()
 
 
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_duration(duration: str) -> int:
+    """
+    Returns the number of seconds in a duration such as "90s", "15m", "2h"
+    or "7d". Raises ValueError if it isn't one.
+    """
+    match = re.fullmatch(r'(\d+)([smhd])', duration.strip().lower())
+    if match is None:
+        raise ValueError(f'Invalid duration: {duration}')
+
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
 # https://gist.github.com/deontologician/3503910
 def reltime(date, compare_to=None, at='@'):
     """
@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import heapq
+import itertools
+import json
+import re
+import sys
+import time
+
+import click
+
+DATE_FORMAT = '%b %d %H:%M:%S'
+
+# Coloured lines, the log objects as they were received (one JSON object
+# per line), or just the messages.
+OUTPUTS = ('pretty', 'ndjson', 'raw')
+
+# Rendered lines are written once this many messages are pending, or once
+# the stream has been idle for FLUSH_INTERVAL seconds.
+CHUNK_SIZE = 1000
+FLUSH_INTERVAL = 0.1
+
+# How long lines from several apps are held back, to be merged in order.
+REORDER_WINDOW = 0.5
+
+# How often a LogThrottle reports the lines it's left out, at most.
+REPORT_INTERVAL = 1
+
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+
+def level_rank(level: str) -> int:
+    """Returns the index of the level in LEVELS (info, if unknown)."""
+    level = level.lower()
+    if 'debug' in level:
+        return 0
+    elif 'warn' in level:
+        return 2
+    elif 'crit' in level or 'error' in level:
+        return 3
+
+    return 1  # Default for info.
+
+
+def level_colour(level: str) -> str:
+    return ('blue', 'green', 'yellow', 'red')[level_rank(level)]
+
+
+def styled_prefix(level: str, tag: str) -> str:
+    """Returns the styled level and tag, which follow the date of a line."""
+    colour = level_colour(level)
+    level = level.lower()[:7].rjust(7).upper()
+    tag = tag[:12].rjust(12)
+
+    if tag:
+        return (
+            f'{click.style(level, fg=colour)} '
+            f'{click.style(tag, fg="blue")}: '
+        )
+
+    return f'{click.style(level, fg=colour)} '
+
+
+def decode(messages: list) -> list:
+    """Decodes a chunk of JSON messages, with a single parse if possible."""
+    try:
+        return json.loads(f'[{",".join(messages)}]')
+    except ValueError:
+        return [json.loads(message) for message in messages]
+
+
+class LogFilter:
+    """
+    Matches log lines against a pattern (a regular expression, searched
+    for in the message) and one to exclude, a time range (in milliseconds),
+    a minimum level and a service name.
+    """
+
+    # The filter fields of the log server, by the name of the features
+    # advertised by servers which support them.
+    FIELDS = {
+        'grep': 'pattern',
+        'exclude': 'exclude',
+        'since': 'since_ts',
+        'until': 'until_ts',
+    }
+
+    def __init__(self, pattern=None, since_ts=None, until_ts=None,
+                 level='debug', service_name=None, exclude=None):
+        self.pattern = pattern
+        self.exclude = exclude
+        self.since_ts = since_ts
+        self.until_ts = until_ts
+        self.level = level
+        self.min_rank = level_rank(level)
+        self.service_name = service_name
+
+        self._pattern = re.compile(pattern) if pattern else None
+        self._exclude = re.compile(exclude) if exclude else None
+
+    def match(self, log: dict) -> bool:
+        return (
+            (self.since_ts is None or log['ts'] >= self.since_ts)
+            and (self.until_ts is None or log['ts'] <= self.until_ts)
+            and level_rank(log['level']) >= self.min_rank
+            and (
+                self.service_name is None
+                or log.get('service_name') == self.service_name
+            )
+            and (
+                self._pattern is None
+                or self._pattern.search(log['message']) is not None
+            )
+            and (
+                self._exclude is None
+                or self._exclude.search(log['message']) is None
+            )
+        )
+
+    def split(self, features) -> tuple:
+        """
+        Splits the filter into the fields which the log server supports
+        (given the features it advertises), to send in the filter command,
+        and a LogFilter of the rest, to apply client-side (None if there's
+        nothing left).
+        """
+        fields = {}
+        rest = {attr: getattr(self, attr) for attr in self.FIELDS.values()}
+
+        for feature, attr in self.FIELDS.items():
+            if rest[attr] is not None and feature in features:
+                fields[feature] = rest[attr]
+                rest[attr] = None
+
+        if (
+            all(value is None for value in rest.values())
+            and self.min_rank == 0
+            and self.service_name is None
+        ):
+            return fields, None
+
+        return fields, LogFilter(
+            level=self.level, service_name=self.service_name, **rest
+        )
+
+    def sink(self, sink):
+        """Returns a LogRenderer sink, which passes on matching entries."""
+        match = self.match
+        return lambda entries: sink([e for e in entries if match(e[1])])
+
+
+class LogWriter:
+    """
+    Formats log lines, and writes them out a batch at a time.
+
+    Dates are only formatted once per second, and the styled prefixes are
+    formatted once per (app, level, tag). The ndjson and raw outputs skip
+    the styling and date formatting altogether: ndjson passes the messages
+    through as they were received.
+
+    When following several apps, each line is tagged with its app, in a
+    column app_width wide.
+    """
+
+    def __init__(self, tag=None, output='pretty', app_width=0):
+        assert output in OUTPUTS
+        self.tag = tag
+        self.output = output
+        self.app_width = app_width
+
+        self._second = None
+        self._date = None
+        self._prefixes = {}
+
+    def date(self, ts) -> str:
+        """Returns the styled date of a timestamp (in milliseconds)."""
+        second = int(ts / 1000)
+        if second != self._second:
+            self._second = second
+            self._date = click.style(
+                time.strftime(DATE_FORMAT, time.localtime(second)),
+                fg='white',
+            )
+
+        return self._date
+
+    def prefix(self, level, tag, app=None) -> str:
+        prefix = self._prefixes.get((app, level, tag))
+        if prefix is None:
+            prefix = styled_prefix(level, tag)
+            if app is not None:
+                app_column = click.style(
+                    app[:self.app_width].rjust(self.app_width), fg='magenta'
+                )
+                prefix = f'{app_column} {prefix}'
+
+            self._prefixes[(app, level, tag)] = prefix
+
+        return prefix
+
+    def render(self, log: dict, app=None) -> str:
+        tag = self.tag or log['service_name']
+        return (
+            f'{self.date(log["ts"])} '
+            f'{self.prefix(log["level"], tag, app)}'
+            f'{log["message"]}\n'
+        )
+
+    def line(self, message: str, log: dict, app=None) -> str:
+        if self.output == 'ndjson':
+            if app is not None:
+                return f'{json.dumps(dict(log, app=app))}\n'
+
+            # The messages are single line JSON already.
+            if '\n' not in message:
+                return f'{message}\n'
+
+            return f'{json.dumps(log)}\n'
+
+        elif self.output == 'raw':
+            if app is not None:
+                return f'{app}: {log["message"]}\n'
+
+            return f'{log["message"]}\n'
+
+        return self.render(log, app)
+
+    def write(self, entries: list):
+        """Writes (message, log, app) entries."""
+        if not entries:
+            return
+
+        text = ''.join(self.line(*entry) for entry in entries)
+
+        if self.output == 'pretty':
+            click.echo(text, nl=False)
+        else:
+            # Nothing to style, so skip click's ANSI handling too.
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+
+class LogCursor:
+    """
+    Where a stream is up to, so that it can resume without repeating or
+    skipping lines when it reconnects.
+
+    That's the timestamp of the latest lines, along with how many times
+    each of those lines was received, since several lines (even identical
+    ones) can share a millisecond.
+    """
+
+    def __init__(self):
+        self.ts = None
+        self.seen = collections.Counter()
+        self.gap = None
+
+        self._resume_ts = None
+        self._resume_seen = None
+        self._resuming = False
+
+    @staticmethod
+    def key(log: dict):
+        return log['level'], log.get('service_name'), log['message']
+
+    def resume(self):
+        """
+        Marks a reconnect: lines the cursor has been through are skipped
+        when they're sent again.
+        """
+        self._resume_ts = self.ts
+        self._resume_seen = collections.Counter(self.seen)
+        self._resuming = self.ts is not None
+
+    def advance(self, log: dict) -> bool:
+        """Moves the cursor past the line, returning whether it's new."""
+        ts = log['ts']
+        key = self.key(log)
+
+        if self._resuming:
+            # The first line since reconnecting should be one we've seen,
+            # or else some may have been missed in between.
+            self._resuming = False
+            if ts > self._resume_ts:
+                self.gap = (self._resume_ts, ts)
+
+        if self._resume_ts is not None:
+            if ts < self._resume_ts:
+                return False
+
+            if ts == self._resume_ts and self._resume_seen[key] > 0:
+                self._resume_seen[key] -= 1
+                return False
+
+        if self.ts is None or ts > self.ts:
+            self.ts = ts
+            self.seen = collections.Counter({key: 1})
+        elif ts == self.ts:
+            self.seen[key] += 1
+
+        return True
+
+
+class LogRenderer:
+    """
+    Renders the raw log messages of a stream from the log server, in chunks.
+
+    Messages are decoded a chunk at a time, and the chunk is handed to the
+    sink (a LogWriter's write by default) in one go, once CHUNK_SIZE
+    messages are pending or the stream goes idle. The stream's cursor
+    skips the lines which have been rendered before a reconnect.
+
+    Lines which don't match the log filter are dropped before they reach
+    the sink. The connection sets `match` to the part of the filter which
+    the log server doesn't apply itself.
+    """
+
+    def __init__(self, tag=None, output='pretty', app=None, sink=None,
+                 cursor=None, log_filter=None):
+        self.app = app
+        self.sink = sink or LogWriter(tag=tag, output=output).write
+        self.cursor = cursor or LogCursor()
+        self.log_filter = log_filter
+        self.match = log_filter.match if log_filter else None
+        self.gap_reason = 'the connection to the log server was lost'
+
+        self._pending = []
+        self._flush_handle = None
+
+    def feed(self, message: str):
+        """Queues a raw message, to be rendered with the rest of its chunk."""
+        self._pending.append(message)
+
+        if len(self._pending) >= CHUNK_SIZE:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                FLUSH_INTERVAL, self.flush
+            )
+
+    def flush(self):
+        """Decodes the pending messages, and hands them to the sink."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        messages = self._pending
+        self._pending = []
+
+        # The cursor goes through every line, matching or not.
+        advance = self.cursor.advance
+        entries = [
+            (message, log, self.app)
+            for message, log in zip(messages, decode(messages))
+            if advance(log)
+        ]
+
+        if self.match is not None:
+            match = self.match
+            entries = [entry for entry in entries if match(entry[1])]
+
+        if self.cursor.gap is not None:
+            self.echo_gap(*self.cursor.gap)
+            self.cursor.gap = None
+
+        self.sink(entries)
+
+    def echo_gap(self, since_ts, until_ts):
+        since, until = (
+            time.strftime(DATE_FORMAT, time.localtime(int(ts / 1000)))
+            for ts in (since_ts, until_ts)
+        )
+        app = f' of {self.app}' if self.app else ''
+        click.echo(
+            click.style(
+                f'Some logs{app} may be missing, between {since} and {until} '
+                f'({self.gap_reason}).',
+                fg='yellow',
+            ),
+            err=True,
+        )
+
+
+class LogMerger:
+    """
+    Merges the streams of several apps into timestamp order.
+
+    Lines are held back for up to `window` seconds after they're received,
+    so that lines which arrive a little late on one stream are still
+    written in order with the others.
+    """
+
+    def __init__(self, writer: LogWriter, window=REORDER_WINDOW):
+        self.writer = writer
+        self.window = window
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._release_handle = None
+
+    def push(self, entries: list):
+        """A LogRenderer sink, which queues the entries."""
+        now = time.monotonic()
+        for entry in entries:
+            heapq.heappush(
+                self._heap, (entry[1]['ts'], next(self._counter), now, entry)
+            )
+
+        self._schedule_release()
+
+    def _schedule_release(self):
+        if self._release_handle is not None or not self._heap:
+            return
+
+        delay = max(0, self._heap[0][2] + self.window - time.monotonic())
+        self._release_handle = asyncio.get_event_loop().call_later(
+            delay, self.release
+        )
+
+    def release(self, everything=False):
+        """Writes the lines that have been held back for long enough."""
+        self._release_handle = None
+
+        ready_by = time.monotonic() - self.window
+        entries = []
+        while self._heap and (everything or self._heap[0][2] <= ready_by):
+            entries.append(heapq.heappop(self._heap)[3])
+
+        self.writer.write(entries)
+        self._schedule_release()
+
+    def drain(self):
+        """Writes all the lines held back."""
+        if self._release_handle is not None:
+            self._release_handle.cancel()
+
+        self.release(everything=True)
+
+
+class LogThrottle:
+    """
+    Thins out a flooding stream before it's written, so that the terminal
+    (and the client) keep up, while the shape of the flood still shows.
+
+    Runs of identical lines are collapsed into "last message repeated N
+    times", only one in `sample` lines is kept, and no more than
+    `max_rate` lines a second are passed on to the sink. The lines skipped
+    over the rate are counted, and reported every REPORT_INTERVAL seconds.
+    """
+
+    def __init__(self, sink, max_rate=None, sample=None, collapse=True):
+        self.sink = sink
+        self.max_rate = max_rate
+        self.sample = sample
+        self.collapse = collapse
+
+        self._last = None  # The last entry passed on.
+        self._repeats = 0
+        self._sampled = 0
+        self._tokens = max_rate
+        self._refilled = time.monotonic()
+        self._skipped = 0
+        self._skipped_last = None
+        self._report_handle = None
+
+    @staticmethod
+    def notice(entry, text):
+        """Returns an entry like `entry`, with `text` as its message."""
+        message, log, app = entry
+        log = dict(log, message=text)
+        return json.dumps(log), log, app
+
+    def _allowed(self, now) -> bool:
+        self._tokens = min(
+            self.max_rate,
+            self._tokens + (now - self._refilled) * self.max_rate,
+        )
+        self._refilled = now
+
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    def push(self, entries: list):
+        """A LogRenderer sink, which passes the entries on thinned out."""
+        now = time.monotonic()
+        key = LogCursor.key
+        passed = []
+
+        for entry in entries:
+            if (
+                self.collapse
+                and self._last is not None
+                and key(entry[1]) == key(self._last[1])
+            ):
+                self._repeats += 1
+                continue
+
+            self._end_repeats(passed)
+
+            if self.sample:
+                sampled = self._sampled == 0
+                self._sampled = (self._sampled + 1) % self.sample
+                if not sampled:
+                    continue
+
+            if self.max_rate and not self._allowed(now):
+                self._skipped += 1
+                self._skipped_last = entry
+                continue
+
+            passed.append(entry)
+            self._last = entry
+
+        self.sink(passed)
+
+        if (self._repeats or self._skipped) and self._report_handle is None:
+            self._report_handle = asyncio.get_event_loop().call_later(
+                REPORT_INTERVAL, self.report
+            )
+
+    def _end_repeats(self, entries: list):
+        if self._repeats:
+            entries.append(self.notice(
+                self._last,
+                f'last message repeated {self._repeats:,} times',
+            ))
+            self._repeats = 0
+
+    def report(self):
+        """Passes on the counts of the lines left out since the last one."""
+        self._report_handle = None
+
+        entries = []
+        self._end_repeats(entries)
+
+        if self._skipped:
+            entries.append(self.notice(
+                self._skipped_last,
+                f'{self._skipped:,} lines skipped '
+                f'(over {self.max_rate:,} lines/s)',
+            ))
+            self._skipped = 0
+
+        self.sink(entries)
+
+    def drain(self):
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+
+        self.report()
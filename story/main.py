@@ -3,12 +3,9 @@ import sys
 
 try:
     # Allow keyboard interrupts of CLI import.
+    # Commands are imported on demand, by the CLI group.
     from .cli import cli
 
-    # Import commands for CLI.
-
-    from .commands import *  # noqa
-
 except KeyboardInterrupt:
     print('Aborted!')
     sys.exit(1)
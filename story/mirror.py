@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+A local mirror of the release history of apps, so that listing releases,
+diffing them and picking rollback targets don't query it every time.
+
+The mirror only holds the releases which were asked for: the first time,
+just the ones listed (or picked) are fetched. It records the range of
+versions it has all of, from the latest one down, which later requests
+extend downwards on demand. Releases are only ever added, and they only
+change state until they've settled, so keeping the range up to date only
+takes fetching the releases newer than the ones which have settled
+(newest first, in small pages), which is usually one small query.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+from . import cli
+from . import storage
+from .api import Apps, PENDING_STATES, Releases
+
+MIRROR_PATH = os.path.join(storage.CACHE_DIR, 'releases.sqlite3')
+
+# The page size of incremental syncs, which usually fetch a release or two.
+SYNC_PAGE_SIZE = 10
+
+FIELDS = ('id', 'state', 'message', 'timestamp', 'config_hash')
+
+
+def config_hash(config: dict) -> str:
+    """A canonical hash of a release's config."""
+    config = json.dumps(config or {}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+class ReleaseMirror:
+    def __init__(self, path=None):
+        self.path = path or MIRROR_PATH
+        self._synced = {}
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Wait for other CLI processes' syncs, rather than failing.
+        self._db = sqlite3.connect(self.path, timeout=10)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS releases ('
+                '  app_uuid TEXT NOT NULL,'
+                '  id INTEGER NOT NULL,'
+                '  state TEXT NOT NULL,'
+                '  message TEXT,'
+                '  timestamp TEXT NOT NULL,'
+                '  config_hash TEXT NOT NULL,'
+                '  PRIMARY KEY (app_uuid, id)'
+                ')'
+            )
+            # Every release from low (0 once the first release is in) to
+            # high, the latest one as of the last sync, is mirrored.
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS coverage ('
+                '  app_uuid TEXT PRIMARY KEY,'
+                '  low INTEGER NOT NULL,'
+                '  high INTEGER NOT NULL'
+                ')'
+            )
+
+    def close(self):
+        self._db.close()
+
+    def coverage(self, app_uuid):
+        """Returns the (low, high) range of versions mirrored, if any."""
+        row = self._db.execute(
+            'SELECT low, high FROM coverage WHERE app_uuid = ?', (app_uuid,)
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def settled_id(self, app_uuid):
+        """
+        Returns the version up to which the mirror has every release of the
+        app, in its final state, if any.
+        """
+        coverage = self.coverage(app_uuid)
+        if coverage is None:
+            return None
+
+        low, high = coverage
+        pending_id, = self._db.execute(
+            'SELECT MIN(id) FROM releases '
+            'WHERE app_uuid = ? AND id >= ? AND state IN (?, ?)',
+            (app_uuid, low, *PENDING_STATES),
+        ).fetchone()
+        if pending_id is not None:
+            return pending_id - 1
+
+        return high
+
+    def sync(self, app: str) -> str:
+        """
+        Fetches the app's releases which are new, or may have changed,
+        since the last sync (once per mirror), and returns the app's uuid.
+
+        With --no-cache, what was mirrored of the app is dropped instead,
+        to be fetched again as it's asked for.
+        """
+        if app in self._synced:
+            return self._synced[app]
+
+        app_uuid = self._synced[app] = Apps.get_uuid_from_hostname(app)
+
+        if not cli.use_cache:
+            with self._db:
+                for table in ('releases', 'coverage'):
+                    self._db.execute(
+                        f'DELETE FROM {table} WHERE app_uuid = ?', (app_uuid,)
+                    )
+            return app_uuid
+
+        settled_id = self.settled_id(app_uuid)
+        if settled_id is None:
+            return app_uuid
+
+        # Pages are only fetched as far as the releases are iterated.
+        releases = (
+            release
+            for page in Releases.pages(
+                app, page_size=SYNC_PAGE_SIZE, with_config=True
+            )
+            for release in page
+        )
+
+        fetched = []
+        for release in releases:
+            if release['id'] <= settled_id:
+                break
+
+            fetched.append(release)
+
+        if fetched:
+            low, high = self.coverage(app_uuid)
+            self._store(app_uuid, fetched)
+            self._cover(app_uuid, low, max(high, fetched[0]['id']))
+
+        return app_uuid
+
+    def releases(self, app: str, limit: int = None, before: int = None,
+                 after: int = None) -> list:
+        """
+        Returns up to `limit` of the app's releases, oldest first. That's
+        the latest ones, or the ones before or after a version (ids are
+        exclusive bounds), like Releases.pages().
+
+        They're read from the mirror, once it's synced. Only the ones it
+        doesn't have are fetched (and mirrored).
+        """
+        app_uuid = self.sync(app)
+
+        coverage = self.coverage(app_uuid)
+        if coverage is None:
+            fetched = self._fetch(app, app_uuid, limit, before, after)
+            if before is None and after is None:
+                ids = [release['id'] for release in fetched]
+                exhausted = limit is None or len(fetched) < limit
+                self._cover(
+                    app_uuid,
+                    0 if exhausted else min(ids),
+                    max(ids, default=0),
+                )
+            return fetched
+
+        low, high = coverage
+        if low == 0 or (after is not None and after >= low - 1):
+            # All of it is mirrored.
+            pass
+        elif before is not None and before < low:
+            # None of it is, nor does it adjoin what is.
+            return self._fetch(app, app_uuid, limit, before, after)
+        elif before is None and after is not None:
+            # It starts below what's mirrored.
+            fetched = self._fetch(app, app_uuid, limit, after=after)
+            if not (
+                limit is None
+                or len(fetched) < limit
+                or fetched[-1]['id'] >= low
+            ):
+                return fetched
+
+            self._cover(app_uuid, after + 1, high)
+            low = after + 1
+        else:
+            # It starts with what's mirrored, and may reach below it.
+            mirrored = self._read(app_uuid, low, limit, before, after)
+            missing = None if limit is None else limit - len(mirrored)
+            if missing is None or missing > 0:
+                fetched = self._fetch(app, app_uuid, missing, low, after)
+                if missing is None or len(fetched) < missing:
+                    low = 0 if after is None else after + 1
+                else:
+                    low = fetched[0]['id']
+
+                self._cover(app_uuid, low, high)
+
+        return self._read(app_uuid, low, limit, before, after)
+
+    def get(self, app: str, version: int):
+        """Returns one of the app's releases, if there's such a version."""
+        releases = self.releases(app, limit=1, before=version + 1)
+        if releases and releases[0]['id'] == version:
+            return releases[0]
+
+        return None
+
+    def latest(self, app: str):
+        """Returns the app's latest release, if any."""
+        releases = self.releases(app, limit=1)
+        return releases[-1] if releases else None
+
+    def _fetch(self, app, app_uuid, limit, before=None, after=None) -> list:
+        """Fetches and mirrors releases, and returns them oldest first."""
+        releases = [
+            release
+            for page in Releases.pages(
+                app, limit=limit, before=before, after=after, with_config=True
+            )
+            for release in page
+        ]
+        return sorted(
+            self._store(app_uuid, releases), key=lambda r: r['id']
+        )
+
+    def _store(self, app_uuid, releases: list) -> list:
+        rows = [
+            {
+                'id': release['id'],
+                'state': release['state'],
+                'message': release['message'],
+                'timestamp': release['timestamp'],
+                'config_hash': config_hash(release['config']),
+            }
+            for release in releases
+        ]
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (app_uuid, *[row[field] for field in FIELDS])
+                    for row in rows
+                ],
+            )
+
+        return rows
+
+    def _cover(self, app_uuid, low, high):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)',
+                (app_uuid, low, high),
+            )
+
+    def _read(self, app_uuid, low, limit, before, after) -> list:
+        """Reads mirrored releases from low up, like releases()."""
+        order = 'ASC' if after is not None and before is None else 'DESC'
+        rows = self._db.execute(
+            f'SELECT {", ".join(FIELDS)} FROM releases '
+            'WHERE app_uuid = ? AND id >= ?'
+            '  AND (? IS NULL OR id < ?) AND (? IS NULL OR id > ?) '
+            f'ORDER BY id {order} LIMIT ?',
+            (
+                app_uuid,
+                low,
+                before,
+                before,
+                after,
+                after,
+                -1 if limit is None else limit,
+            ),
+        ).fetchall()
+
+        return sorted((dict(row) for row in rows), key=lambda r: r['id'])
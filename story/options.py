@@ -21,3 +21,47 @@ def app(allow_option=True):
             context.command.name, app, _app, allow_option
         ),
     )
+
+
+def apps():
+    """
+    Like app(), but the option may be given several times. The apps are
+    checked by assert_apps() rather than on parsing, so that groups (whose
+    options are parsed before their sub commands run) can skip it.
+    """
+    return click.option(
+        '--app',
+        '-a',
+        'apps',
+        multiple=True,
+        default=[_app] if _app else [],
+        help=f'Apps to interact with, may be repeated [default: {_app}].',
+    )
+
+
+def assert_apps(command, apps) -> tuple:
+    return tuple(
+        cli.assert_project(command, app, _app, True) for app in apps or [None]
+    )
+
+
+def jobs():
+    return click.option(
+        '--jobs',
+        '-j',
+        default=1,
+        type=click.IntRange(min=0),
+        help='Compile stories in N parallel processes (0 for one per CPU).',
+    )
+
+
+def concurrency():
+    from .fanout import DEFAULT_CONCURRENCY
+
+    return click.option(
+        '--concurrency',
+        '-c',
+        default=DEFAULT_CONCURRENCY,
+        type=click.IntRange(min=1),
+        help='Work on up to N apps at once.',
+    )
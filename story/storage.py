@@ -1,10 +1,20 @@
 import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from time import time
 
 import appdirs
 
+from . import utils
+
+try:
+    import fcntl
+except ImportError:  # Windows.
+    fcntl = None
+
 CACHE_DIR = appdirs.user_cache_dir(
     appname='storyscript-cli', appauthor='asyncy'
 )
@@ -14,15 +24,27 @@ STORAGE_DIR = appdirs.user_state_dir(
 
 
 class Storage:
+    """
+    A JSON file backed key/value store.
+
+    Changes are written straight away, unless they're made within a
+    transaction, in which case they're written once, when it ends.
+    Writes are atomic, and are merged with changes made to the file by
+    other processes in the meantime.
+    """
+
     def __init__(self, path):
         self.path = path
         self._data = {}
+        self._changed = set()
+        self._transactions = 0
 
         self._touch()
         self._load()
         self._ensure()
 
     def remove_file_on_disk(self):
+        self._changed.clear()
         os.remove(self.path)
 
     def _touch(self):
@@ -36,28 +58,82 @@ class Storage:
             f.write('')
 
     def _load(self):
-        with open(self.path, 'r') as f:
-            try:
-                self._data.update(json.load(f))
-            except ValueError:
-                pass
+        self._data.update(self._read())
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
     def _ensure(self):
-        for k in self._data:
-            if k.startswith('_'):
-                if '_expires' in k:
-                    expires_key = f'_{k}_expires'
-                    try:
-                        if time() > self._data[expires_key]:
-                            self.delete(k)
-                            self.delete(expires_key)
-
-                    except KeyError:
-                        pass
+        # Evict expired keys, along with their expiry markers.
+        expired = [
+            k for k in self._data
+            if k.startswith('_') and k.endswith('_expires')
+            and time() > self._data[k]
+        ]
+
+        for expires_key in expired:
+            key = expires_key[1:-len('_expires')]
+            self._data.pop(key, None)
+            del self._data[expires_key]
+            self._changed.update((key, expires_key))
+
+        if expired:
+            self._save()
 
     def _save(self):
-        with open(self.path, 'w') as f:
-            json.dump(self._data, f)
+        if self._transactions == 0:
+            self.flush()
+
+    @contextmanager
+    def _lock(self):
+        """Serialises writes across CLI processes, where supported."""
+        if fcntl is None:
+            yield
+            return
+
+        with open(f'{self.path}.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def flush(self):
+        """Writes the pending changes, on top of what's on disk now."""
+        if not self._changed:
+            return
+
+        with self._lock():
+            data = self._read()
+            for key in self._changed:
+                if key in self._data:
+                    data[key] = self._data[key]
+                else:
+                    data.pop(key, None)
+
+            utils.write_atomic(self.path, json.dumps(data))
+
+        self._changed.clear()
+
+    def begin(self):
+        self._transactions += 1
+
+    def commit(self):
+        self._transactions -= 1
+        self._save()
+
+    @contextmanager
+    def transaction(self):
+        """Buffers the changes made within, and writes them at once."""
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
 
     def fetch(self, key, default=None):
         return self._data.get(key, default)
@@ -68,7 +144,10 @@ class Storage:
         # Set expiration, if applicable.
         if expires:
             self._data[f'_{key}_expires'] = time() + expires
+        else:
+            self._data.pop(f'_{key}_expires', None)
 
+        self._changed.update((key, f'_{key}_expires'))
         self._save()
 
     def copy_from(self, path, delete=False):
@@ -81,8 +160,9 @@ class Storage:
                 old_contents = json.load(f)
 
             # Copy the items over.
-            for (k, v) in old_contents.items():
-                self.store(k, v)
+            with self.transaction():
+                for (k, v) in old_contents.items():
+                    self.store(k, v)
 
             # Delete the file, if requested.
             if delete:
@@ -93,6 +173,8 @@ class Storage:
 
     def delete(self, key):
         del self._data[key]
+        self._data.pop(f'_{key}_expires', None)
+        self._changed.update((key, f'_{key}_expires'))
         self._save()
 
     def as_dict(self):
@@ -105,15 +187,236 @@ class Storage:
         return self._data.__getitem__(*args, **kwargs)
 
 
-cache: Storage = None
+class SQLiteStorage:
+    """
+    A SQLite backed key/value store, with the same interface as Storage.
+
+    Every key expires on its own (expired keys are swept on load, using an
+    index), and the least recently used keys are evicted beyond
+    max_entries. Changes are buffered like Storage's, and written in a
+    single SQLite transaction.
+
+    It may be shared by threads (see story.fanout).
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._pending = {}
+        self._accessed = set()
+        self._transactions = 0
+        self._lock = threading.RLock()
+
+        if os.path.dirname(self.path) != '':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # Wait for other CLI processes' writes, rather than failing.
+        self._db = sqlite3.connect(
+            self.path, timeout=10, check_same_thread=False
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                '  key TEXT PRIMARY KEY,'
+                '  value TEXT NOT NULL,'
+                '  expires REAL,'
+                '  accessed REAL NOT NULL'
+                ')'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS cache_accessed '
+                'ON cache (accessed)'
+            )
+            self._db.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time(),)
+            )
+
+    def remove_file_on_disk(self):
+        self._pending.clear()
+        self._accessed.clear()
+        self._db.close()
+        for path in (self.path, f'{self.path}-wal', f'{self.path}-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _row(self, key):
+        """Returns the (value, expires) of the key, or None if it's not set."""
+        with self._lock:
+            if key in self._pending:
+                row = self._pending[key]
+            else:
+                row = self._db.execute(
+                    'SELECT value, expires FROM cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    row = (json.loads(row[0]), row[1])
+
+        if row is None or (row[1] is not None and row[1] <= time()):
+            return None
+
+        return row
+
+    def _save(self):
+        if self._transactions == 0:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending changes, in a single transaction."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending and not self._accessed:
+            return
+
+        now = time()
+        with self._db:
+            for key, row in self._pending.items():
+                if row is None:
+                    self._db.execute(
+                        'DELETE FROM cache WHERE key = ?', (key,)
+                    )
+                else:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO cache '
+                        '(key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                        (key, json.dumps(row[0]), row[1], now),
+                    )
+
+            self._db.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?',
+                [(now, key) for key in self._accessed],
+            )
+
+            # Evict the least recently used keys.
+            self._db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                '  SELECT key FROM cache ORDER BY accessed DESC'
+                '  LIMIT -1 OFFSET ?'
+                ')',
+                (self.max_entries,),
+            )
+
+        self._pending.clear()
+        self._accessed.clear()
+
+    def begin(self):
+        self._transactions += 1
+
+    def commit(self):
+        self._transactions -= 1
+        self._save()
+
+    @contextmanager
+    def transaction(self):
+        """Buffers the changes made within, and writes them at once."""
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def fetch(self, key, default=None):
+        row = self._row(key)
+        if row is None:
+            return default
+
+        with self._lock:
+            self._accessed.add(key)
+
+        return row[0]
+
+    def store(self, key, value, expires=False):
+        with self._lock:
+            self._pending[key] = (
+                value, time() + expires if expires else None
+            )
+            self._save()
+
+    def copy_from(self, path, delete=False):
+        """Migrates the keys of a Storage file, along with their expiry."""
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'r') as f:
+            try:
+                old_contents = json.load(f)
+            except ValueError:
+                old_contents = {}
+
+        with self.transaction():
+            for (k, v) in old_contents.items():
+                if k.startswith('_') and k.endswith('_expires'):
+                    continue
+
+                expires = old_contents.get(f'_{k}_expires')
+                if expires is None:
+                    self.store(k, v)
+                elif expires > time():
+                    self.store(k, v, expires=expires - time())
+
+        if delete:
+            os.remove(path)
+
+    def delete(self, key):
+        with self._lock:
+            if self._row(key) is None:
+                raise KeyError(key)
+
+            self._pending[key] = None
+            self._save()
+
+    def as_dict(self):
+        with self._lock:
+            data = {
+                key: json.loads(value)
+                for key, value in self._db.execute(
+                    'SELECT key, value FROM cache '
+                    'WHERE expires IS NULL OR expires > ?',
+                    (time(),),
+                )
+            }
+            for key in self._pending:
+                row = self._row(key)
+                if row is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = row[0]
+
+        return data
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+
+        with self._lock:
+            self._accessed.add(key)
+
+        return row[0]
+
+
+cache: SQLiteStorage = None
 config: Storage = None
 
 
 def init_storage(config_loc: str = None):
     global cache, config
 
-    cache_file = os.path.join(CACHE_DIR, 'cache.json')
-    cache = Storage(path=cache_file)
+    # Don't lose changes buffered by the instances being replaced.
+    for storage in (cache, config):
+        if storage is not None:
+            storage.flush()
+
+    cache = SQLiteStorage(path=os.path.join(CACHE_DIR, 'cache.sqlite3'))
+    cache.copy_from(os.path.join(CACHE_DIR, 'cache.json'), delete=True)
 
     if config_loc is None:
         config_loc = os.path.join(STORAGE_DIR, 'config.json')
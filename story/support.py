@@ -1,5 +1,6 @@
 import json
 import os
+import subprocess
 import sys
 
 import click
@@ -45,3 +46,43 @@ def echo_support():
         pass
 
     # TODO: this.
+
+
+def startup_profile(module='story.main') -> dict:
+    """
+    Imports the CLI in a fresh interpreter, with -X importtime, and returns
+    the time spent importing each top level package (in seconds).
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+    packages = {}
+    for line in process.stderr.decode().splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us = int(fields[0])
+        except ValueError:
+            continue  # The header.
+
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us / 1e6
+
+    return packages
+
+
+def echo_startup_profile(limit=15):
+    packages = startup_profile()
+    total = sum(packages.values())
+
+    click.echo(f'Importing the CLI took {total * 1000:.1f}ms, of which:')
+    for package, secs in sorted(
+        packages.items(), key=lambda item: item[1], reverse=True
+    )[:limit]:
+        click.echo(f'  {package:<24} {secs * 1000:7.1f}ms')
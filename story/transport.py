@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+A shared, pooled HTTP session for all of the CLI's HTTP traffic.
+
+Connections are kept alive and reused across calls made by the same
+command, and idempotent requests are retried with an exponential backoff.
+Large request bodies are compressed, falling back to whichever encoding
+the server accepts if it rejects them (see RFC 7694).
+"""
+import gzip
+import time
+import zlib
+
+import click
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import storage
+from .environment import SS_HTTP_POOL_SIZE
+
+RETRIES = 3
+RETRY_BACKOFF = 0.25
+RETRY_STATUS_CODES = (502, 503, 504)
+
+COMPRESS_MIN_SIZE = 16 * 1024
+ENCODERS = {'gzip': gzip.compress, 'deflate': zlib.compress}
+ENCODING_EXPIRES = 60 * 60 * 24
+
+session = requests.Session()
+session.headers['Connection'] = 'keep-alive'
+
+_adapter = HTTPAdapter(
+    pool_connections=SS_HTTP_POOL_SIZE, pool_maxsize=SS_HTTP_POOL_SIZE
+)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+timings = []
+"""(method, url, status code, seconds) of every request made so far."""
+
+uploads = []
+"""(url, body size, bytes sent, encoding) of every request body sent."""
+
+_encodings = {}
+
+
+def post(url, idempotent=False, data=None, headers=None, **kwargs):
+    """
+    POSTs through the shared session.
+
+    Only requests which are safe to repeat (idempotent=True) are retried,
+    on connection errors, timeouts and gateway errors.
+    """
+    encoding = _request_encoding(url, data)
+    res = _post(url, idempotent, data, headers, encoding, **kwargs)
+
+    if encoding != 'identity' and res.status_code == 415:
+        # The server couldn't decode the body, so it did not process it.
+        # Send it again, in an encoding the server says that it accepts.
+        accepted = res.headers.get('Accept-Encoding', '').split(',')
+        accepted = [e.strip().lower() for e in accepted]
+        encoding = next((e for e in ENCODERS if e in accepted), 'identity')
+        _remember_encoding(url, encoding)
+
+        res = _post(url, idempotent, data, headers, encoding, **kwargs)
+
+    return res
+
+
+def _request_encoding(url, data) -> str:
+    if data is None or len(data) < COMPRESS_MIN_SIZE:
+        return 'identity'
+
+    if url not in _encodings and storage.cache is not None:
+        _encodings[url] = storage.cache.fetch(f'request-encoding-{url}')
+
+    return _encodings.get(url) or 'gzip'
+
+
+def _remember_encoding(url, encoding):
+    _encodings[url] = encoding
+    if storage.cache is not None:
+        storage.cache.store(
+            f'request-encoding-{url}', encoding, expires=ENCODING_EXPIRES
+        )
+
+
+def _post(url, idempotent, data, headers, encoding, **kwargs):
+    if data is not None:
+        raw = data.encode() if isinstance(data, str) else data
+        body = raw
+        if encoding != 'identity':
+            body = ENCODERS[encoding](raw)
+            headers = dict(headers or {}, **{'Content-Encoding': encoding})
+
+        uploads.append((url, len(raw), len(body), encoding))
+        data = body
+
+    attempts = RETRIES + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        start = time.perf_counter()
+        try:
+            res = session.post(url, data=data, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            timings.append(('POST', url, None, time.perf_counter() - start))
+            if last_attempt:
+                raise
+        else:
+            timings.append(
+                ('POST', url, res.status_code, time.perf_counter() - start)
+            )
+            if last_attempt or res.status_code not in RETRY_STATUS_CODES:
+                return res
+
+        time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+def connection_stats() -> (int, int):
+    """Returns the number of requests made, and connections opened."""
+    requests_made = connections_opened = 0
+
+    # The same adapter is mounted for more than one prefix.
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_made += pool.num_requests
+            connections_opened += pool.num_connections
+
+    return requests_made, connections_opened
+
+
+def echo_stats():
+    """Prints per-request timings and the connection reuse rate."""
+    for method, url, status, elapsed in timings:
+        click.echo(
+            f'{method} {url} -> {status or "failed"} '
+            f'({elapsed * 1000:.0f}ms)',
+            err=True,
+        )
+
+    requests_made, connections_opened = connection_stats()
+    if requests_made:
+        reuse_rate = (requests_made - connections_opened) / requests_made
+        click.echo(
+            f'{requests_made} request(s) over {connections_opened} '
+            f'connection(s), {reuse_rate:.0%} connection reuse',
+            err=True,
+        )
+
+
+def echo_upload_stats():
+    """Prints the size of each request body, and how well it compressed."""
+    for url, size, sent, encoding in uploads:
+        saved = 1 - sent / size if size else 0
+        click.echo(
+            f'Uploaded {_human_size(sent)} to {url} '
+            f'({_human_size(size)} {encoding}, {saved:.0%} saved)',
+            err=True,
+        )
+
+
+def _human_size(size: int) -> str:
+    if size < 1024:
+        return f'{size}B'
+    elif size < 1024 * 1024:
+        return f'{size / 1024:.1f}KB'
+    else:
+        return f'{size / 1024 / 1024:.1f}MB'
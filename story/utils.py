@@ -1,4 +1,7 @@
 import os
+import subprocess
+import sys
+import tempfile
 
 
 def find_story_yml():
@@ -51,3 +54,44 @@ def get_asyncy_yaml(must_exist=True) -> dict:
             return yaml.safe_load(s)
     except Exception:
         return {}
+
+
+def write_atomic(path: str, content: str):
+    """
+    Writes the file via a temporary file and a rename, so that readers
+    never see a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def spawn_detached(args: list):
+    """
+    Starts a process which outlives the CLI, without waiting for it or
+    sharing its terminal.
+    """
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = (
+            subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        )
+    else:
+        kwargs['start_new_session'] = True
+
+    subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        **kwargs,
+    )
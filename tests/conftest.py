@@ -1,11 +1,15 @@
+import asyncio
 import json
 import os
+import threading
 from unittest.mock import MagicMock
 
 from click.testing import CliRunner, Result
 
 import pytest
 
+import websockets
+
 STORYSCRIPT_CONFIG = {
     'id': os.environ.get('STORYSCRIPT_INT_CONF_USER_ID', 'my_user_id'),
     'access_token': os.environ.get('STORYSCRIPT_INT_CONF_ACCESS_TOKEN',
@@ -133,3 +137,33 @@ def init_sample_app_in_cwd():
 @pytest.fixture
 def app_dir():
     pass
+
+
+@pytest.fixture
+def websocket_server():
+    """
+    Starts a local websocket server (a stand-in for the log server) with
+    the given handler, on its own thread. Returns the server's URL.
+    """
+    servers = []
+
+    def start(handler):
+        loop = asyncio.new_event_loop()
+
+        async def serve():
+            return await websockets.serve(handler, 'localhost', 0)
+
+        server = loop.run_until_complete(serve())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        servers.append((loop, server, thread))
+
+        port = server.sockets[0].getsockname()[1]
+        return f'ws://localhost:{port}'
+
+    yield start
+
+    for loop, server, thread in servers:
+        loop.call_soon_threadsafe(server.close)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
@@ -164,23 +164,55 @@ def test_destroy(patch, runner, init_sample_app_in_cwd, all_apps,
         for i in range(1, 4):
             assert f'Destroying application \'my_app_{i}\'' in result.stdout
 
-        assert api.Apps.destroy.mock_calls == [
+        # The apps are destroyed concurrently, in any order.
+        assert api.Apps.destroy.call_count == 3
+        api.Apps.destroy.assert_has_calls([
             mock.call(app='my_app_1'),
             mock.call(app='my_app_2'),
             mock.call(app='my_app_3'),
-        ]
+        ], any_order=True)
 
-        assert cli.track.mock_calls == [
+        assert cli.track.call_count == 3
+        cli.track.assert_has_calls([
             mock.call('App Destroyed', {'App name': 'my_app_1'}),
             mock.call('App Destroyed', {'App name': 'my_app_2'}),
             mock.call('App Destroyed', {'App name': 'my_app_3'}),
-        ]
+        ], any_order=True)
     else:
         assert f'Destroying application \'{app_name}\'' in result.stdout
         api.Apps.destroy.assert_called_with(app=app_name)
         cli.track.assert_called_with('App Destroyed', {'App name': app_name})
 
 
+def test_destroy_all_aggregates_errors(patch, runner, init_sample_app_in_cwd):
+    def destroy(app):
+        if app == 'my_app_2':
+            click.get_current_context().exit(1)  # As api.graphql does.
+
+    patch.object(api.Apps, 'destroy', side_effect=destroy)
+    patch.object(api.Apps, 'list', return_value=[
+        {'name': 'my_app_1'},
+        {'name': 'my_app_2'},
+        {'name': 'my_app_3'},
+    ])
+    patch.object(cli, 'track')
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import apps
+        result = runner.run(apps.destroy, exit_code=1,
+                            args=['--all', '--yes', '--concurrency', '2'])
+
+    assert api.Apps.destroy.call_count == 3
+    assert '[3/3] Destroying application' in result.stdout
+    assert 'Failed to destroy 1 of 3 applications: my_app_2' in result.stdout
+    cli.track.assert_has_calls([
+        mock.call('App Destroyed', {'App name': 'my_app_1'}),
+        mock.call('App Destroyed', {'App name': 'my_app_3'}),
+    ], any_order=True)
+
+
 def test_create_inside_an_existing_project(runner, init_sample_app_in_cwd):
     with runner.runner.isolated_filesystem():
         init_sample_app_in_cwd()
@@ -1,7 +1,29 @@
 # -*- coding: utf-8 -*-
+import json
 import time
+from unittest import mock
 
-from pytest import mark
+from pytest import fixture, mark
+
+
+def releases_get(polled, latest=None):
+    """
+    Stands in for Releases.get: the pre-flight (batched) call gets the
+    latest release, and each poll gets the next of the polled results.
+    """
+    from story import api
+
+    polled = iter(polled)
+
+    def get(app, batch=None):
+        if batch is None:
+            return next(polled)
+
+        pending = api.Pending(None)
+        pending.result = latest or [{'id': 41, 'state': 'DEPLOYED'}]
+        return pending
+
+    return get
 
 
 @mark.parametrize('with_message', [True, False])
@@ -11,7 +33,7 @@ from pytest import mark
 ])
 @mark.parametrize('maintenance', [True, False])
 @mark.parametrize('payload', [None, 'my_super_complex_payload'])
-def test_deploy(runner, with_message, patch, hard_deployment,
+def test_deploy(runner, with_message, patch, async_mock, hard_deployment,
                 final_release_state, maintenance, payload,
                 init_sample_app_in_cwd):
     with runner.runner.isolated_filesystem():
@@ -21,20 +43,28 @@ def test_deploy(runner, with_message, patch, hard_deployment,
         # the cli init code in an isolated filesystem, inside an app dir.
         # Weird things happen otherwise. Not the most efficient way, but works.
         from story import api
+        from story.commands import deploy as deploy_module
         from story.commands import test
         from story.commands.deploy import deploy
 
         patch.object(test, 'compile_app', return_value=payload)
+        # The log server can't push release states, fall back to polling.
+        patch.object(deploy_module, 'watch_release',
+                     new=async_mock(return_value=None))
         patch.object(time, 'sleep')
 
-        patch.object(api.Config, 'get')
-        patch.object(api.Releases, 'create')
-        patch.object(api.Releases, 'get', side_effect=[
+        patch.object(api.Apps, 'get_uuid_from_hostname')
+        patch.object(api.Config, 'get', return_value=api.Pending(None))
+        api.Config.get.return_value.result = {'my': 'config'}
+        patch.object(api.Releases, 'create', return_value={'id': 42})
+        patch.object(api.Releases, 'get', side_effect=releases_get([
             [{'state': 'QUEUED'}],
             [{'state': 'DEPLOYING'}],
             [{'state': final_release_state}],
-        ])
-        patch.object(api.Apps, 'maintenance', return_value=maintenance)
+        ]))
+        patch.object(api.Apps, 'maintenance',
+                     return_value=api.Pending(None))
+        api.Apps.maintenance.return_value.result = maintenance
 
         args = []
 
@@ -59,11 +89,14 @@ def test_deploy(runner, with_message, patch, hard_deployment,
             assert 'Your app is in maintenance mode.' in result.stdout
             return
 
-        api.Config.get.assert_called_with('my_app')
+        api.Config.get.assert_called_with('my_app', batch=mock.ANY)
+        api.Apps.maintenance.assert_called_with(
+            'my_app', maintenance=None, batch=mock.ANY)
         api.Releases.create.assert_called_with(
-            api.Config.get(), payload, 'my_app', message, hard_deployment)
+            api.Config.get().result, payload, 'my_app', message,
+            hard_deployment)
 
-        assert time.sleep.call_count == 3
+        assert time.sleep.mock_calls == [mock.call(0.5), mock.call(1.0)]
 
         if final_release_state == 'DEPLOYED':
             assert 'Deployment successful!' in result.stdout
@@ -77,3 +110,145 @@ def test_deploy(runner, with_message, patch, hard_deployment,
             assert f'An unhandled state of your app has been encountered ' \
                    f'- {final_release_state}' in result.stdout
             assert 'support@storyscript.io' in result.stdout
+
+
+@mark.parametrize('force', [True, False])
+@mark.parametrize('hard', [True, False])
+@mark.parametrize('changed', [True, False])
+@mark.parametrize('latest_state', ['DEPLOYED', 'FAILED'])
+def test_deploy_skips_unchanged_releases(runner, patch, async_mock,
+                                         init_sample_app_in_cwd, force, hard,
+                                         changed, latest_state):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story import api, storage
+        from story.commands import deploy as deploy_module
+        from story.commands import test
+        from story.commands.deploy import deploy
+
+        patch.object(test, 'compile_app', return_value={'stories': {}})
+        patch.object(deploy_module, 'watch_release',
+                     new=async_mock(return_value='DEPLOYED'))
+
+        patch.object(api.Apps, 'get_uuid_from_hostname')
+        patch.object(api.Config, 'get', return_value=api.Pending(None))
+        api.Config.get.return_value.result = {'FOO': 'bar'}
+        patch.object(api.Apps, 'maintenance', return_value=api.Pending(None))
+        api.Apps.maintenance.return_value.result = False
+        patch.object(api.Releases, 'create', return_value={'id': 42})
+        patch.object(api.Releases, 'get', side_effect=releases_get(
+            [], latest=[{'id': 41, 'state': latest_state}]))
+
+        deployed_hash = deploy_module.payload_hash(
+            {'FOO': 'bar'}, {'stories': {}})
+        if changed:
+            deployed_hash = 'another_hash'
+
+        runner.run(deploy, exit_code=0, args=[])  # Initialises storage.
+        storage.cache.store('release-my_app',
+                            {'id': 41, 'hash': deployed_hash})
+        api.Releases.create.reset_mock()
+
+        args = []
+        if force:
+            args.append('--force')
+        if hard:
+            args.append('--hard')
+
+        result = runner.run(deploy, exit_code=0, args=args)
+
+    if changed or force or hard or latest_state != 'DEPLOYED':
+        api.Releases.create.assert_called_once()
+        assert 'Deployment successful!' in result.stdout
+        assert storage.cache.fetch('release-my_app') == {
+            'id': 42,
+            'hash': deploy_module.payload_hash(
+                {'FOO': 'bar'}, {'stories': {}}),
+        }
+    else:
+        api.Releases.create.assert_not_called()
+        assert 'Version 41 of your app is already deployed' in result.stdout
+        assert 'story deploy --force' in result.stdout
+
+
+def test_payload_hash_is_canonical():
+    from story.commands.deploy import payload_hash
+
+    assert payload_hash({'a': 1, 'b': 2}, {'stories': {'x': [1]}}) == \
+        payload_hash({'b': 2, 'a': 1}, {'stories': {'x': [1]}})
+    assert payload_hash({'a': 1}, {}) != payload_hash({'a': 2}, {})
+
+
+@fixture
+def log_server(websocket_server, patch):
+    """
+    A stand-in log server, which pushes the given release states, if
+    it supports pushing them at all.
+    """
+    def start(features, states):
+        received = []
+
+        async def handler(websocket, path=None):
+            received.append(json.loads(await websocket.recv()))
+            await websocket.send(json.dumps({
+                'authorised': True,
+                'features': features,
+            }))
+
+            if 'release_state' in features:
+                received.append(json.loads(await websocket.recv()))
+                for state in states:
+                    await websocket.send(json.dumps({'state': state}))
+
+            await websocket.wait_closed()
+
+        from story.commands import deploy
+        patch.object(deploy, 'SS_LOGS', websocket_server(handler))
+        return received
+
+    return start
+
+
+@mark.parametrize('push_supported', [True, False])
+def test_wait_for_release(runner, patch, init_sample_app_in_cwd, log_server,
+                          push_supported):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story import api, cli
+        from story.commands import deploy
+
+        patch.object(cli, 'get_access_token', return_value='my_token')
+        patch.object(api.Apps, 'get_uuid_from_hostname',
+                     return_value='my_uuid')
+        patch.object(api.Releases, 'get', side_effect=[
+            [{'state': 'QUEUED'}],
+            [{'state': 'DEPLOYING'}],
+            [{'state': 'DEPLOYING'}],
+            [{'state': 'DEPLOYING'}],
+            [{'state': 'DEPLOYING'}],
+            [{'state': 'DEPLOYING'}],
+            [{'state': 'FAILED'}],
+        ])
+        patch.object(time, 'sleep')
+
+        features = ['release_state'] if push_supported else []
+        received = log_server(features, ['DEPLOYING', 'DEPLOYED'])
+
+        state = deploy.wait_for_release('my_app', 42)
+
+    assert received[0]['command'] == 'auth'
+    assert received[0]['app_id'] == 'my_uuid'
+
+    if push_supported:
+        assert state == 'DEPLOYED'
+        assert received[1] == {'command': 'release_state', 'release_id': 42}
+        api.Releases.get.assert_not_called()
+    else:
+        assert state == 'FAILED'
+        assert api.Releases.get.call_count == 7
+        # Exponential backoff, up to a cap.
+        assert [c[1][0] for c in time.sleep.mock_calls] == [
+            0.5, 1, 2, 4, 8, 8
+        ]
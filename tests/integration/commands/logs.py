@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import json
+import random
+import time
 from unittest import mock
 from urllib.error import URLError
 
@@ -7,7 +10,9 @@ import click
 
 from pytest import mark
 
-from story import api, cli
+from story import api, archive, cli
+from story.archive import Archive
+from story.helpers.logs import LogFilter
 
 from websockets import ConnectionClosed, InvalidStatusCode
 
@@ -81,7 +86,9 @@ def test_logs_command(runner, init_sample_app_in_cwd, patch, level, follow,
         service is False,
         service,
         '*' if service_name is None else service_name,
-        'info' if level is None else level
+        'info' if level is None else level,
+        'pretty',
+        renderer=None,
     )
 
     asyncio.get_event_loop.return_value.run_until_complete.assert_called_with(
@@ -89,6 +96,58 @@ def test_logs_command(runner, init_sample_app_in_cwd, patch, level, follow,
     )
 
 
+@mark.parametrize('output', ['ndjson', 'raw'])
+def test_logs_command_machine_output(runner, init_sample_app_in_cwd, patch,
+                                     output):
+    patch.object(asyncio, 'get_event_loop')
+    patch.object(cli, 'track')
+    patch.object(api.Apps, 'get_uuid_from_hostname')
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'connect_and_listen_with_retry')
+        patch.object(click, 'echo')
+
+        runner.run(logs.logs, args=['-o', output])
+
+    # Only the logs themselves go to stdout.
+    assert click.echo.mock_calls == [
+        mock.call('Retrieving logs for my_app... ', nl=False, err=True),
+        mock.call(err=True),
+    ]
+
+    logs.connect_and_listen_with_retry.assert_called_with(
+        api.Apps.get_uuid_from_hostname.return_value,
+        10, False, True, False, '*', 'info', output, renderer=None
+    )
+
+
+def test_logs_command_many_apps(runner, init_sample_app_in_cwd, patch):
+    patch.object(asyncio, 'get_event_loop')
+    patch.object(cli, 'track')
+    patch.object(api.Apps, 'get_uuid_from_hostname',
+                 side_effect=lambda app: f'{app}_id')
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'listen_to_apps')
+
+        result = runner.run(logs.logs,
+                            args=['-f', '--app', 'app_a', '--app', 'app_b'])
+
+    assert 'Retrieving logs for app_a, app_b' in result.stdout
+
+    logs.listen_to_apps.assert_called_with(
+        {'app_a': 'app_a_id', 'app_b': 'app_b_id'},
+        10, True, True, False, '*', 'info', 'pretty', archive=None,
+        archive_filter=None, log_filter=None, make_throttle=None
+    )
+
+
 @mark.parametrize('exception_to_throw', [URLError('reason'),
                                          ConnectionClosed(10, 'closed')])
 @mark.asyncio
@@ -125,6 +184,7 @@ async def test_connect_and_listen_with_retry(runner, init_sample_app_in_cwd,
                                              patch, async_mock,
                                              final_result_of_connect_once):
     patch.object(click, 'get_current_context')
+    patch.object(asyncio, 'sleep', new=async_mock())
 
     with runner.runner.isolated_filesystem():
         init_sample_app_in_cwd()
@@ -143,18 +203,370 @@ async def test_connect_and_listen_with_retry(runner, init_sample_app_in_cwd,
             'app_id', 'n', 'follow', 'runtime_logs', 'service_logs',
             'service_name', 'level')
 
-    assert logs.connect_and_listen_once.mock.mock_calls == [
+    calls = logs.connect_and_listen_once.mock.mock_calls
+    assert calls == [
         mock.call('app_id', 'n', 'follow', 'runtime_logs', 'service_logs',
-                  'service_name', 'level'),
-        mock.call('app_id', 100, 'follow', 'runtime_logs', 'service_logs',
-                  'service_name', 'level'),
-        mock.call('app_id', 100, 'follow', 'runtime_logs', 'service_logs',
-                  'service_name', 'level'),
-        mock.call('app_id', 100, 'follow', 'runtime_logs', 'service_logs',
-                  'service_name', 'level'),
-        mock.call('app_id', 100, 'follow', 'runtime_logs', 'service_logs',
-                  'service_name', 'level')
-    ]
+                  'service_name', 'level', 'pretty', renderer=mock.ANY,
+                  connection=mock.ANY),
+    ] + [
+        mock.call('app_id', logs.RESUME_LINES, 'follow', 'runtime_logs',
+                  'service_logs', 'service_name', 'level', 'pretty',
+                  renderer=mock.ANY, connection=mock.ANY),
+    ] * 4
+
+    # The stream's cursor and connection manager are carried over from one
+    # connection to the next.
+    assert len({id(c[2]['renderer']) for c in calls}) == 1
+    assert len({id(c[2]['connection']) for c in calls}) == 1
+
+    # Reconnects back off.
+    assert asyncio.sleep.mock.call_count == 4
 
     if isinstance(final_result_of_connect_once, BaseException):
         click.get_current_context.return_value.exit.assert_called_with(1)
+
+
+@mark.parametrize('features,pushed,rest', [
+    ([], {'n': 10}, {'pattern': 'error', 'exclude': 'retry',
+                     'since_ts': 1000}),
+    (['grep', 'since'], {'grep': 'error', 'since': 1000},
+     {'pattern': None, 'exclude': 'retry', 'since_ts': None}),
+    (['grep', 'exclude', 'since'],
+     {'grep': 'error', 'exclude': 'retry', 'since': 1000}, None),
+])
+@mark.asyncio
+async def test_connect_and_listen_once_pushes_filters_down(
+        magic, patch, async_mock, features, pushed, rest):
+    from story.commands import logs
+    from story.helpers.logs import LogFilter, LogRenderer
+
+    websocket = magic(spec=logs.WebSocketClientProtocol)
+    websocket.send = async_mock()
+    websocket.recv = async_mock(side_effect=[
+        json.dumps({'authorised': True, 'features': features}),
+        ConnectionClosed(1000, 'done'),
+    ])
+    connect = patch.object(logs.websockets, 'connect')
+    connect.return_value.__aenter__ = async_mock(return_value=websocket)
+    connect.return_value.__aexit__ = async_mock(return_value=None)
+
+    renderer = LogRenderer(log_filter=LogFilter(
+        'error', since_ts=1000, exclude='retry'
+    ))
+    await logs.connect_and_listen_once(
+        'app_id', 10, False, True, False, '*', 'info', renderer=renderer
+    )
+
+    filter_payload = json.loads(websocket.send.mock.call_args_list[1][0][0])
+    assert filter_payload == dict(
+        pushed, command='filter', source='runtime', level='info', watch=False
+    )
+
+    if rest is None:
+        assert renderer.match is None
+    else:
+        rest_filter = renderer.match.__self__
+        assert {attr: getattr(rest_filter, attr) for attr in rest} == rest
+
+
+@mark.parametrize('errors,exits', [
+    # A flapping log server, which is retried.
+    ([InvalidStatusCode(503), ConnectionRefusedError(), URLError('reason')],
+     False),
+    # Auth errors aren't retried.
+    ([InvalidStatusCode(503), InvalidStatusCode(403)], True),
+    ([InvalidStatusCode(502)] * 4, True),
+])
+@mark.asyncio
+async def test_connect_and_listen_with_retry_retries_failed_reconnects(
+        runner, init_sample_app_in_cwd, patch, async_mock, errors, exits):
+    patch.object(click, 'get_current_context')
+    patch.object(asyncio, 'sleep', new=async_mock())
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+
+        patch.object(logs, 'RECONNECT_ATTEMPTS', 3)
+        results = iter([False, *errors, True])
+
+        async def connect_and_listen_once(*args, connection, **kwargs):
+            result = next(results)
+            if isinstance(result, BaseException):
+                raise result
+
+            connection.connected()
+            return result
+
+        patch.object(logs, 'connect_and_listen_once',
+                     new=connect_and_listen_once)
+
+        await logs.connect_and_listen_with_retry(
+            'app_id', 'n', True, 'runtime_logs', 'service_logs',
+            'service_name', 'level')
+
+    exit = click.get_current_context.return_value.exit
+    if exits:
+        exit.assert_called_once_with(1)
+    else:
+        assert not exit.called
+        assert next(results, None) is None
+        assert asyncio.sleep.mock.call_count == 1 + len(errors)
+
+
+@mark.asyncio
+async def test_connect_and_listen_with_retry_exits_on_first_connect(
+        runner, init_sample_app_in_cwd, patch, async_mock):
+    patch.object(click, 'get_current_context')
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+
+        patch.object(logs, 'connect_and_listen_once',
+                     new=async_mock(side_effect=ConnectionRefusedError()))
+
+        await logs.connect_and_listen_with_retry(
+            'app_id', 'n', True, 'runtime_logs', 'service_logs',
+            'service_name', 'level')
+
+    click.get_current_context.return_value.exit.assert_called_once_with(1)
+    assert logs.connect_and_listen_once.mock.call_count == 1
+
+
+def test_connection_manager(patch):
+    from story.commands import logs
+
+    patch.object(random, 'uniform', side_effect=lambda low, high: high)
+    patch.object(time, 'monotonic', return_value=100)
+    connection = logs.ConnectionManager()
+
+    connection.connected()
+    connection.disconnected()
+    assert [connection.backoff() for _ in range(8)] == [
+        0.5, 1, 2, 4, 8, 16, 30, 30
+    ]
+
+    time.monotonic.return_value = 110
+    connection.connected()
+    assert (connection.reconnects, connection.disconnected_secs) == (1, 10)
+
+    # A connection which stayed up for a while resets the backoff.
+    time.monotonic.return_value = 110 + logs.STABLE_CONNECTION
+    connection.disconnected()
+    assert connection.backoff() == 0.5
+
+
+@mark.asyncio
+async def test_supervise_heartbeat(magic, async_mock):
+    from story.commands import logs
+
+    websocket = magic()
+    websocket.close = async_mock()
+
+    async def heartbeat():
+        raise OSError()
+
+    task = asyncio.ensure_future(heartbeat())
+    logs.supervise_heartbeat(task, websocket)
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert websocket.close.mock.call_count == 1
+
+
+def test_logs_search(runner, init_sample_app_in_cwd, patch, tmpdir):
+    patch.object(asyncio, 'get_event_loop',
+                 return_value=asyncio.new_event_loop())
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='app_id')
+    patch.object(archive, 'ARCHIVE_DIR', str(tmpdir))
+    now = int(time.time() * 1000)
+
+    def entry(ts, text):
+        log = {'ts': ts, 'level': 'info', 'service_name': 's', 'message': text}
+        return json.dumps(log), log, None
+
+    seeded = Archive()
+    seeded.add('app_id', 'runtime', [
+        entry(now - 3 * 60 * 60 * 1000, 'an old match'),
+        entry(now - 30 * 60 * 1000, 'a match'),
+        entry(now - 20 * 60 * 1000, 'something else'),
+    ])
+    seeded.close()
+
+    async def listen(*args, renderer, **kwargs):
+        # The server sends the tail again, along with a newer line.
+        renderer.feed(entry(now - 20 * 60 * 1000, 'something else')[0])
+        renderer.feed(entry(now, 'a new match')[0])
+        renderer.flush()
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'connect_and_listen_once', side_effect=listen)
+
+        result = runner.run(logs.logs, args=[
+            'search', 'match', '--since', '2h', '-o', 'raw'
+        ])
+
+    assert result.stdout.splitlines() == ['a match', 'a new match']
+    assert logs.connect_and_listen_once.call_args[0][:2] == (
+        'app_id', logs.SEARCH_TAIL_LINES
+    )
+
+    # The new line was archived.
+    assert Archive().latest_ts('app_id', 'runtime') == now
+
+    asyncio.get_event_loop().close()
+
+
+def test_logs_search_archives_whole_tails(runner, init_sample_app_in_cwd,
+                                          patch, tmpdir):
+    patch.object(asyncio, 'get_event_loop',
+                 return_value=asyncio.new_event_loop())
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='app_id')
+    patch.object(archive, 'ARCHIVE_DIR', str(tmpdir))
+    now = int(time.time() * 1000)
+
+    def message(ts, level, service_name):
+        return json.dumps({
+            'ts': ts,
+            'level': level,
+            'service_name': service_name,
+            'message': f'{level} match from {service_name}',
+        })
+
+    async def listen(*args, renderer, **kwargs):
+        renderer.feed(message(now - 2000, 'debug', 'redis'))
+        renderer.feed(message(now - 1000, 'error', 'redis'))
+        renderer.feed(message(now, 'error', 'web'))
+        renderer.flush()
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'connect_and_listen_once', side_effect=listen)
+
+        result = runner.run(logs.logs, args=[
+            'search', 'match', '-s', '-sn', 'redis', '-l', 'error',
+            '-o', 'raw'
+        ])
+
+    # The whole tail is asked for, and archived, but only the matches are
+    # shown.
+    assert logs.connect_and_listen_once.call_args[0][5:7] == ('*', 'debug')
+    assert result.stdout.splitlines() == ['error match from redis']
+
+    lines = Archive().search('app_id', 'service', LogFilter())
+    assert [log['message'] for _, log in lines] == [
+        'debug match from redis',
+        'error match from redis',
+        'error match from web',
+    ]
+
+    asyncio.get_event_loop().close()
+
+
+def test_logs_search_bad_duration(runner, init_sample_app_in_cwd):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        result = runner.run(logs.logs, exit_code=2,
+                            args=['search', 'match', '--since', 'soon'])
+
+    assert 'expected a duration' in result.stdout
+
+
+@mark.parametrize('args,error', [
+    (['--grep', '('], 'invalid regular expression'),
+    (['--grep', 'error', '--archive'], "can't be combined"),
+    (['-f', '--until', '1h'], "can't be combined with --follow"),
+    (['--max-rate', 'fast'], 'expected a rate'),
+    (['--sample', '2/3'], 'expected a ratio'),
+])
+def test_logs_command_bad_filters(runner, init_sample_app_in_cwd, args,
+                                  error):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        result = runner.run(logs.logs, exit_code=2, args=args)
+
+    assert error in result.stdout
+
+
+def test_logs_command_throttle(runner, init_sample_app_in_cwd, patch):
+    patch.object(asyncio, 'get_event_loop')
+    patch.object(cli, 'track')
+    patch.object(api.Apps, 'get_uuid_from_hostname')
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'connect_and_listen_with_retry')
+
+        result = runner.run(logs.logs, args=[
+            '-f', '--max-rate', '100/s', '--sample', '1/10'
+        ])
+
+    assert 'Printing one in 10 lines.' in result.stdout
+
+    renderer = logs.connect_and_listen_with_retry.call_args[1]['renderer']
+    throttle = renderer.sink.__self__
+    assert isinstance(throttle, logs.LogThrottle)
+    assert (throttle.max_rate, throttle.sample, throttle.collapse) == (
+        100, 10, True
+    )
+
+
+def test_logs_command_archives_whole_streams(runner, init_sample_app_in_cwd,
+                                             patch, tmpdir):
+    patch.object(asyncio, 'get_event_loop',
+                 return_value=asyncio.new_event_loop())
+    patch.object(cli, 'track')
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='app_id')
+    patch.object(archive, 'ARCHIVE_DIR', str(tmpdir))
+
+    def message(ts, level, service_name):
+        return json.dumps({
+            'ts': ts,
+            'level': level,
+            'service_name': service_name,
+            'message': f'{level} from {service_name}',
+        })
+
+    async def listen(*args, renderer, **kwargs):
+        renderer.feed(message(1000, 'debug', 'a'))
+        renderer.feed(message(2000, 'error', 'a'))
+        renderer.feed(message(3000, 'error', 'b'))
+        renderer.flush()
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands import logs
+        patch.object(logs, 'connect_and_listen_with_retry',
+                     side_effect=listen)
+
+        result = runner.run(logs.logs, args=[
+            '--archive', '-s', '-sn', 'a', '-l', 'warning', '-o', 'raw'
+        ])
+
+    # Every line is asked for (and archived), but only those asked for are
+    # shown.
+    args = logs.connect_and_listen_with_retry.call_args[0]
+    assert args[5:7] == (None, 'debug')
+    assert result.stdout.splitlines()[-1:] == ['error from a']
+
+    lines = Archive().search('app_id', 'service', LogFilter())
+    assert [log['message'] for _, log in lines] == [
+        'debug from a', 'error from a', 'error from b'
+    ]
+
+    asyncio.get_event_loop().close()
@@ -1,27 +1,61 @@
 # -*- coding: utf-8 -*-
-from unittest import mock
-
-from pytest import mark
+from pytest import fixture, mark
 
 from story.helpers import datetime
 
 
-@mark.parametrize('no_releases', [True, False])
-@mark.parametrize('limit', [None, 100, 200])
-def test_list(runner, patch, init_sample_app_in_cwd, no_releases, limit):
-    if not no_releases:
-        patch.object(datetime, 'reltime', side_effect=[
-            'reltime_100',
-            'reltime_200',
-            'reltime_300'
-        ])
-
-        patch.object(datetime, 'parse_psql_date_str', side_effect=[
-            'parsed_100',
-            'parsed_200',
-            'parsed_300'
-        ])
+def release(id, state='DEPLOYED', config=None):
+    return {
+        'id': id,
+        'state': state,
+        'timestamp': f'date_app_{id}',
+        'message': f'my_deployment_message_{id}',
+        'config': config,
+    }
+
+
+@fixture
+def mirror(patch, tmpdir):
+    """Mirrors releases in tmpdir, and fakes the app's releases."""
+    from story import api, mirror
+    patch.object(mirror, 'MIRROR_PATH', str(tmpdir.join('releases.sqlite3')))
+    patch.object(api.Apps, 'get_uuid_from_hostname',
+                 return_value='my_app_uuid')
+
+    patch.object(datetime, 'parse_psql_date_str',
+                 side_effect=lambda date: date.replace('date_app', 'parsed'))
+    patch.object(datetime, 'reltime',
+                 side_effect=lambda date: date.replace('parsed', 'reltime'))
+
+    def releases(*releases):
+        """Has the app's releases be the given ones."""
+
+        def pages(app, limit=None, before=None, after=None,
+                  page_size=api.RELEASES_PAGE_SIZE, with_config=False):
+            matching = sorted(
+                (
+                    release for release in releases
+                    if (before is None or release['id'] < before)
+                    and (after is None or release['id'] > after)
+                ),
+                key=lambda release: release['id'],
+                reverse=after is None or before is not None,
+            )[:limit]
+
+            return iter([
+                matching[i:i + page_size]
+                for i in range(0, max(len(matching), 1), page_size)
+            ])
+
+        patch.object(api.Releases, 'pages', side_effect=pages)
 
+    return releases
+
+
+@mark.parametrize('no_releases', [True, False])
+@mark.parametrize('limit', [None, 2, 200])
+def test_list(runner, patch, init_sample_app_in_cwd, mirror, no_releases,
+              limit):
     args = []
     if limit is not None:
         args.append('-n')
@@ -34,38 +68,23 @@ def test_list(runner, patch, init_sample_app_in_cwd, no_releases, limit):
         from story.commands.releases import list_command
 
         if no_releases:
-            patch.object(api.Releases, 'list', return_value=[])
+            mirror()
         else:
-            patch.object(api.Releases, 'list', return_value=[
-                {
-                    'id': 100,
-                    'state': 'deployed',
-                    'timestamp': 'date_app_100',
-                    'message': 'my_deployment_message_100'
-                },
-                {
-                    'id': 300,
-                    'state': 'deployed',
-                    'timestamp': 'date_app_300',
-                    'message': 'my_deployment_message_300'
-                },
-                {
-                    'id': 200,
-                    'state': 'deployed',
-                    'timestamp': 'date_app_200',
-                    'message': 'my_deployment_message_200'
-                },
-            ])
+            mirror(release(300), release(200), release(100))
 
         result = runner.run(list_command, args=args, exit_code=0)
 
-    if limit is None:
-        limit = 20  # The supposed default.
-
-    api.Releases.list.assert_called_with('my_app', limit=limit)
+    # Only the releases listed are fetched, the first time.
+    api.Releases.pages.assert_called_once_with(
+        'my_app', limit=limit or 20, before=None, after=None, with_config=True
+    )
 
     if no_releases:
         assert 'No releases yet for app my_app' in result.stdout
+    elif limit == 2:
+        assert 'v100' not in result.stdout
+        assert 'v200' in result.stdout
+        assert 'v300' in result.stdout
     else:
         assert """
     VERSION    STATUS      CREATED              MESSAGE         
@@ -75,17 +94,61 @@ v200      Deployed   reltime_200   my_deployment_message_200
 v300      Deployed   reltime_300   my_deployment_message_300
 """.strip() in result.stdout  # noqa (because there's a trailing whitespace in the header)
 
-        assert datetime.parse_psql_date_str.mock_calls == [
-            mock.call('date_app_100'),
-            mock.call('date_app_200'),
-            mock.call('date_app_300')
-        ]
 
-        assert datetime.reltime.mock_calls == [
-            mock.call('parsed_100'),
-            mock.call('parsed_200'),
-            mock.call('parsed_300')
-        ]
+def test_list_syncs_new_releases(runner, init_sample_app_in_cwd, mirror):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story import api, mirror as mirror_
+        from story.commands.releases import list_command
+
+        mirror(release(2, state='DEPLOYING'), release(1))
+        runner.run(list_command)
+
+        mirror(release(4, state='QUEUED'), release(3), release(2), release(1))
+        result = runner.run(list_command)
+
+    # One small query, for the releases up to (and including) the one
+    # which was deploying.
+    api.Releases.pages.assert_called_once_with(
+        'my_app', page_size=mirror_.SYNC_PAGE_SIZE, with_config=True
+    )
+    assert 'v1 ' in result.stdout
+    assert 'Deployed   reltime_2' in result.stdout
+    assert 'Queued     reltime_4' in result.stdout
+
+
+@mark.parametrize('args,expected', [
+    (['--before', 'v3'], ['v1', 'v2']),
+    (['--before', 'v5', '-n', '2'], ['v3', 'v4']),
+    (['--after', '3', '-n', '1'], ['v4']),
+    (['--after', '1', '--before', 'v4'], ['v2', 'v3']),
+])
+def test_list_range(runner, patch, init_sample_app_in_cwd, mirror, args,
+                    expected):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands.releases import list_command
+
+        mirror(*[release(id) for id in range(5, 0, -1)])
+        result = runner.run(list_command, args=args)
+
+    versions = [
+        line.split()[0] for line in result.stdout.splitlines()[2:]
+    ]
+    assert versions == expected
+
+
+def test_list_bad_range(runner, init_sample_app_in_cwd):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands.releases import list_command
+        result = runner.run(list_command, args=['--before', 'latest'],
+                            exit_code=2)
+
+    assert 'expected a version' in result.stdout
 
 
 @mark.parametrize('version_specified,version_number', [
@@ -95,7 +158,7 @@ v300      Deployed   reltime_300   my_deployment_message_300
     (True, 'v28'),
     (True, 'invalid')
 ])
-def test_rollback(runner, patch, init_sample_app_in_cwd,
+def test_rollback(runner, patch, init_sample_app_in_cwd, mirror,
                   version_specified, version_number):
     expected_rollback_version = 99
     expected_exit_code = 0
@@ -119,12 +182,7 @@ def test_rollback(runner, patch, init_sample_app_in_cwd,
         from story import api
         from story.commands.releases import rollback
 
-        if not version_specified:
-            patch.object(api.Releases, 'get', return_value=[{'id': 100}])
-        else:
-            patch.object(api.Releases, 'get',
-                         return_value=[{'id': version_number}])
-
+        mirror(release(100), release(99))
         patch.object(api.Releases, 'rollback',
                      return_value={'id': expected_rollback_version})
 
@@ -142,7 +200,10 @@ def test_rollback(runner, patch, init_sample_app_in_cwd,
         return
 
     if not version_specified:
-        api.Releases.get.assert_called_with(app='my_app')
+        # Only the latest release is fetched, to be mirrored.
+        api.Releases.pages.assert_called_once_with(
+            'my_app', limit=1, before=None, after=None, with_config=True
+        )
         assert 'Getting latest release for app my_app' in result.stdout
 
     assert f'Rolling back to v{expected_rollback_version}' in result.stdout
@@ -150,3 +211,51 @@ def test_rollback(runner, patch, init_sample_app_in_cwd,
 
     api.Releases.rollback.assert_called_with(version=expected_rollback_version,
                                              app='my_app')
+
+
+@mark.parametrize('versions,expected', [
+    (['v1', 'v2'], [
+        '--- v1',
+        '+++ v2',
+        '-state: TERMINATED',
+        '+state: DEPLOYED',
+        '-timestamp: date_app_1',
+        '+timestamp: date_app_2',
+        '-message: my_deployment_message_1',
+        '+message: my_deployment_message_2',
+        ' config: changed',
+    ]),
+    (['v2', 'v2'], [
+        '--- v2',
+        '+++ v2',
+        ' state: DEPLOYED',
+        ' timestamp: date_app_2',
+        ' message: my_deployment_message_2',
+        ' config: unchanged',
+    ]),
+])
+def test_diff(runner, init_sample_app_in_cwd, mirror, versions, expected):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands.releases import diff
+
+        mirror(
+            release(2, config={'A': '2'}),
+            release(1, state='TERMINATED', config={'A': '1'}),
+        )
+        result = runner.run(diff, args=versions)
+
+    assert result.stdout.splitlines() == expected
+
+
+def test_diff_unknown_release(runner, init_sample_app_in_cwd, mirror):
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+
+        from story.commands.releases import diff
+
+        mirror(release(1))
+        result = runner.run(diff, args=['v1', 'v3'], exit_code=1)
+
+    assert 'Release v3 not found for app my_app.' in result.stdout
@@ -6,7 +6,7 @@ import click
 
 from pytest import mark
 
-from story import cli
+from story import cli, compiler
 
 from storyscript.App import App
 from storyscript.exceptions import StoryError
@@ -15,8 +15,9 @@ from storyscript.exceptions import StoryError
 @mark.parametrize('mock_tree_as_none', [True, False])
 @mark.parametrize('no_stories_found', [True, False])
 @mark.parametrize('debug', [True, False])
+@mark.parametrize('jobs', [None, 4])
 def test_test(runner, patch, init_sample_app_in_cwd, mock_tree_as_none,
-              no_stories_found, debug):
+              no_stories_found, debug, jobs):
     expected_exit_code = 0
     compile_app_result = {
         'stories': {
@@ -29,6 +30,9 @@ def test_test(runner, patch, init_sample_app_in_cwd, mock_tree_as_none,
     if debug:
         args.append('--debug')
 
+    if jobs:
+        args.extend(['--jobs', jobs])
+
     if no_stories_found:
         compile_app_result['stories'] = {}
         expected_exit_code = 1
@@ -44,7 +48,7 @@ def test_test(runner, patch, init_sample_app_in_cwd, mock_tree_as_none,
 
         result = runner.run(test.test, args=args, exit_code=expected_exit_code)
 
-    test.compile_app.assert_called_with('my_app', debug)
+    test.compile_app.assert_called_with('my_app', debug, jobs=jobs or 1)
 
     if mock_tree_as_none:
         assert result.stdout == ''
@@ -56,17 +60,27 @@ def test_test(runner, patch, init_sample_app_in_cwd, mock_tree_as_none,
         assert 'a2.story' in result.stdout
 
 
+class UnpicklableError(Exception):
+    """An error which can't be unpickled, as its args don't fit __init__."""
+
+    def __init__(self, message, *, story):
+        super().__init__(message)
+
+
 @mark.parametrize('force_compilation_error,compilation_exc', [
     (True, StoryError('E100', 'a.story', path='foo')),
     (True, BaseException('oh no!')),
+    (True, UnpicklableError('oh no!', story='a.story')),
     (False, None)
 ])
 @mark.parametrize('nested_dir', [True, False])
+@mark.parametrize('jobs', [1, 4])
 def test_compile_app(runner, patch, init_sample_app_in_cwd,
-                     pre_init_cli_runner, nested_dir,
-                     force_compilation_error, compilation_exc):
+                     pre_init_cli_runner, nested_dir, jobs,
+                     force_compilation_error, compilation_exc, tmpdir):
     app_name_for_analytics = 'my_special_app'
 
+    patch.object(compiler, 'COMPILED_DIR', str(tmpdir))
     patch.object(cli, 'get_asyncy_yaml', return_value='asyncy_yml_content')
     patch.object(cli, 'track')
 
@@ -89,11 +103,14 @@ def test_compile_app(runner, patch, init_sample_app_in_cwd,
         if nested_dir:
             os.chdir(f'{os.getcwd()}/src/b')
 
+        # With jobs, stories are compiled in (forked) worker processes,
+        # which errors have to make it out of.
         actual_compilation_result = test.compile_app(app_name_for_analytics,
-                                                     False)
+                                                     False, jobs=jobs)
 
         if not force_compilation_error:
             os.chdir(actual_project_root)
+            # What the compiler makes of the whole project, at once.
             expected_compilation_result = json.loads(App.compile(os.getcwd()))
             expected_compilation_result['yaml'] = 'asyncy_yml_content'
 
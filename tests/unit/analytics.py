@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import atexit
+import fcntl
+import json
+import os
+
+from pytest import fixture
+
+from story import analytics, cli, storage
+
+
+@fixture()
+def spool(runner, patch):
+    with runner.runner.isolated_filesystem():
+        patch.object(storage, 'cache', storage.SQLiteStorage('cache.sqlite3'))
+        patch.object(analytics, 'SPOOL_PATH',
+                     os.path.abspath('analytics.ndjson'))
+        patch.object(analytics, '_sender_scheduled', False)
+        patch.object(atexit, 'register')
+        yield analytics.SPOOL_PATH
+
+
+def test_record_spools_without_forking(spool, patch):
+    patch.object(os, 'fork', side_effect=AssertionError)
+    patch.object(cli, 'enable_reporting', True)
+    patch.object(cli, 'data', {'id': 'my_user_id'})
+
+    cli.track('App Created', {'App name': 'my_app'})
+    cli.track('App Destroyed', {'App name': 'my_app'})
+
+    with open(spool) as f:
+        events = [json.loads(line) for line in f]
+
+    assert [e['json']['event_name'] for e in events] == [
+        'App Created', 'App Destroyed'
+    ]
+    assert events[0]['url'] == analytics.TRACK_EVENT_URL
+    assert atexit.register.call_count == 1
+
+
+def test_record_drops_when_full(spool, patch):
+    patch.object(analytics, 'MAX_SPOOL_SIZE', 200)
+
+    for i in range(5):
+        analytics.record(analytics.TRACK_EVENT_URL, {'event_name': i})
+
+    assert os.path.getsize(spool) <= 200
+    assert storage.cache['analytics-dropped'] == 3
+
+
+def test_send(spool, magic):
+    storage.cache.store('analytics-dropped', 2)
+    for i in range(3):
+        analytics.record(analytics.TRACK_EVENT_URL,
+                         {'id': 'my_user_id', 'event_name': i})
+
+    session = magic()
+    analytics.send(session)
+
+    sent = [c[2]['json'] for c in session.post.mock_calls]
+    assert [e['event_name'] for e in sent] == [
+        0, 1, 2, 'Analytics Events Dropped'
+    ]
+    assert sent[-1] == {
+        'id': 'my_user_id',
+        'event_name': 'Analytics Events Dropped',
+        'event_props': {'Count': 2},
+    }
+    assert 'analytics-dropped' not in storage.cache
+    assert not os.path.exists(spool)
+    assert not os.path.exists(f'{spool}.sending')
+
+
+def test_send_leaves_it_to_the_running_sender(spool, magic):
+    analytics.record(analytics.TRACK_EVENT_URL, {'event_name': 'event'})
+
+    session = magic()
+    with open(f'{spool}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        analytics.send(session)
+
+    assert not session.post.called
+    assert os.path.exists(spool)
@@ -5,11 +5,11 @@ from urllib.error import URLError
 
 import click
 
-from pytest import fixture, mark
+from pytest import fixture, mark, raises
 
 import requests
 
-from story import api
+from story import api, cli, storage, transport
 from story.environment import SS_GRAPHQL
 
 
@@ -17,9 +17,23 @@ from story.environment import SS_GRAPHQL
 def patch_graphql(patch):
     patch.object(api, 'graphql')
     patch.object(api.Apps, 'get_uuid_from_hostname')
+    patch.object(api.Apps, 'forget_uuid')
+
+
+@fixture()
+def isolated_cache(runner, patch):
+    """
+    Gives each test a fresh on-disk cache and a clean UUID session memo.
+    """
+    with runner.runner.isolated_filesystem():
+        patch.object(storage, 'cache', storage.SQLiteStorage('cache.sqlite3'))
+        patch.object(api.Apps, '_hostname_to_uuid', {})
+        patch.object(api.Apps, '_resolved_from_cache', set())
+        yield storage.cache
 
 
 @mark.parametrize('with_api_errors', [True, False])
+@mark.parametrize('is_mutation', [True, False])
 @mark.parametrize('api_throws_an_exception',
                   [
                       None,
@@ -27,15 +41,16 @@ def patch_graphql(patch):
                       requests.RequestException(),
                       KeyboardInterrupt()
                   ])
-def test_graphql(runner, patch, with_api_errors, api_throws_an_exception):
+def test_graphql(runner, patch, with_api_errors, is_mutation,
+                 api_throws_an_exception):
     if api_throws_an_exception:
         patch.object(click, 'get_current_context')
-        patch.object(requests, 'post', side_effect=api_throws_an_exception)
+        patch.object(transport, 'post', side_effect=api_throws_an_exception)
     else:
-        patch.object(requests, 'post')
+        patch.object(transport, 'post')
 
     if with_api_errors:
-        requests.post.return_value.json.return_value = {
+        transport.post.return_value.json.return_value = {
             'errors': [
                 {
                     'message': 'my_error_message'
@@ -45,7 +60,11 @@ def test_graphql(runner, patch, with_api_errors, api_throws_an_exception):
 
         patch.object(click, 'get_current_context')
 
-    my_query = {'my_query': 'hello_world'}
+    patch.object(api.Apps, 'forget_cached_uuids')
+
+    my_query = 'query{ hello_world }'
+    if is_mutation:
+        my_query = 'mutation{ hello_world }'
     variables = {
         'var1': 'val1',
         'var2': 'val2'
@@ -58,8 +77,9 @@ def test_graphql(runner, patch, with_api_errors, api_throws_an_exception):
 
     ret_val = api.graphql(my_query, **variables)
 
-    requests.post.assert_called_with(
+    transport.post.assert_called_with(
         SS_GRAPHQL,
+        idempotent=not is_mutation,
         data=json.dumps({
             'query': my_query,
             'variables': variables
@@ -75,8 +95,10 @@ def test_graphql(runner, patch, with_api_errors, api_throws_an_exception):
     if with_api_errors or api_throws_an_exception:
         click.get_current_context().exit.assert_called_with(1)
         assert ret_val is None
+        if with_api_errors and not api_throws_an_exception:
+            api.Apps.forget_cached_uuids.assert_called()
     else:
-        assert ret_val == requests.post.return_value.json.return_value
+        assert ret_val == transport.post.return_value.json.return_value
 
 
 app_name = 'my_app'
@@ -191,9 +213,181 @@ def test_apps_list(assert_simple_graphql_call):
     assert ret_val == api.graphql()['data']['allApps']['nodes']
 
 
+@mark.parametrize('cached', [True, False])
+@mark.parametrize('use_cache', [True, False])
+def test_apps_get_uuid_from_hostname(isolated_cache, patch, cached,
+                                     use_cache):
+    patch.object(api, 'graphql', return_value={
+        'data': {'app': {'appUuid': 'my_uuid'}}
+    })
+    patch.object(cli, 'use_cache', use_cache)
+
+    if cached:
+        isolated_cache.store('app-uuid-my_app', 'cached_uuid', expires=60)
+
+    ret_val = api.Apps.get_uuid_from_hostname(app_name)
+
+    # Subsequent calls within the same session are served from memory.
+    assert api.Apps.get_uuid_from_hostname(app_name) == ret_val
+
+    if cached and use_cache:
+        assert ret_val == 'cached_uuid'
+        api.graphql.assert_not_called()
+    else:
+        assert ret_val == 'my_uuid'
+        assert api.graphql.call_count == 1
+        assert api.graphql.mock_calls[0][2] == {'app': app_name}
+        assert isolated_cache.fetch('app-uuid-my_app') == 'my_uuid'
+
+
+def test_apps_get_uuid_from_hostname_caches_missing_apps(isolated_cache,
+                                                         patch):
+    patch.object(api, 'graphql', return_value={'data': {'app': None}})
+
+    with raises(SystemExit):
+        api.Apps.get_uuid_from_hostname(app_name)
+
+    assert 'app-uuid-my_app' in isolated_cache
+    assert isolated_cache.fetch('app-uuid-my_app') is None
+
+    # A new session exits straight away, without asking the API again.
+    with raises(SystemExit):
+        api.Apps.get_uuid_from_hostname(app_name)
+
+    assert api.graphql.call_count == 1
+
+
+def test_apps_forget_cached_uuids(isolated_cache, patch):
+    patch.object(api, 'graphql')
+    isolated_cache.store('app-uuid-my_app', 'cached_uuid', expires=60)
+    isolated_cache.store('app-uuid-other_app', 'other_uuid', expires=60)
+
+    assert api.Apps.get_uuid_from_hostname(app_name) == 'cached_uuid'
+
+    api.Apps.forget_cached_uuids()
+
+    assert 'app-uuid-my_app' not in isolated_cache
+    assert 'app-uuid-other_app' in isolated_cache
+    assert app_name not in api.Apps._hostname_to_uuid
+
+
+def test_batch_coalesces_queries(patch):
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api, 'graphql', return_value={
+        'data': {
+            'op0': {'nodes': [{'config': {'foo': 'bar'}}]},
+            'op1': {'maintenance': True},
+        }
+    })
+
+    with api.Batch() as batch:
+        config = api.Config.get(app_name, batch=batch)
+        maintenance = api.Apps.maintenance(app_name, None, batch=batch)
+        duplicate = api.Config.get(app_name, batch=batch)
+
+        api.graphql.assert_not_called()
+
+    assert duplicate is config
+    assert config.result == {'foo': 'bar'}
+    assert maintenance.result is True
+
+    api.graphql.assert_called_once()
+    query = api.graphql.mock_calls[0][1][0]
+    assert sanitise_graphql_query(query).startswith(
+        sanitise_graphql_query('query($op0_app: UUID!, $op1_app: UUID!){'))
+    assert 'op0: allReleases(condition: {appUuid: $op0_app}' in query
+    assert 'op1: appByUuid(uuid: $op1_app)' in query
+    assert api.graphql.mock_calls[0][2] == {
+        'op0_app': 'my_uuid',
+        'op1_app': 'my_uuid',
+    }
+
+
+def test_batch_sends_single_queries_as_is(patch):
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api, 'graphql', return_value={
+        'data': {'allReleases': {'nodes': [{'id': 1, 'state': 'DEPLOYED'}]}}
+    })
+
+    with api.Batch() as batch:
+        release = api.Releases.get(app_name, batch=batch)
+
+    assert release.result == [{'id': 1, 'state': 'DEPLOYED'}]
+    assert 'allReleases(' in api.graphql.mock_calls[0][1][0]
+    assert api.graphql.mock_calls[0][2] == {'app': 'my_uuid'}
+
+
 def sanitise_graphql_query(query: str) -> str:
     query = query.strip()
     query = re.sub(r'[\s]{2,}', ' ', query)
     query = query.replace(' ', '_space_')
     query = query.replace('\n', '_new_line_')
     return query
+
+
+def test_releases_pages(patch):
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api, 'RELEASES_PAGE_SIZE', 2)
+
+    def page(ids, has_next_page, end_cursor):
+        return {'data': {'allReleases': {
+            'nodes': [{'id': i} for i in ids],
+            'pageInfo': {
+                'hasNextPage': has_next_page, 'endCursor': end_cursor
+            },
+        }}}
+
+    patch.object(api, 'graphql', side_effect=[
+        page([9, 8], True, 'c1'),
+        page([7, 6], True, 'c2'),
+        page([5], True, 'c3'),
+    ])
+
+    pages = list(api.Releases.pages(app_name, limit=5))
+
+    assert pages == [[{'id': 9}, {'id': 8}], [{'id': 7}, {'id': 6}],
+                     [{'id': 5}]]
+    assert [c[2] for c in api.graphql.mock_calls] == [
+        {'app': 'my_uuid', 'first': 2, 'cursor': None},
+        {'app': 'my_uuid', 'first': 2, 'cursor': 'c1'},
+        {'app': 'my_uuid', 'first': 1, 'cursor': 'c2'},
+    ]
+    query = api.graphql.mock_calls[0][1][0]
+    assert 'orderBy: ID_DESC' in query
+    assert 'filter' not in query
+
+
+@mark.parametrize('before,after,order,id_filter', [
+    (10, None, 'ID_DESC', {'lessThan': 10}),
+    (None, 3, 'ID_ASC', {'greaterThan': 3}),
+    (10, 3, 'ID_DESC', {'lessThan': 10, 'greaterThan': 3}),
+])
+def test_releases_pages_range(patch, before, after, order, id_filter):
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api, 'graphql', return_value={'data': {'allReleases': {
+        'nodes': [{'id': 5}],
+        'pageInfo': {'hasNextPage': False, 'endCursor': 'c1'},
+    }}})
+
+    assert api.Releases.list(app_name, 20, before=before, after=after) == [
+        {'id': 5}
+    ]
+
+    query = api.graphql.mock_calls[0][1][0]
+    assert f'orderBy: {order}' in query
+    assert 'filter: $filter' in query
+    assert api.graphql.mock_calls[0][2]['filter'] == {'id': id_filter}
+
+
+def test_releases_pages_all(patch):
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api, 'graphql', return_value={'data': {'allReleases': {
+        'nodes': [{'id': 5, 'config': {}}],
+        'pageInfo': {'hasNextPage': False, 'endCursor': 'c1'},
+    }}})
+
+    pages = api.Releases.pages(app_name, page_size=10, with_config=True)
+
+    assert list(pages) == [[{'id': 5, 'config': {}}]]
+    assert api.graphql.mock_calls[0][2]['first'] == 10
+    assert 'config' in api.graphql.mock_calls[0][1][0]
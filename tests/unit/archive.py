@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import json
+
+from pytest import fixture
+
+from story.archive import Archive, HOUR
+from story.helpers.logs import LogFilter
+
+
+def entry(ts, level='info', service_name='my_service', text='hello'):
+    log = {
+        'ts': ts,
+        'level': level,
+        'service_name': service_name,
+        'message': text,
+    }
+    return json.dumps(log), log, None
+
+
+@fixture
+def archive(tmpdir):
+    archive = Archive(path=str(tmpdir))
+    yield archive
+    archive.close()
+
+
+def texts(lines):
+    return [log['message'] for _, log in lines]
+
+
+def test_search(archive):
+    archive.add('app_id', 'runtime', [
+        entry(1000, text='started'),
+        entry(HOUR + 1000, level='error', text='failed to start'),
+        entry(2 * HOUR + 1000, text='started again'),
+    ])
+    archive.flush()
+
+    assert texts(archive.search('app_id', 'runtime', LogFilter())) == [
+        'started', 'failed to start', 'started again'
+    ]
+    assert texts(archive.search(
+        'app_id', 'runtime', LogFilter('start', since_ts=HOUR)
+    )) == ['failed to start', 'started again']
+    assert texts(archive.search(
+        'app_id', 'runtime', LogFilter(level='error')
+    )) == ['failed to start']
+    assert list(archive.search('app_id', 'service', LogFilter())) == []
+
+
+def test_search_only_reads_matching_partitions(archive, patch):
+    archive.add('app_id', 'service', [
+        entry(1000, service_name='a'),
+        entry(HOUR + 1000, service_name='b'),
+        entry(2 * HOUR + 1000, level='debug', service_name='a'),
+    ])
+    archive.flush()
+    patch.object(archive, '_read', wraps=archive._read)
+
+    lines = archive.search(
+        'app_id', 'service', LogFilter(level='info', service_name='a')
+    )
+
+    assert texts(lines) == ['hello']
+    archive._read.assert_called_once_with('app_id', 'service', 0)
+
+
+def test_add_skips_archived_lines(archive, tmpdir):
+    archive.add('app_id', 'runtime', [entry(1000), entry(2000, text='a')])
+    archive.close()
+
+    # Another fetch, which overlaps with the archive.
+    archive = Archive(path=str(tmpdir))
+    archive.add('app_id', 'runtime', [
+        entry(1000),
+        entry(2000, text='a'),
+        entry(2000, text='b'),
+        entry(3000),
+    ])
+    archive.flush()
+
+    assert texts(archive.search('app_id', 'runtime', LogFilter())) == [
+        'hello', 'a', 'b', 'hello'
+    ]
+    assert archive.latest_ts('app_id', 'runtime') == 3000
+
+
+def test_cursor_is_past_the_archive(archive):
+    archive.add('app_id', 'runtime', [entry(1000), entry(2000, text='a')])
+    archive.flush()
+
+    cursor = archive.cursor('app_id', 'runtime')
+    assert cursor.ts == 2000
+
+    fetched = [entry(1000), entry(2000, text='a'), entry(2000, text='b')]
+    assert [e[1]['message'] for e in fetched if cursor.advance(e[1])] == [
+        'b'
+    ]
+    assert cursor.gap is None
+
+
+def test_flushes_full_batches(archive, patch):
+    patch.object(archive, 'flush', wraps=archive.flush)
+    patch('story.archive.FLUSH_LINES', 2)
+
+    archive.add('app_id', 'runtime', [entry(1000)])
+    assert not archive.flush.called
+
+    archive.add('app_id', 'runtime', [entry(2000)])
+    assert archive.flush.called
+    assert archive._pending == {}
+
+
+def test_flush_adds_up_partition_stats(archive):
+    archive.add('app_id', 'runtime', [entry(2000), entry(3000)])
+    archive.flush()
+    archive.add('app_id', 'runtime', [entry(4000), entry(5000, 'error')])
+    archive.flush()
+
+    assert archive._db.execute(
+        'SELECT level, lines, min_ts, max_ts FROM partitions ORDER BY level'
+    ).fetchall() == [('error', 1, 5000, 5000), ('info', 3, 2000, 4000)]
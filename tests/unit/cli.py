@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import sys
+
+import raven
+
+from story import cli, support
+
+
+def test_get_sentry_is_lazy(patch):
+    patch.object(cli, 'sentry', None)
+    patch.object(cli, 'sentry_user', {'id': 'my_user_id'})
+    patch.object(raven, 'Client')
+
+    assert cli.get_sentry() is cli.get_sentry()
+
+    raven.Client.assert_called_once_with(
+        cli.SENTRY_DSN, install_sys_hook=False
+    )
+    raven.Client().user_context.assert_called_with({'id': 'my_user_id'})
+
+
+def test_report_exception(patch, magic):
+    patch.object(cli, 'get_sentry')
+    patch.object(sys, '__excepthook__')
+    exc_info = (ValueError, ValueError('oops'), None)
+
+    cli.report_exception(*exc_info)
+
+    cli.get_sentry().captureException.assert_called_with(
+        exc_info=exc_info, level='fatal'
+    )
+    sys.__excepthook__.assert_called_with(*exc_info)
+
+
+def test_startup_profile(patch, magic):
+    stderr = (
+        'import time: self [us] | cumulative | imported package\n'
+        'import time:      1000 |       1000 |   click.core\n'
+        'import time:       500 |       1500 | click\n'
+        'import time:      2000 |       2000 | story.cli\n'
+    )
+    patch.object(support.subprocess, 'run',
+                 return_value=magic(stderr=stderr.encode()))
+
+    assert support.startup_profile() == {'click': 0.0015, 'story': 0.002}
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from pytest import fixture
+
+from story import cli, compiler
+
+
+@fixture
+def project(runner, patch, init_sample_app_in_cwd, tmpdir):
+    """A sample project in the CWD, with a fresh compilation cache."""
+    patch.object(compiler, 'COMPILED_DIR', str(tmpdir))
+    patch.object(cli, 'use_cache', True)
+    patch.object(compiler, 'compile_story', side_effect=lambda story: {
+        'stories': {story: {'tree': story}},
+        'services': [f'service_{os.path.basename(story)}', 'shared'],
+        'version': 'v1',
+    })
+
+    with runner.runner.isolated_filesystem():
+        init_sample_app_in_cwd()
+        yield os.getcwd()
+
+
+def test_find_stories(project):
+    assert compiler.find_stories(project) == [
+        os.path.join('src', 'a.story'),
+        os.path.join('src', 'b', 'b.story'),
+    ]
+
+
+def test_compile_project(project):
+    tree = compiler.compile_project(project)
+
+    assert tree == {
+        'stories': {
+            os.path.join('src', 'a.story'): {
+                'tree': os.path.join('src', 'a.story')
+            },
+            os.path.join('src', 'b', 'b.story'): {
+                'tree': os.path.join('src', 'b', 'b.story')
+            },
+        },
+        'services': ['service_a.story', 'shared', 'service_b.story'],
+        'version': 'v1',
+    }
+    assert compiler.compile_story.call_count == 2
+
+
+def test_compile_project_unchanged(project):
+    tree = compiler.compile_project(project)
+
+    assert compiler.compile_project(project) == tree
+    assert compiler.compile_story.call_count == 2
+
+
+def test_compile_project_recompiles_changed_stories_only(project):
+    compiler.compile_project(project)
+
+    with open('src/a.story', 'a') as f:
+        f.write('c = 2\n')
+
+    compiler.compile_project(project)
+
+    assert compiler.compile_story.call_count == 3
+    compiler.compile_story.assert_called_with(os.path.join('src', 'a.story'))
+
+
+def test_compile_project_recompiles_importers_of_changed_stories(project):
+    with open('src/a.story', 'w') as f:
+        f.write("import 'b/b.story' as b\n")
+
+    compiler.compile_project(project)
+
+    with open('src/b/b.story', 'a') as f:
+        f.write('c = 2\n')
+
+    compiler.compile_project(project)
+
+    assert compiler.compile_story.call_count == 4
+
+
+def test_dependencies():
+    sources = {
+        'a.story': b"import 'lib/b.story' as b\n",
+        'lib/b.story': b'import "c.story" as c\nimport "x.story" as x\n',
+        'lib/c.story': b"import 'a.story' as a\n",
+        'd.story': b'd = 1\n',
+    }
+
+    assert compiler.dependencies('a.story', sources) == [
+        'a.story', 'lib/b.story', 'lib/c.story'
+    ]
+    assert compiler.dependencies('d.story', sources) == ['d.story']
+
+
+def test_compile_project_recompiles_on_story_yml_change(project):
+    compiler.compile_project(project)
+
+    with open('story.yml', 'a') as f:
+        f.write('foo: bar\n')
+
+    compiler.compile_project(project)
+
+    assert compiler.compile_story.call_count == 4
+
+
+def test_compile_project_without_cache(project, patch):
+    compiler.compile_project(project)
+
+    patch.object(cli, 'use_cache', False)
+    compiler.compile_project(project)
+
+    assert compiler.compile_story.call_count == 4
+
+
+def test_merge_is_deterministic():
+    bundles = [
+        {'stories': {'a': 1}, 'services': ['x', 'y'], 'entrypoint': ['a']},
+        {'stories': {'b': 2}, 'services': ['y', 'z'], 'entrypoint': ['b']},
+    ]
+
+    merged = compiler.merge(bundles)
+
+    assert merged == {
+        'stories': {'a': 1, 'b': 2},
+        'services': ['x', 'y', 'z'],
+        'entrypoint': ['a', 'b'],
+    }
+    assert json.dumps(merged) == json.dumps(compiler.merge(bundles))
+
+
+def test_compile_project_in_parallel(project, patch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Processes can't run the mocked compiler, threads can.
+    patch.object(compiler, 'ProcessPoolExecutor', new=ThreadPoolExecutor)
+
+    parallel = compiler.compile_project(project, jobs=4)
+
+    patch.object(cli, 'use_cache', False)
+    serial = compiler.compile_project(project, jobs=1)
+
+    assert json.dumps(parallel) == json.dumps(serial)
+    assert compiler.compile_story.call_count == 4
+
+
+def test_compile_stories_keeps_order(patch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    patch.object(compiler, 'ProcessPoolExecutor', new=ThreadPoolExecutor)
+    patch.object(compiler, 'compile_story', side_effect=lambda s: {s: s})
+
+    stories = [f'{i}.story' for i in range(20)]
+
+    assert compiler.compile_stories(stories, jobs=0) == [
+        {story: story} for story in stories
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import socket
+import sys
+
+from pytest import fixture
+
+from story import ensure, storage, utils
+
+
+@fixture()
+def cache(runner, patch):
+    with runner.runner.isolated_filesystem():
+        patch.object(storage, 'cache', storage.SQLiteStorage('cache.sqlite3'))
+        patch.object(utils, 'spawn_detached')
+        patch.object(ensure, 'story_version', '0.1.0')
+        yield storage.cache
+
+
+@fixture()
+def no_network(patch):
+    patch.object(socket.socket, 'connect', side_effect=AssertionError)
+    patch.object(ensure.http_session, 'get', side_effect=AssertionError)
+
+
+def test_ensure_latest_spawns_refresher(cache, no_network, capsys):
+    ensure.ensure_latest()
+    ensure.ensure_latest()
+
+    utils.spawn_detached.assert_called_once_with(
+        [sys.executable, '-m', 'story.ensure']
+    )
+    assert capsys.readouterr().err == ''
+
+
+def test_ensure_latest_warns_from_cache(cache, no_network, capsys):
+    cache.store('cli-latest', '0.2.0')
+    cache.store('cli-latest-checked', True, expires=60)
+
+    ensure.ensure_latest()
+
+    assert not utils.spawn_detached.called
+    assert 'A new release (v0.2.0)' in capsys.readouterr().err
+
+
+def test_refresh_latest(cache, patch, magic):
+    response = magic()
+    response.json.return_value = {'releases': {'0.1.0': [], '0.2.0': []}}
+    patch.object(ensure.http_session, 'get', return_value=response)
+
+    ensure.refresh_latest()
+
+    assert cache['cli-latest'] == '0.2.0'
+
+
+def test_refresh_latest_offline(cache, patch):
+    patch.object(ensure.http_session, 'get', side_effect=IOError)
+
+    ensure.refresh_latest()
+
+    assert 'cli-latest' not in cache
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import click
+
+from story import fanout
+
+
+def test_fan_out_is_bounded():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def work(item):
+        with lock:
+            running.append(item)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(item)
+
+    done = []
+    errors = fanout.fan_out(
+        work, list(range(20)), concurrency=3,
+        on_done=lambda item, error: done.append((item, error)),
+    )
+
+    assert errors == {}
+    assert max(peak) == 3
+    assert sorted(done) == [(i, None) for i in range(20)]
+
+
+def test_fan_out_aggregates_errors():
+    def work(item):
+        if item == 'bad':
+            raise ValueError('nope')
+        if item == 'exits':
+            click.get_current_context().exit(1)
+
+    with click.Context(click.Command('destroy')):
+        errors = fanout.fan_out(work, ['good', 'bad', 'exits'])
+
+    assert set(errors) == {'bad', 'exits'}
+    assert str(errors['bad']) == 'nope'
+    assert isinstance(errors['exits'], click.exceptions.Exit)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+import click
+
+from pytest import mark
+
+from story.helpers import logs
+
+
+def message(ts, level='info', service_name='my_service', text='hello'):
+    """Returns a log message, as sent by the log server."""
+    return json.dumps({
+        'ts': ts,
+        'level': level,
+        'service_name': service_name,
+        'message': text,
+    })
+
+
+def resumed_cursor(*messages):
+    """Returns a cursor past the messages, as after a reconnect."""
+    cursor = logs.LogCursor()
+    for log in logs.decode(list(messages)):
+        cursor.advance(log)
+
+    cursor.resume()
+    return cursor
+
+
+@mark.parametrize('level,colour', [
+    ('debug', 'blue'),
+    ('info', 'green'),
+    ('WARNING', 'yellow'),
+    ('critical', 'red'),
+    ('error', 'red'),
+])
+def test_styled_prefix(level, colour):
+    assert logs.styled_prefix(level, 'my_service') == (
+        f'{click.style(level.lower()[:7].rjust(7).upper(), fg=colour)} '
+        f'{click.style("  my_service", fg="blue")}: '
+    )
+
+
+def test_render():
+    writer = logs.LogWriter()
+    log = json.loads(message(1546300800000))
+    date = time.strftime(logs.DATE_FORMAT, time.localtime(1546300800))
+
+    assert writer.render(log) == (
+        f'{click.style(date, fg="white")} '
+        f'{logs.styled_prefix("info", "my_service")}hello\n'
+    )
+
+
+def test_render_caches_dates_and_prefixes(patch):
+    patch.object(time, 'strftime', wraps=time.strftime)
+    patch.object(logs, 'styled_prefix', wraps=logs.styled_prefix)
+    writer = logs.LogWriter(tag='runtime')
+
+    for ts in (1000, 1500, 1999, 2000):
+        writer.render(json.loads(message(ts)))
+
+    assert time.strftime.call_count == 2
+    assert logs.styled_prefix.call_count == 1
+
+
+def test_decode_falls_back_per_message():
+    assert logs.decode(['{"a": 1}', '{"b": 2}']) == [{'a': 1}, {'b': 2}]
+    assert logs.decode(['{"a": 1}']) == [{'a': 1}]
+
+
+@mark.asyncio
+async def test_feed_flushes_full_chunks(patch, capsys):
+    patch.object(logs, 'CHUNK_SIZE', 3)
+    renderer = logs.LogRenderer(
+        cursor=resumed_cursor(message(1000, text='line 1000'))
+    )
+
+    for ts in (1000, 2000, 3000):
+        renderer.feed(message(ts, text=f'line {ts}'))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(': ')[-1] for line in lines] == [
+        'line 2000', 'line 3000'
+    ]
+    assert renderer.cursor.ts == 3000
+
+
+@mark.asyncio
+async def test_feed_flushes_when_idle(capsys):
+    renderer = logs.LogRenderer()
+    renderer.feed(message(1000))
+
+    assert capsys.readouterr().out == ''
+
+    await asyncio.sleep(logs.FLUSH_INTERVAL * 2)
+
+    assert capsys.readouterr().out.endswith('my_service: hello\n')
+
+
+@mark.parametrize('output,expected', [
+    ('ndjson', [message(2000, text='second'), message(3000, text='third')]),
+    ('raw', ['second', 'third']),
+])
+def test_machine_outputs(patch, capsys, output, expected):
+    patch.object(time, 'strftime')
+    patch.object(click, 'style')
+    renderer = logs.LogRenderer(
+        output=output, cursor=resumed_cursor(message(1000, text='first'))
+    )
+
+    renderer._pending = [
+        message(1000, text='first'),
+        message(2000, text='second'),
+        message(3000, text='third'),
+    ]
+    renderer.flush()
+
+    assert capsys.readouterr().out.splitlines() == expected
+    assert not time.strftime.called
+    assert not click.style.called
+
+
+@mark.parametrize('output,expected', [
+    ('pretty', f'{click.style("   app", fg="magenta")} '
+               f'{logs.styled_prefix("info", "my_service")}hello\n'),
+    ('ndjson', json.dumps(dict(json.loads(message(1000)), app='app')) + '\n'),
+    ('raw', 'app: hello\n'),
+])
+def test_writer_tags_apps(output, expected):
+    writer = logs.LogWriter(output=output, app_width=6)
+    line = writer.line(message(1000), json.loads(message(1000)), 'app')
+
+    assert line.endswith(expected)
+
+
+def test_merger_orders_streams(patch, magic):
+    writer = magic()
+    merger = logs.LogMerger(writer, window=0.5)
+
+    def entries(app, *timestamps):
+        return [(None, {'ts': ts}, app) for ts in timestamps]
+
+    patch.object(asyncio, 'get_event_loop')
+    patch.object(time, 'monotonic', return_value=10)
+    merger.push(entries('a', 1000, 3000))
+    patch.object(time, 'monotonic', return_value=10.2)
+    merger.push(entries('b', 2000, 4000))
+
+    # Nothing's been held back for long enough yet.
+    merger.release()
+    assert writer.write.call_args[0][0] == []
+
+    patch.object(time, 'monotonic', return_value=10.6)
+    merger.release()
+    assert writer.write.call_args[0][0] == entries('a', 1000)
+
+    merger.drain()
+    assert writer.write.call_args[0][0] == (
+        entries('b', 2000) + entries('a', 3000) + entries('b', 4000)
+    )
+
+
+@mark.asyncio
+async def test_merger_releases_on_its_own(capsys):
+    merger = logs.LogMerger(logs.LogWriter(output='raw'), window=0.05)
+
+    for app, ts in (('b', 2000), ('a', 1000)):
+        renderer = logs.LogRenderer(app=app, sink=merger.push)
+        renderer.feed(message(ts, text=str(ts)))
+        renderer.flush()
+
+    await asyncio.sleep(0.1)
+
+    assert capsys.readouterr().out == 'a: 1000\nb: 2000\n'
+
+
+def test_cursor_skips_lines_seen_before_reconnecting():
+    cursor = resumed_cursor(
+        message(1000, text='a'),
+        message(2000, text='b'),
+        message(2000, text='dup'),
+        message(2000, text='dup'),
+    )
+
+    replayed = logs.decode([
+        message(1000, text='a'),
+        message(2000, text='b'),
+        message(2000, text='dup'),
+        message(2000, text='dup'),
+        # Identical, but sent after the connection was lost.
+        message(2000, text='dup'),
+        message(2000, text='c'),
+        message(3000, text='d'),
+    ])
+
+    assert [log['message'] for log in replayed if cursor.advance(log)] == [
+        'dup', 'c', 'd'
+    ]
+    assert cursor.gap is None
+    assert cursor.ts == 3000
+
+
+def test_cursor_detects_gaps():
+    cursor = resumed_cursor(message(1000))
+
+    assert cursor.advance(json.loads(message(5000)))
+    assert cursor.gap == (1000, 5000)
+
+
+def test_renderer_reports_gaps(capsys):
+    renderer = logs.LogRenderer(
+        output='raw', app='my_app', cursor=resumed_cursor(message(1000))
+    )
+
+    renderer._pending = [message(5000, text='later')]
+    renderer.flush()
+
+    out, err = capsys.readouterr()
+    assert out == 'my_app: later\n'
+    assert err.startswith('Some logs of my_app may be missing, between ')
+    assert renderer.cursor.gap is None
+
+
+@mark.parametrize('log_filter,expected', [
+    (logs.LogFilter(), ['a', 'b', 'c']),
+    (logs.LogFilter('^[ab]$'), ['a', 'b']),
+    (logs.LogFilter(since_ts=2000, until_ts=2000), ['b']),
+    (logs.LogFilter(level='warning'), ['c']),
+    (logs.LogFilter(service_name='other'), ['b']),
+])
+def test_filter(log_filter, expected):
+    lines = logs.decode([
+        message(1000, level='debug', text='a'),
+        message(2000, service_name='other', text='b'),
+        message(3000, level='critical', text='c'),
+    ])
+
+    assert [log['message'] for log in lines if log_filter.match(log)] == (
+        expected
+    )
+
+
+def test_renderer_filters_before_rendering(patch, capsys):
+    renderer = logs.LogRenderer(
+        output='raw', log_filter=logs.LogFilter('^keep', exclude='not')
+    )
+    patch.object(renderer.cursor, 'advance', wraps=renderer.cursor.advance)
+
+    renderer._pending = [
+        message(1000, text='keep me'),
+        message(2000, text='drop me'),
+        message(3000, text='keep me not'),
+    ]
+    renderer.flush()
+
+    assert capsys.readouterr().out == 'keep me\n'
+    assert renderer.cursor.advance.call_count == 3
+    assert renderer.cursor.ts == 3000
+
+
+def throttled(throttle, *texts):
+    """Pushes lines with the texts, and returns the messages passed on."""
+    throttle.sink.reset_mock()
+    throttle.push([
+        (None, json.loads(message(1000, text=text)), None) for text in texts
+    ])
+
+    return [
+        log['message']
+        for call in throttle.sink.mock_calls
+        for _, log, _ in call[1][0]
+    ]
+
+
+def test_throttle_collapses_repeats(patch, magic):
+    patch.object(asyncio, 'get_event_loop')
+    throttle = logs.LogThrottle(magic())
+
+    assert throttled(throttle, 'a', 'a', 'a', 'b', 'b') == [
+        'a', 'last message repeated 2 times', 'b'
+    ]
+
+    # The count of a run which is still going is reported in a while.
+    call_later = asyncio.get_event_loop.return_value.call_later
+    call_later.assert_called_once_with(
+        logs.REPORT_INTERVAL, throttle.report
+    )
+
+    throttle.sink.reset_mock()
+    throttle.report()
+    assert throttle.sink.call_args[0][0][0][1]['message'] == (
+        'last message repeated 1 times'
+    )
+
+
+def test_throttle_samples(patch, magic):
+    patch.object(asyncio, 'get_event_loop')
+    throttle = logs.LogThrottle(magic(), sample=3, collapse=False)
+
+    assert throttled(throttle, *'abcdefg') == ['a', 'd', 'g']
+
+
+def test_throttle_limits_the_rate(patch, magic):
+    patch.object(asyncio, 'get_event_loop')
+    patch.object(time, 'monotonic', return_value=100)
+    throttle = logs.LogThrottle(magic(), max_rate=2)
+
+    assert throttled(throttle, *'abcde') == ['a', 'b']
+
+    patch.object(time, 'monotonic', return_value=100.5)
+    assert throttled(throttle, *'fgh') == ['f']
+
+    throttle.sink.reset_mock()
+    throttle.drain()
+    notice = throttle.sink.call_args[0][0][0][1]
+    assert notice['message'] == '5 lines skipped (over 2 lines/s)'
+    assert notice['service_name'] == 'my_service'
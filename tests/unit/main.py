@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import importlib
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+import pytest
+
+from story import cli
+from story.commands import COMMANDS, HIDDEN_COMMANDS
+
+
+def test_main_does_not_import_commands():
+    modules = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, story.main; print("\\n".join(sys.modules))',
+    ]).decode().split()
+
+    for module in ('story.commands.apps', 'story.commands.logs',
+                   'emoji', 'websockets', 'blindspin', 'click_spinner',
+                   'raven'):
+        assert module not in modules
+
+
+@pytest.mark.parametrize('name', sorted(COMMANDS))
+def test_manifest_matches_command(name):
+    importlib.import_module(f'story.commands.{name}')
+    command = cli.cli.commands[name]
+
+    assert command.get_short_help_str(1000) == COMMANDS[name]
+    assert command.hidden == (name in HIDDEN_COMMANDS)
+
+
+def test_get_command_imports_module(magic, patch):
+    patch.object(cli.cli, 'commands', {})
+    patch.dict(sys.modules)
+    sys.modules.pop('story.commands.feedback', None)
+    ctx = magic()
+
+    command = cli.cli.get_command(ctx, 'feedback')
+
+    assert command.name == 'feedback'
+    assert cli.cli.get_command(ctx, 'nope') is None
+
+
+def test_help_lists_manifest(patch):
+    patch.object(cli.cli, 'commands', {})
+
+    result = CliRunner().invoke(cli.cli, ['--help'])
+
+    assert 'apps ' in result.output
+    assert 'Create, list, and manage apps on' in result.output
+    assert 'status' not in result.output
+    assert cli.cli.commands == {}
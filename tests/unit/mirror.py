@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from pytest import fixture
+
+from story import api, cli, mirror as mirror_
+from story.mirror import ReleaseMirror, config_hash
+
+
+def release(id, state='DEPLOYED'):
+    return {
+        'id': id,
+        'state': state,
+        'timestamp': f'date_{id}',
+        'message': f'message_{id}',
+        'config': {'version': id},
+    }
+
+
+class Server:
+    """Serves Releases.pages() from a list of releases, and counts queries."""
+
+    def __init__(self, count):
+        self.releases = {id: release(id) for id in range(1, count + 1)}
+        self.queries = []
+
+    def pages(self, app, limit=None, before=None, after=None,
+              page_size=api.RELEASES_PAGE_SIZE, with_config=False):
+        assert with_config
+        ids = sorted(
+            id for id in self.releases
+            if (before is None or id < before)
+            and (after is None or id > after)
+        )
+        if after is None or before is not None:
+            ids.reverse()
+        if limit is not None:
+            ids = ids[:limit]
+
+        for i in range(0, max(len(ids), 1), page_size):
+            self.queries.append({
+                'limit': limit,
+                'before': before,
+                'after': after,
+                'page_size': page_size,
+            })
+            yield [self.releases[id] for id in ids[i:i + page_size]]
+
+
+@fixture
+def server(patch):
+    server = Server(250)
+    patch.object(cli, 'use_cache', True)
+    patch.object(api.Apps, 'get_uuid_from_hostname', return_value='my_uuid')
+    patch.object(api.Releases, 'pages', new=server.pages)
+    return server
+
+
+@fixture
+def mirror(tmpdir):
+    path = str(tmpdir.join('releases.sqlite3'))
+
+    def mirror():
+        # A mirror per command, as the CLI uses it.
+        return ReleaseMirror(path=path)
+
+    return mirror
+
+
+def ids(releases):
+    return [release['id'] for release in releases]
+
+
+def queried(server, mirror, **kwargs):
+    """Returns the ids of the releases asked for, and the queries sent."""
+    server.queries.clear()
+    releases = mirror().releases('my_app', **kwargs)
+    return ids(releases), server.queries[:]
+
+
+def test_config_hash():
+    assert config_hash({'a': 1, 'b': 2}) == config_hash({'b': 2, 'a': 1})
+    assert config_hash(None) == config_hash({})
+    assert config_hash({'a': 1}) != config_hash({'a': 2})
+
+
+def test_first_request_only_fetches_what_it_shows(server, mirror):
+    assert queried(server, mirror, limit=3) == ([248, 249, 250], [
+        {'limit': 3, 'before': None, 'after': None,
+         'page_size': api.RELEASES_PAGE_SIZE},
+    ])
+    assert mirror().coverage('my_uuid') == (248, 250)
+
+
+def test_later_requests_only_fetch_new_releases(server, mirror):
+    queried(server, mirror, limit=3)
+
+    # One small query, which finds nothing new.
+    assert queried(server, mirror, limit=3) == ([248, 249, 250], [
+        {'limit': None, 'before': None, 'after': None,
+         'page_size': mirror_.SYNC_PAGE_SIZE},
+    ])
+
+    server.releases[251] = release(251)
+    server.releases[252] = release(252)
+    releases, queries = queried(server, mirror, limit=3)
+    assert releases == [250, 251, 252]
+    assert len(queries) == 1
+    assert mirror().coverage('my_uuid') == (248, 252)
+
+
+def test_older_releases_are_fetched_on_demand(server, mirror):
+    queried(server, mirror, limit=3)
+
+    releases, queries = queried(server, mirror, limit=5)
+    assert releases == [246, 247, 248, 249, 250]
+    assert queries[1:] == [
+        {'limit': 2, 'before': 248, 'after': None,
+         'page_size': api.RELEASES_PAGE_SIZE},
+    ]
+    assert mirror().coverage('my_uuid') == (246, 250)
+
+    # Within what's mirrored.
+    releases, queries = queried(server, mirror, limit=2, before=249)
+    assert (releases, len(queries)) == ([247, 248], 1)
+    releases, queries = queried(server, mirror, limit=2, after=246)
+    assert (releases, len(queries)) == ([247, 248], 1)
+
+
+def test_releases_far_below_the_mirror_are_fetched(server, mirror):
+    queried(server, mirror, limit=3)
+
+    releases, queries = queried(server, mirror, limit=2, before=10)
+    assert releases == [8, 9]
+    assert queries[1]['before'] == 10
+    assert mirror().coverage('my_uuid') == (248, 250)
+
+    releases, queries = queried(server, mirror, limit=2, after=10)
+    assert releases == [11, 12]
+    assert mirror().coverage('my_uuid') == (248, 250)
+
+    # Unless they reach it.
+    releases, _ = queried(server, mirror, after=240)
+    assert releases == list(range(241, 251))
+    assert mirror().coverage('my_uuid') == (241, 250)
+
+
+def test_the_whole_history(server, mirror):
+    server.releases = {id: release(id) for id in range(1, 4)}
+
+    assert queried(server, mirror, limit=20)[0] == [1, 2, 3]
+    assert mirror().coverage('my_uuid') == (0, 3)
+
+    releases, queries = queried(server, mirror, limit=2, before=2)
+    assert (releases, len(queries)) == ([1], 1)
+
+
+def test_pending_releases_are_refreshed(server, mirror):
+    server.releases[250] = release(250, state='QUEUED')
+    server.releases[249] = release(249, state='DEPLOYING')
+    queried(server, mirror, limit=3)
+    assert mirror().settled_id('my_uuid') == 248
+
+    server.releases[250] = release(250, state='FAILED')
+    server.releases[249] = release(249)
+    releases = mirror().releases('my_app', limit=3)
+
+    assert [r['state'] for r in releases] == ['DEPLOYED', 'DEPLOYED', 'FAILED']
+    assert mirror().settled_id('my_uuid') == 250
+
+
+def test_no_cache_fetches_again(server, mirror, patch):
+    queried(server, mirror, limit=3)
+
+    patch.object(cli, 'use_cache', False)
+    server.releases[248] = release(248, state='TERMINATED')
+
+    releases, queries = queried(server, mirror, limit=2)
+    assert releases == [249, 250]
+    assert queries[0]['limit'] == 2
+    assert mirror().coverage('my_uuid') == (249, 250)
+
+
+def test_app_without_releases(server, mirror):
+    server.releases = {}
+
+    assert queried(server, mirror, limit=20)[0] == []
+    assert mirror().coverage('my_uuid') == (0, 0)
+
+    server.releases[1] = release(1)
+    assert queried(server, mirror, limit=20)[0] == [1]
+
+
+def test_get_and_latest(server, mirror):
+    assert mirror().latest('my_app')['id'] == 250
+
+    server.queries.clear()
+    assert mirror().get('my_app', 250)['config_hash'] == config_hash(
+        {'version': 250}
+    )
+    assert len(server.queries) == 1
+
+    assert mirror().get('my_app', 12)['id'] == 12
+    assert mirror().get('my_app', 251) is None
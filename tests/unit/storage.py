@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import json
+import multiprocessing
+import os
+import threading
+
+from pytest import fixture
+
+from story import storage, utils
+
+
+@fixture()
+def cache(runner):
+    with runner.runner.isolated_filesystem():
+        yield storage.Storage('cache.json')
+
+
+def test_store_and_fetch(cache):
+    cache.store('key', 'value')
+
+    assert 'key' in cache
+    assert cache.fetch('key') == 'value'
+    assert storage.Storage(cache.path)['key'] == 'value'
+
+
+def test_evicts_expired_keys(cache):
+    cache.store('fresh', 'value', expires=60)
+    cache.store('stale', 'value', expires=-1)
+
+    reloaded = storage.Storage(cache.path)
+
+    assert 'fresh' in reloaded
+    assert 'stale' not in reloaded
+    assert '_stale_expires' not in reloaded
+
+
+def test_store_without_expiry_clears_expiry(cache):
+    cache.store('key', 'old', expires=-1)
+    cache.store('key', 'new')
+
+    assert storage.Storage(cache.path).fetch('key') == 'new'
+
+
+def test_transaction_writes_once(cache, patch):
+    patch.object(utils, 'write_atomic', wraps=utils.write_atomic)
+
+    with cache.transaction():
+        for i in range(10):
+            cache.store(f'key_{i}', i)
+        cache.delete('key_0')
+
+        assert storage.Storage(cache.path).as_dict() == {}
+
+    assert utils.write_atomic.call_count == 1
+    assert storage.Storage(cache.path).as_dict() == {
+        f'key_{i}': i for i in range(1, 10)
+    }
+
+
+def test_copy_from_writes_once(cache, patch):
+    with open('old.json', 'w') as f:
+        json.dump({f'key_{i}': i for i in range(10)}, f)
+
+    patch.object(utils, 'write_atomic', wraps=utils.write_atomic)
+
+    cache.copy_from('old.json', delete=True)
+
+    assert utils.write_atomic.call_count == 1
+    assert storage.Storage(cache.path)['key_9'] == 9
+    assert not os.path.exists('old.json')
+
+
+def test_concurrent_writers_do_not_lose_changes(cache):
+    other = storage.Storage(cache.path)
+
+    cache.store('mine', 1)
+    other.store('theirs', 2)
+    other.delete('theirs')
+    other.store('also_theirs', 3)
+
+    assert storage.Storage(cache.path).as_dict() == {
+        'mine': 1,
+        'also_theirs': 3,
+    }
+
+
+def test_concurrent_processes(cache):
+    def write(i):
+        s = storage.Storage(cache.path)
+        for j in range(20):
+            s.store(f'key_{i}_{j}', j)
+
+    processes = [
+        multiprocessing.Process(target=write, args=(i,)) for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert len(storage.Storage(cache.path).as_dict()) == 4 * 20
+
+
+@fixture()
+def sqlite_cache(runner):
+    with runner.runner.isolated_filesystem():
+        yield storage.SQLiteStorage('cache.sqlite3')
+
+
+def test_sqlite_store_and_fetch(sqlite_cache):
+    sqlite_cache.store('key', {'nested': [1, 2]})
+    sqlite_cache.store('gone', 'value')
+    sqlite_cache.delete('gone')
+
+    reloaded = storage.SQLiteStorage(sqlite_cache.path)
+
+    assert reloaded['key'] == {'nested': [1, 2]}
+    assert 'gone' not in reloaded
+    assert reloaded.fetch('gone', 'default') == 'default'
+
+
+def test_sqlite_expires_keys(sqlite_cache):
+    sqlite_cache.store('fresh', 'value', expires=60)
+    sqlite_cache.store('stale', 'value', expires=-1)
+
+    assert 'stale' not in sqlite_cache
+    assert storage.SQLiteStorage(sqlite_cache.path).as_dict() == {
+        'fresh': 'value'
+    }
+
+    # Expired rows are swept when the store is opened.
+    rows = sqlite_cache._db.execute('SELECT key FROM cache').fetchall()
+    assert rows == [('fresh',)]
+
+
+def test_sqlite_transaction_is_buffered(sqlite_cache):
+    with sqlite_cache.transaction():
+        for i in range(10):
+            sqlite_cache.store(f'key_{i}', i)
+        sqlite_cache.delete('key_0')
+
+        assert 'key_1' in sqlite_cache
+        assert storage.SQLiteStorage(sqlite_cache.path).as_dict() == {}
+
+    assert storage.SQLiteStorage(sqlite_cache.path).as_dict() == {
+        f'key_{i}': i for i in range(1, 10)
+    }
+
+
+def test_sqlite_evicts_least_recently_used(sqlite_cache, patch):
+    sqlite_cache.max_entries = 3
+    patch.object(storage, 'time', side_effect=range(100, 200))
+
+    for key in ('a', 'b', 'c'):
+        sqlite_cache.store(key, key)
+
+    sqlite_cache.fetch('a')
+    sqlite_cache.store('d', 'd')
+
+    assert sorted(sqlite_cache.as_dict()) == ['a', 'c', 'd']
+
+
+def test_sqlite_copy_from_keeps_expiry(sqlite_cache, patch):
+    patch.object(storage, 'time', return_value=1000)
+    with open('cache.json', 'w') as f:
+        json.dump({
+            'forever': 1,
+            'fresh': 2,
+            '_fresh_expires': 1060,
+            'stale': 3,
+            '_stale_expires': 900,
+        }, f)
+
+    sqlite_cache.copy_from('cache.json', delete=True)
+
+    assert sqlite_cache.as_dict() == {'forever': 1, 'fresh': 2}
+    assert sqlite_cache._row('fresh') == (2, 1060)
+    assert not os.path.exists('cache.json')
+
+
+def test_sqlite_concurrent_processes(sqlite_cache):
+    def write(i):
+        s = storage.SQLiteStorage(sqlite_cache.path)
+        for j in range(20):
+            s.store(f'key_{i}_{j}', j)
+
+    processes = [
+        multiprocessing.Process(target=write, args=(i,)) for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert len(sqlite_cache.as_dict()) == 4 * 20
+
+
+def test_sqlite_storage_is_shared_by_threads(sqlite_cache):
+    values = {}
+
+    def work(i):
+        sqlite_cache.store(f'key-{i}', i)
+        values[i] = sqlite_cache.fetch(f'key-{i}')
+        sqlite_cache.delete(f'key-{i}')
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert values == {i: i for i in range(20)}
+    assert sqlite_cache.as_dict() == {}
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pytest import fixture, mark, raises
+
+import requests
+
+from story import transport
+
+
+@fixture
+def api_server(patch):
+    """
+    A stand-in API server, which echoes back the JSON it's sent, if it can
+    decode the body, and answers 415 (with the encodings it accepts)
+    otherwise.
+    """
+    patch.object(transport, '_encodings', {})
+    patch.object(transport, 'uploads', [])
+    patch.object(transport.storage, 'cache', None)
+    servers = []
+
+    def start(accepted_encodings):
+        received = []
+        decoders = {
+            'identity': lambda body: body,
+            'gzip': gzip.decompress,
+            'deflate': zlib.decompress,
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):  # noqa: N802
+                encoding = self.headers.get('Content-Encoding', 'identity')
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                received.append(encoding)
+
+                if encoding not in accepted_encodings:
+                    self.send_response(415)
+                    self.send_header('Accept-Encoding',
+                                     ', '.join(accepted_encodings))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                response = decoders[encoding](body)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('localhost', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        return f'http://localhost:{server.server_port}', received
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@fixture()
+def session_post(patch, magic):
+    patch.object(time, 'sleep')
+    patch.object(transport, 'timings', [])
+    patch.object(transport.session, 'post')
+    return transport.session.post
+
+
+def response(status_code):
+    res = requests.Response()
+    res.status_code = status_code
+    return res
+
+
+@mark.parametrize('idempotent', [True, False])
+def test_post_retries_idempotent_requests(session_post, idempotent):
+    ok = response(200)
+    session_post.side_effect = [
+        requests.ConnectionError(), response(503), ok
+    ]
+
+    if idempotent:
+        assert transport.post('url', idempotent=True, data='d') is ok
+        assert session_post.call_count == 3
+        assert [c[1][0] for c in time.sleep.mock_calls] == [0.25, 0.5]
+    else:
+        with raises(requests.ConnectionError):
+            transport.post('url', data='d')
+        assert session_post.call_count == 1
+        time.sleep.assert_not_called()
+
+    session_post.assert_called_with('url', data=b'd', headers=None)
+
+
+def test_post_gives_up_after_retries(session_post):
+    session_post.side_effect = [response(502)] * (transport.RETRIES + 1)
+
+    res = transport.post('url', idempotent=True)
+
+    assert res.status_code == 502
+    assert session_post.call_count == transport.RETRIES + 1
+
+
+def test_post_records_timings(session_post):
+    session_post.return_value = response(200)
+
+    transport.post('url')
+
+    assert len(transport.timings) == 1
+    method, url, status, elapsed = transport.timings[0]
+    assert (method, url, status) == ('POST', 'url', 200)
+    assert elapsed >= 0
+
+
+def test_connection_stats(patch, magic):
+    pool = magic(num_requests=5, num_connections=2)
+    adapter = magic()
+    adapter.poolmanager.pools.keys.return_value = ['key']
+    adapter.poolmanager.pools.__getitem__.return_value = pool
+    patch.object(transport.session, 'adapters', {'https://': adapter})
+
+    assert transport.connection_stats() == (5, 2)
+
+
+@mark.parametrize('accepted,expected', [
+    (['identity', 'gzip'], ['gzip']),
+    (['identity', 'deflate'], ['gzip', 'deflate']),
+    (['identity'], ['gzip', 'identity']),
+])
+def test_post_compresses_large_bodies(api_server, accepted, expected):
+    url, received = api_server(accepted)
+    payload = json.dumps({'stories': ['a = 1'] * 10000})
+
+    res = transport.post(url, data=payload)
+
+    assert res.json() == json.loads(payload)
+    assert received == expected
+
+    # The accepted encoding is remembered, and used straight away.
+    transport.post(url, data=payload)
+    assert received[len(expected):] == expected[-1:]
+
+    size, sent, encoding = transport.uploads[-1][1:]
+    assert size == len(payload)
+    assert encoding == expected[-1]
+    if encoding != 'identity':
+        assert sent < size / 10
+
+
+def test_post_does_not_compress_small_bodies(api_server):
+    url, received = api_server(['identity', 'gzip'])
+
+    assert transport.post(url, data='{"small": true}').json() == {
+        'small': True
+    }
+    assert received == ['identity']